@@ -1,15 +1,22 @@
 import azure.functions as func
+import asyncio
 import logging
-import json
 import os
 from datetime import datetime
-from datetime import datetime
+from bson.objectid import ObjectId
 from shared.auth import authenticate_request
-from shared.clients import get_openai_client, get_mongo_db
-from shared.rag import perform_vector_search
+from shared.clients import get_async_mongo_db
+from shared.rag import generate_embedding_async, vector_search_async
+from shared.llm import chat_completion_async, fallback_deployments, with_deadline, DeadlineExceeded, INTERACTIVE
+from shared.telemetry import instrument, span, set_attribute
+from shared import write_behind, chat_history
+from shared.responses import json_response, cursor_response_async, etag_for, not_modified
+from shared.projections import CHAT_PROJECTION
 
+@instrument("api_chat")
+@with_deadline("api_chat")
 @authenticate_request
-def main(req: func.HttpRequest) -> func.HttpResponse:
+async def main(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Python HTTP trigger function processed a chat request.')
     
     uid = req.user['uid']
@@ -20,19 +27,34 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
         if not project_id:
             return func.HttpResponse("projectId is required", status_code=400)
         
-        db = get_mongo_db()
-        # Verify ownership (optional but good practice, though history is filtered by userId anyway)
-        # But we want to ensure user has access to project history
-        
-        history = list(db.chat_history.find({"projectId": project_id, "userId": uid}).sort("timestamp", 1))
-        for h in history:
-            h['_id'] = str(h['_id'])
-            
-        return func.HttpResponse(
-            json.dumps(history),
-            mimetype="application/json",
-            status_code=200
-        )
+        if not ObjectId.is_valid(project_id):
+            return func.HttpResponse("Invalid Project ID format", status_code=400)
+
+        # `before`: the page of messages older than that one (the "load earlier" control)
+        before = req.params.get('before')
+        if before and not ObjectId.is_valid(before):
+            return func.HttpResponse("Invalid message ID format", status_code=400)
+
+        db = get_async_mongo_db()
+        # Verify ownership, reading the chatVersion the history's ETag is derived from
+        project = await db.projects.find_one({"_id": ObjectId(project_id), "ownerId": uid}, {"chatVersion": 1})
+        if not project:
+            return func.HttpResponse("Project not found", status_code=404)
+
+        etag_parts = ["chat", project_id, uid, project.get("chatVersion", 0)]
+        if before:
+            etag_parts += [before, chat_history.page_size()]
+        etag = etag_for(*etag_parts)
+        cached = not_modified(req, etag)
+        if cached:
+            return cached
+        if before:
+            page = await chat_history.page_async(db, uid, project_id, before=before)
+            if page is None:
+                return func.HttpResponse("Message not found", status_code=404)
+            return json_response(page, req=req, etag=etag)
+        history = db.chat_history.find({"projectId": project_id, "userId": uid}, CHAT_PROJECTION).sort("timestamp", 1)
+        return await cursor_response_async(history, req=req, etag=etag)
 
     # 3. Handle DELETE (Clear History)
     if req.method == 'DELETE':
@@ -40,14 +62,12 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
         if not project_id:
             return func.HttpResponse("projectId is required", status_code=400)
         
-        db = get_mongo_db()
-        result = db.chat_history.delete_many({"projectId": project_id, "userId": uid})
+        db = get_async_mongo_db()
+        result = await db.chat_history.delete_many({"projectId": project_id, "userId": uid})
+        if result.deleted_count and ObjectId.is_valid(project_id):
+            await db.projects.update_one({"_id": ObjectId(project_id)}, {"$inc": {"chatVersion": 1}})
         
-        return func.HttpResponse(
-            json.dumps({"message": "Chat history cleared", "deletedCount": result.deleted_count}),
-            mimetype="application/json",
-            status_code=200
-        )
+        return json_response({"message": "Chat history cleared", "deletedCount": result.deleted_count})
 
     # 3. Parse Body (POST)
     try:
@@ -57,35 +77,43 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
     
     project_id = req_body.get('projectId')
     message = req_body.get('message')
+    set_attribute("projectId", project_id)
     
     if not project_id or not message:
         return func.HttpResponse("projectId and message are required", status_code=400)
 
-    # 3. Verify Project Ownership
-    db = get_mongo_db()
-    project = db.projects.find_one({"_id": project_id}) # Assuming _id is stored as ObjectId or String. In api_projects we stored as ObjectId but returned as str.
-    # If we stored as ObjectId, we need to convert string to ObjectId.
-    # Let's check api_projects. It inserts using insert_one, so it's ObjectId.
-    # We need to import ObjectId.
-    from bson.objectid import ObjectId
+    # 3. Validate Project ID (projects are inserted with ObjectId _ids)
     try:
-        project = db.projects.find_one({"_id": ObjectId(project_id), "ownerId": uid})
+        project_oid = ObjectId(project_id)
     except:
         return func.HttpResponse("Invalid Project ID format", status_code=400)
 
-    if not project:
-        return func.HttpResponse("Project not found or access denied", status_code=404)
-
     # 4. Guardrails (Input)
     # Basic check for malicious intent or jailbreaks
     malicious_keywords = ["ignore instructions", "system prompt", "you are not"]
     if any(keyword in message.lower() for keyword in malicious_keywords):
          return func.HttpResponse("I cannot answer that request.", status_code=400)
 
-    # 5. RAG - Generate Embedding
-    # 5. RAG - Vector Search (Shared Logic)
+    # 5. Verify Project Ownership and RAG - Generate Embedding
+    # Both are independent network waits, so they run concurrently.
+    db = get_async_mongo_db()
+    project, query_vector = await asyncio.gather(
+        db.projects.find_one({"_id": project_oid, "ownerId": uid}),
+        generate_embedding_async(message),
+        return_exceptions=True
+    )
+
+    if isinstance(project, Exception):
+        logging.error(f"Error verifying project ownership: {project}")
+        return func.HttpResponse("Error verifying project", status_code=500)
+    if not project:
+        return func.HttpResponse("Project not found or access denied", status_code=404)
+
+    # 6. RAG - Vector Search (Shared Logic)
     try:
-        results = perform_vector_search(project_id, message)
+        if isinstance(query_vector, Exception):
+            raise query_vector
+        results = await vector_search_async(project_id, query_vector)
         
         if not results:
              logging.info("Vector search returned no results.")
@@ -119,12 +147,19 @@ Guidelines:
          chat_deployment = "gpt-4o-mini" # Example
 
     try:
-        completion = openai_client.chat.completions.create(
-            model=chat_deployment,
-            messages=messages,
-            temperature=0.7
-        )
+        with span("llm.chat_completion", deployment=chat_deployment):
+            completion = await chat_completion_async(
+                lane=INTERACTIVE,
+                hedge=True,
+                fallbacks=fallback_deployments(),
+                model=chat_deployment,
+                messages=messages,
+                temperature=0.7
+            )
         answer = completion.choices[0].message.content
+    except DeadlineExceeded as e:
+        logging.error(f"Chat response timed out: {e}")
+        return func.HttpResponse("Timed out generating response", status_code=504)
     except Exception as e:
         logging.error(f"Error generating chat response: {e}")
         return func.HttpResponse("Error generating response", status_code=500)
@@ -137,10 +172,8 @@ Guidelines:
         "answer": answer,
         "timestamp": datetime.utcnow().isoformat()
     }
-    db.chat_history.insert_one(chat_entry)
+    # Off the critical path with WRITE_BEHIND; the chatVersion moves once the entry is stored
+    await write_behind.insert(db, "chat_history", chat_entry,
+                              follow_up=("projects", {"_id": project_oid}, {"$inc": {"chatVersion": 1}}))
 
-    return func.HttpResponse(
-        json.dumps({"answer": answer}),
-        mimetype="application/json",
-        status_code=200
-    )
+    return json_response({"answer": answer})
@@ -5,7 +5,13 @@ import os
 from bson.objectid import ObjectId
 from shared.auth import authenticate_request
 from shared.clients import get_mongo_db, get_blob_service_client
+from shared.telemetry import instrument
+from shared import ingestion_state, storage_usage, chunk_store
+from shared.topic_map import TopicMapUpdate, topic_summary
+from shared.responses import json_response, cursor_response, etag_for, not_modified
+from shared.projections import DOCUMENT_PROJECTION
 
+@instrument("api_documents")
 @authenticate_request
 def main(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Python HTTP trigger function processed a documents request.')
@@ -14,26 +20,46 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
     method = req.method
     db = get_mongo_db()
 
-    if method == 'GET':
+    if method == 'GET' and req.route_params.get('action') == 'status':
+        # Cheap ingestion progress poll: per-document status only, no summaries
+        project_id = req.params.get('projectId')
+        if not project_id:
+            return func.HttpResponse("projectId is required", status_code=400)
+
+        status = ingestion_state.project_status(db, project_id, uid)
+        if not status:
+            return func.HttpResponse("Project not found", status_code=404)
+
+        return json_response(status)
+
+    elif method == 'GET' and req.route_params.get('action') == 'topics':
+        # Topics of the project's documents, from the topic map built at ingestion
+        project_id = req.params.get('projectId')
+        if not project_id:
+            return func.HttpResponse("projectId is required", status_code=400)
+
+        project = db.projects.find_one({"_id": ObjectId(project_id), "ownerId": uid}, {"_id": 1})
+        if not project:
+            return func.HttpResponse("Project not found", status_code=404)
+
+        topic_map = db.topic_maps.find_one({"_id": project_id}, {"clusters.mean": 0})
+        return json_response({"topics": topic_summary(topic_map)}, req=req)
+
+    elif method == 'GET':
         # List documents for a project
         project_id = req.params.get('projectId')
         if not project_id:
             return func.HttpResponse("projectId is required", status_code=400)
             
         # Verify access
-        project = db.projects.find_one({"_id": ObjectId(project_id), "ownerId": uid})
+        project = db.projects.find_one({"_id": ObjectId(project_id), "ownerId": uid}, {"statusVersion": 1})
         if not project:
             return func.HttpResponse("Project not found", status_code=404)
-            
-        docs = list(db.documents.find({"projectId": project_id}))
-        for d in docs:
-            d['_id'] = str(d['_id'])
-        
-        return func.HttpResponse(
-            json.dumps(docs),
-            mimetype="application/json",
-            status_code=200
-        )
+
+        # Every change to the project's documents (status, summary, deletion) moves statusVersion
+        etag = etag_for("documents", project_id, project.get("statusVersion", 0))
+        return not_modified(req, etag) or \
+            cursor_response(db.documents.find({"projectId": project_id}, DOCUMENT_PROJECTION), req=req, etag=etag)
 
     elif method == 'DELETE':
         # Delete a specific document
@@ -64,23 +90,37 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             blob_name = f"{project_id}/{filename}"
             
             try:
+                size = storage_usage.blob_size(container_client.get_blob_client(blob_name))
                 container_client.delete_blob(blob_name)
+                storage_usage.record_delete(db, "docs", blob_name, size)
             except Exception as e:
                 logging.warning(f"Blob delete failed (might be missing): {e}")
 
-            # 2. Delete vectors (docs collection)
+            # 2. Delete chunks (docs and doc_vectors collections)
             # Vectors are stored with metadata.projectId AND metadata.source (filename)
             # Need to ensure we match exactly.
             # In process_file/ingestion_logic.py: doc['metadata']['source'] = filename
             
-            delete_result = db.docs.delete_many({
+            chunk_filter = {
                 "metadata.projectId": project_id,
                 "metadata.source": filename
-            })
+            }
+            topics = TopicMapUpdate(project_id, db)
+            topics.remove_matching(chunk_filter)
+            delete_result = chunk_store.delete_chunks(db, chunk_filter)
+            topics.commit()
             logging.info(f"Deleted {delete_result.deleted_count} vectors for {filename}")
 
             # 3. Delete metadata (documents collection)
-            db.documents.delete_one({"projectId": project_id, "filename": filename})
+            deleted = db.documents.find_one_and_delete({"projectId": project_id, "filename": filename},
+                                                       projection={"status": 1})
+            # A document deleted mid-ingestion no longer counts towards the project's processing
+            if deleted and deleted.get("status") in ingestion_state.ACTIVE_STATES:
+                ingestion_state.adjust_project(db, project_id, -1)
+            elif deleted:
+                ingestion_state.bump_status_version(db, project_id)
+            if deleted or delete_result.deleted_count:
+                ingestion_state.bump_content_version(db, project_id)
             
             return func.HttpResponse(status_code=204)
 
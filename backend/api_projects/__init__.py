@@ -1,13 +1,17 @@
 import azure.functions as func
 import logging
-import json
 import os
-from pymongo import MongoClient
 from bson import ObjectId
 from datetime import datetime
-from datetime import datetime
 from shared.auth import authenticate_request
+from shared.clients import get_mongo_client
+from shared.telemetry import instrument
+from shared.responses import json_response, cursor_response, not_modified
+from shared.projections import PROJECT_PROJECTION, VERSION_PROJECTION
+from shared import storage_usage, chunk_store
+from .workspace import load_workspace, workspace_etag
 
+@instrument("api_projects")
 @authenticate_request
 def main(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Python HTTP trigger function processed a request.')
@@ -19,23 +23,35 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
     if not connection_string:
          return func.HttpResponse("Database configuration error", status_code=500)
     
-    client = MongoClient(connection_string)
+    client = get_mongo_client()
     db = client["mnemoniq"]
     projects_collection = db["projects"]
 
     # 3. Handle Requests
-    if req.method == 'GET':
+    if req.method == 'GET' and req.route_params.get('id'):
+        # Project workspace: project, documents, latest chat page and songs in one round trip
+        project_id = req.route_params.get('id')
+        if not ObjectId.is_valid(project_id):
+            return func.HttpResponse("Invalid Project ID", status_code=400)
+
+        if req.headers.get('If-None-Match'):
+            # Revalidation: the project's versions decide, without reading the rest
+            versions = projects_collection.find_one({"_id": ObjectId(project_id), "ownerId": uid}, VERSION_PROJECTION)
+            if not versions:
+                return func.HttpResponse("Project not found or unauthorized", status_code=404)
+            cached = not_modified(req, workspace_etag(project_id, versions))
+            if cached:
+                return cached
+
+        workspace = load_workspace(db, uid, project_id)
+        if not workspace:
+            return func.HttpResponse("Project not found or unauthorized", status_code=404)
+
+        return json_response(workspace, req=req, etag=workspace_etag(project_id, workspace["project"]))
+
+    elif req.method == 'GET':
         # List projects for user
-        projects = list(projects_collection.find({"ownerId": uid}))
-        # Convert ObjectId to str
-        for p in projects:
-            p['_id'] = str(p['_id'])
-        
-        return func.HttpResponse(
-            json.dumps(projects),
-            mimetype="application/json",
-            status_code=200
-        )
+        return cursor_response(projects_collection.find({"ownerId": uid}, PROJECT_PROJECTION), req=req)
 
     elif req.method == 'POST':
         # Create new project
@@ -59,14 +75,9 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             "createdAt": datetime.utcnow().isoformat()
         }
         
-        result = projects_collection.insert_one(new_project)
-        new_project['_id'] = str(result.inserted_id)
+        projects_collection.insert_one(new_project)
         
-        return func.HttpResponse(
-            json.dumps(new_project),
-            mimetype="application/json",
-            status_code=201
-        )
+        return json_response(new_project, status_code=201)
 
     elif req.method == 'DELETE':
         # Delete project
@@ -84,31 +95,37 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
         if not project:
              return func.HttpResponse("Project not found or unauthorized", status_code=404)
         
-        # 1. Delete from Blob Storage
-        try:
-            from shared.clients import get_blob_service_client
-            blob_service_client = get_blob_service_client()
-            container_client = blob_service_client.get_container_client("docs")
-            
-            # Blobs are stored as "docs/project_id/filename". Prefix is "project_id/"
-            prefix = f"{project_id}/"
-            # List blobs starting with project_id/
-            blobs = container_client.list_blobs(name_starts_with=prefix)
-            for blob in blobs:
-                container_client.delete_blob(blob.name)
-        except Exception as e:
-            logging.error(f"Error deleting blobs: {e}")
+        # 1. Delete from Blob Storage: uploaded documents and generated songs
+        # Blobs are stored as "<container>/project_id/filename". Prefix is "project_id/"
+        prefix = f"{project_id}/"
+        blobs_left = False
+        from shared.clients import get_blob_service_client
+        for container in storage_usage.STORAGE_CONTAINERS:
+            try:
+                container_client = get_blob_service_client().get_container_client(container)
+                for blob in container_client.list_blobs(name_starts_with=prefix):
+                    container_client.delete_blob(blob.name)
+                    storage_usage.record_delete(db, container, blob.name, blob.size or 0)
+            except Exception as e:
+                blobs_left = True
+                logging.error(f"Error deleting {container} blobs: {e}")
+        # The rollup goes with the blobs; while some are left it keeps counting them
+        if not blobs_left:
+            db.storage_usage.delete_one({"_id": project_id})
         
-        # 2. Delete Vector Details (docs collection)
-        docs_collection = db["docs"]
-        docs_collection.delete_many({"metadata.projectId": project_id})
+        # 2. Delete Chunks (docs and doc_vectors collections)
+        chunk_store.delete_chunks(db, {"metadata.projectId": project_id})
         
+        db.topic_maps.delete_one({"_id": project_id})
+        db.song_cache.delete_many({"projectId": project_id})
+
         # 3. Delete Document Metadata (documents collection)
         documents_collection = db["documents"]
         documents_collection.delete_many({"projectId": project_id})
 
-        # 4. Delete Chat History
+        # 4. Delete Chat History and Songs
         db.chat_history.delete_many({"projectId": project_id})
+        db.songs.delete_many({"projectId": project_id})
 
         # 5. Delete Project
         projects_collection.delete_one({"_id": oid})
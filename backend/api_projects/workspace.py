@@ -0,0 +1,46 @@
+from bson import ObjectId
+from concurrent.futures import ThreadPoolExecutor
+from shared.telemetry import span
+from shared.responses import etag_for
+from shared.blob_urls import sas_window, with_audio_url
+from shared.chat_history import page_size as chat_page_size, page as chat_page
+from shared.projections import PROJECT_PROJECTION, DOCUMENT_PROJECTION, SONG_PROJECTION, VERSION_PROJECTION
+
+# Project workspace: everything the project page needs in one response.
+# Opening a project used to take a request per panel (/projects to find the project, then
+# /chat, /documents and /songs), each verifying the token and checking ownership again.
+# Here the four reads run concurrently on the already verified uid, each with a projection
+# of just the fields the page shows. The ownership check is one of the four reads; the
+# others are discarded if it comes back empty.
+# The project's version counters cover everything in the workspace, so its ETag is derived
+# from them and a revalidation only needs the project read.
+# Older chat pages come from GET /chat with `before` (see shared/chat_history.py).
+
+
+def workspace_etag(project_id, project):
+    """ETag of a project's workspace, from the version fields of its project document."""
+    return etag_for("workspace", project_id, chat_page_size(), sas_window(),
+                    *(project.get(field, 0) for field in VERSION_PROJECTION))
+
+def load_workspace(db, uid, project_id, chat_limit=None):
+    """The project with its documents, latest chat page and songs, or None if `uid` doesn't own it."""
+    oid = ObjectId(project_id)
+    chat_limit = chat_limit or chat_page_size()
+    with span("projects.workspace", projectId=project_id):
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            project = pool.submit(db.projects.find_one, {"_id": oid, "ownerId": uid},
+                                  {**PROJECT_PROJECTION, **VERSION_PROJECTION})
+            documents = pool.submit(lambda: list(db.documents.find({"projectId": project_id}, DOCUMENT_PROJECTION)))
+            chat = pool.submit(chat_page, db, uid, project_id, chat_limit)
+            songs = pool.submit(lambda: [with_audio_url(song) for song in
+                                         db.songs.find({"projectId": project_id, "userId": uid}, SONG_PROJECTION)
+                                         .sort("createdAt", -1)])
+            project = project.result()
+            if not project:
+                return None
+            return {
+                "project": project,
+                "documents": documents.result(),
+                "chat": chat.result(),
+                "songs": songs.result()
+            }
@@ -1,30 +1,42 @@
 import azure.functions as func
+import asyncio
 import logging
 import json
 import os
 from datetime import datetime
 from bson.objectid import ObjectId
 from shared.auth import authenticate_request
-from shared.clients import get_openai_client, get_mongo_db
-from shared.rag import perform_vector_search
-
+from shared.clients import get_async_mongo_db
+from shared.rag import generate_embeddings_async, vector_search_many_async
+from shared.topic_map import sample_topic_chunks
+from shared.single_flight import single_flight, flight_key
+from shared.llm import chat_completion_async, fallback_deployments, with_deadline, DeadlineExceeded, INTERACTIVE
+from .quiz_shards import generate_questions, context_chunks
+from shared.telemetry import instrument, span, set_attribute
+from shared.responses import json_response
+from shared.projections import CHUNK_PROJECTION
+from shared import write_behind
+
+@instrument("api_quiz")
+@with_deadline("api_quiz")
 @authenticate_request
-def main(req: func.HttpRequest) -> func.HttpResponse:
+async def main(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Python HTTP trigger function processed a quiz request.')
     
     uid = req.user['uid']
 
     action = req.route_params.get('action')
-    db = get_mongo_db()
+    set_attribute("action", action)
+    db = get_async_mongo_db()
 
     if action == 'generate':
-        return generate_quiz(req, uid, db)
+        return await generate_quiz(req, uid, db)
     elif action == 'submit':
-        return submit_quiz(req, uid, db)
+        return await submit_quiz(req, uid, db)
     else:
         return func.HttpResponse("Invalid action", status_code=400)
 
-def generate_quiz(req, uid, db):
+async def generate_quiz(req, uid, db):
     try:
         req_body = req.get_json()
         project_id = req_body.get('projectId')
@@ -35,73 +47,65 @@ def generate_quiz(req, uid, db):
     if not project_id:
         return func.HttpResponse("projectId is required", status_code=400)
 
-    # Verify project ownership
-    project = db.projects.find_one({"_id": ObjectId(project_id), "ownerId": uid})
-    if not project:
-        return func.HttpResponse("Project not found", status_code=404)
+    # Double-clicks and retries of the same request share one quiz
+    key = flight_key("quiz/generate", project_id, uid, topic=topic)
+    return await single_flight(key, lambda: build_quiz(db, uid, project_id, topic), db)
 
-    try:
+async def build_quiz(db, uid, project_id, topic):
+    # Verify project ownership while the quiz context is retrieved.
+    # The ownership check and the retrieval don't depend on each other.
+    async def retrieve_context():
         if topic:
             logging.info(f"Generating quiz for specific topic: {topic}")
-            search_query = topic
+            search_queries = [topic]
         else:
             logging.info("Generating surprise quiz (Surprise Me mode)")
-            search_query = generate_surprise_topic(db, project_id)
-            logging.info(f"Generated surprise query: {search_query}")
-        
+            # Random topics from the project's topic map: no LLM or embedding call
+            chunks = await sample_topic_chunks(db, project_id, context_chunks())
+            if chunks:
+                set_attribute("quiz.context", "topic_map")
+                return chunks
+            # No map yet: one query per topic, so the quiz covers the project instead of one neighbourhood
+            search_queries = await generate_surprise_queries(db, project_id)
+            logging.info(f"Generated surprise queries: {search_queries}")
+        query_vectors = await generate_embeddings_async(search_queries)
+
         # Use shared RAG
-        results = perform_vector_search(project_id, search_query)
-        context = "\n\n".join([doc['text'] for doc in results])
-        
-        if not context:
-             docs = list(db.docs.find({"metadata.projectId": project_id}).limit(10))
-             if not docs:
+        per_query = max(2, -(-context_chunks() // len(query_vectors)))
+        return await vector_search_many_async(project_id, query_vectors, limit=per_query, total=context_chunks())
+
+    project, chunks = await asyncio.gather(
+        db.projects.find_one({"_id": ObjectId(project_id), "ownerId": uid}),
+        retrieve_context(),
+        return_exceptions=True
+    )
+    if isinstance(project, Exception):
+        return func.HttpResponse(f"Error verifying project: {str(project)}", status_code=500)
+    if not project:
+        return func.HttpResponse("Project not found", status_code=404)
+
+    try:
+        if isinstance(chunks, Exception):
+            raise chunks
+
+        if not chunks:
+             chunks = await db.docs.find({"metadata.projectId": project_id}, CHUNK_PROJECTION).limit(10).to_list()
+             if not chunks:
                  return func.HttpResponse("No documents found for this project", status_code=400)
-             context = "\n\n".join([doc['text'] for doc in docs])
              
     except Exception as e:
         return func.HttpResponse(f"Error preparing quiz context: {str(e)}", status_code=500)
 
-    # Generate Quiz
-    openai_client = get_openai_client()
+    # Generate Quiz, in parallel shards (see quiz_shards.py)
     chat_deployment = os.getenv("AZURE_OPENAI_CHAT_DEPLOYMENT") or "gpt-35-turbo"
 
-    prompt = f"""
-    Generate a multiple choice quiz with 10 questions based on the following text.
-    Return the output as a JSON array of objects.
-    Each object should have:
-    - "question": string
-    - "options": array of 4 strings
-    - "correctAnswer": string (must be one of the options)
-    - "explanation": string (why the answer is correct)
-
-    Text:
-    {context}
-    """
-
     try:
-        completion = openai_client.chat.completions.create(
-            model=chat_deployment,
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.7,
-            response_format={ "type": "json_object" }
-        )
-        content = completion.choices[0].message.content
-        quiz_data = json.loads(content)
-        if "questions" in quiz_data:
-            questions = quiz_data["questions"]
-        elif isinstance(quiz_data, list):
-            questions = quiz_data
-        else:
-             found = False
-             for val in quiz_data.values():
-                 if isinstance(val, list):
-                     questions = val
-                     found = True
-                     break
-             if not found:
-                 raise ValueError("Could not parse questions from LLM response")
+        with span("llm.quiz_completion", deployment=chat_deployment):
+            questions = await generate_questions(chunks, chat_deployment)
 
+    except DeadlineExceeded as e:
+        logging.error(f"Quiz generation timed out: {e}")
+        return func.HttpResponse("Timed out generating quiz", status_code=504)
     except Exception as e:
         logging.error(f"Error generating quiz: {e}")
         return func.HttpResponse("Error generating quiz", status_code=500)
@@ -113,50 +117,55 @@ def generate_quiz(req, uid, db):
         "questions": questions,
         "createdAt": datetime.utcnow().isoformat()
     }
-    result = db.quizzes.insert_one(quiz)
-    quiz_id = str(result.inserted_id)
-
-    return func.HttpResponse(
-        json.dumps({
-            "quizId": quiz_id,
-            "questions": questions
-        }),
-        mimetype="application/json",
-        status_code=200
-    )
+    # The _id is allocated up front, so the quiz can be returned before it is written
+    quiz_id = str(await write_behind.insert(db, "quizzes", quiz))
 
-def generate_surprise_topic(db, project_id):
-    docs = list(db.docs.find({"metadata.projectId": project_id}))
+    return json_response({
+        "quizId": quiz_id,
+        "questions": questions
+    })
+
+async def generate_surprise_queries(db, project_id):
+    # Summaries are stored per document, not on the chunks
+    docs = await db.documents.find({"projectId": project_id, "summary": {"$ne": None}}, {"summary": 1}).to_list()
     if not docs:
-        return "General concepts"
+        return ["General concepts"]
     
-    summary_text = "\n".join([d.get('summary', '') for d in docs])
+    summary_text = "\n".join([d.get('summary') or '' for d in docs])
     if len(summary_text) > 5000:
         summary_text = summary_text[:5000]
 
-    openai_client = get_openai_client()
     chat_deployment = os.getenv("AZURE_OPENAI_CHAT_DEPLOYMENT") or "gpt-35-turbo"
+    query_count = int(os.getenv("QUIZ_SURPRISE_QUERIES", 5))
     
     prompt = f"""
-    Based on the following document summaries, generate a search query that covers 10 diverse and interesting topics found in the text.
-    Return ONLY the search query string, nothing else.
+    Based on the following document summaries, generate {query_count} short search queries, each about a different interesting topic found in the text.
+    Return a JSON object with a "queries" array of strings, nothing else.
     
     Summaries:
     {summary_text}
     """
     
     try:
-        completion = openai_client.chat.completions.create(
-            model=chat_deployment,
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.7
-        )
-        return completion.choices[0].message.content.strip()
+        with span("llm.surprise_topic", deployment=chat_deployment):
+            completion = await chat_completion_async(
+                lane=INTERACTIVE,
+                fallbacks=fallback_deployments(),
+                model=chat_deployment,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.7,
+                response_format={ "type": "json_object" }
+            )
+        queries = json.loads(completion.choices[0].message.content).get("queries") or []
+        queries = [q.strip() for q in queries if isinstance(q, str) and q.strip()][:query_count]
+        if not queries:
+            raise ValueError("No queries in response")
+        return queries
     except Exception as e:
-        logging.error(f"Error generating surprise topic: {e}")
-        return "Key concepts from the project"
+        logging.error(f"Error generating surprise topics: {e}")
+        return ["Key concepts from the project"]
 
-def submit_quiz(req, uid, db):
+async def submit_quiz(req, uid, db):
     try:
         req_body = req.get_json()
         quiz_id = req_body.get('quizId')
@@ -167,7 +176,11 @@ def submit_quiz(req, uid, db):
     if not quiz_id or not answers:
         return func.HttpResponse("quizId and answers are required", status_code=400)
 
-    quiz = db.quizzes.find_one({"_id": ObjectId(quiz_id)})
+    if not ObjectId.is_valid(quiz_id):
+        return func.HttpResponse("Invalid quizId", status_code=400)
+    # A quiz submitted right after generation may still be queued for writing
+    quiz = write_behind.find_pending("quizzes", ObjectId(quiz_id)) or \
+        await db.quizzes.find_one({"_id": ObjectId(quiz_id)})
     if not quiz:
         return func.HttpResponse("Quiz not found", status_code=404)
     
@@ -202,14 +215,10 @@ def submit_quiz(req, uid, db):
         "results": results,
         "submittedAt": datetime.utcnow().isoformat()
     }
-    db.quiz_results.insert_one(quiz_result)
-
-    return func.HttpResponse(
-        json.dumps({
-            "score": score,
-            "total": len(questions),
-            "results": results
-        }),
-        mimetype="application/json",
-        status_code=200
-    )
+    await write_behind.insert(db, "quiz_results", quiz_result)
+
+    return json_response({
+        "score": score,
+        "total": len(questions),
+        "results": results
+    })
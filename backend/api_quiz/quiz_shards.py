@@ -0,0 +1,168 @@
+import os
+import re
+import json
+import asyncio
+import logging
+from shared.llm import chat_completion_async, fallback_deployments, INTERACTIVE
+from shared.telemetry import span, set_attribute
+
+# Sharded quiz generation.
+# One completion writing all 10 questions takes as long as its whole output. Instead the
+# retrieved chunks are split into QUIZ_SHARDS topic shards (chunks ordered by document,
+# section and page, then cut into contiguous runs) and each shard asks for its share of the
+# questions in a parallel completion, so latency is roughly that of the largest shard.
+# Every question is checked against the shape submit_quiz reads and near-duplicates across
+# shards are dropped. Shards that fail or come back short are asked again for what is missing,
+# up to QUIZ_SHARD_ATTEMPTS rounds, instead of failing the whole quiz.
+
+QUESTION_COUNT = 10
+OPTION_COUNT = 4
+
+
+def shard_count():
+    return max(1, int(os.getenv("QUIZ_SHARDS", 4)))
+
+def context_chunks():
+    """How many chunks to retrieve for a quiz; enough for every shard to get a few."""
+    return max(5, int(os.getenv("QUIZ_CONTEXT_CHUNKS", 12)))
+
+def _topic_order(chunk):
+    metadata = chunk.get("metadata") or {}
+    return (metadata.get("source") or "", tuple(metadata.get("headings") or ()),
+            metadata.get("pageStart") or 0, chunk.get("chunk_index") or 0)
+
+def split_into_shards(chunks, shards):
+    """Groups chunks by topic into at most `shards` contiguous runs of similar size."""
+    ordered = sorted(chunks, key=_topic_order)
+    shards = max(1, min(shards, len(ordered)))
+    size, extra = divmod(len(ordered), shards)
+    result, start = [], 0
+    for i in range(shards):
+        end = start + size + (1 if i < extra else 0)
+        result.append(ordered[start:end])
+        start = end
+    return result
+
+def questions_per_shard(total, shards):
+    size, extra = divmod(total, shards)
+    return [size + (1 if i < extra else 0) for i in range(shards)]
+
+def parse_questions(content):
+    """Pulls the question list out of a completion, which may wrap it in an object."""
+    data = json.loads(content)
+    if isinstance(data, list):
+        return data
+    if "questions" in data:
+        return data["questions"]
+    for value in data.values():
+        if isinstance(value, list):
+            return value
+    raise ValueError("Could not parse questions from LLM response")
+
+def validate_question(question):
+    """The question cleaned up to what submit_quiz expects, or None if it doesn't fit."""
+    if not isinstance(question, dict):
+        return None
+    text = question.get("question")
+    options = question.get("options")
+    answer = question.get("correctAnswer")
+    explanation = question.get("explanation")
+    if not all(isinstance(value, str) and value.strip() for value in (text, answer, explanation)):
+        return None
+    if not isinstance(options, list) or len(options) != OPTION_COUNT:
+        return None
+    options = [str(option).strip() for option in options]
+    if len(set(options)) != OPTION_COUNT or answer.strip() not in options:
+        return None
+    return {
+        "question": text.strip(),
+        "options": options,
+        "correctAnswer": answer.strip(),
+        "explanation": explanation.strip()
+    }
+
+def _words(text):
+    return set(re.findall(r"[a-z0-9]+", text.lower()))
+
+def is_duplicate(question, accepted, threshold=0.8):
+    words = _words(question["question"])
+    for other in accepted:
+        other_words = _words(other["question"])
+        if words == other_words:
+            return True
+        if words and other_words and len(words & other_words) / len(words | other_words) >= threshold:
+            return True
+    return False
+
+def _prompt(context, count, avoid):
+    avoid_text = ""
+    if avoid:
+        listed = "\n".join(f"- {q['question']}" for q in avoid)
+        avoid_text = f"\nDo not repeat or rephrase these questions:\n{listed}\n"
+    return f"""
+    Generate a multiple choice quiz with {count} questions based on the following text.
+    Return the output as a JSON object with a "questions" array.
+    Each object should have:
+    - "question": string
+    - "options": array of 4 strings
+    - "correctAnswer": string (must be one of the options)
+    - "explanation": string (why the answer is correct)
+    {avoid_text}
+    Text:
+    {context}
+    """
+
+async def _generate_shard(index, chunks, count, avoid, chat_deployment):
+    context = "\n\n".join(chunk["text"] for chunk in chunks)
+    with span("llm.quiz_shard", deployment=chat_deployment, shard=index, questions=count):
+        completion = await chat_completion_async(
+            lane=INTERACTIVE,
+            hedge=True,
+            fallbacks=fallback_deployments(),
+            model=chat_deployment,
+            messages=[{"role": "user", "content": _prompt(context, count, avoid)}],
+            temperature=0.7,
+            response_format={"type": "json_object"}
+        )
+    return parse_questions(completion.choices[0].message.content)
+
+async def generate_questions(chunks, chat_deployment, total=QUESTION_COUNT):
+    """Generates `total` validated, distinct questions from `chunks` in parallel shards."""
+    shards = split_into_shards(chunks, shard_count())
+    wanted = questions_per_shard(total, len(shards))
+    accepted = [[] for _ in shards]
+    attempts = int(os.getenv("QUIZ_SHARD_ATTEMPTS", 3))
+    set_attribute("quiz.shards", len(shards))
+
+    for attempt in range(attempts):
+        pending = [i for i in range(len(shards)) if len(accepted[i]) < wanted[i]]
+        if not pending:
+            break
+        if attempt:
+            logging.warning(f"Regenerating quiz shards {pending} (attempt {attempt + 1})")
+        results = await asyncio.gather(*(
+            _generate_shard(i, shards[i], wanted[i] - len(accepted[i]), accepted[i], chat_deployment)
+            for i in pending
+        ), return_exceptions=True)
+
+        for i, result in zip(pending, results):
+            if isinstance(result, Exception):
+                logging.warning(f"Quiz shard {i} failed: {result}")
+                # Out of time: another round can't finish either
+                if isinstance(result, TimeoutError):
+                    raise result
+                continue
+            for question in result:
+                question = validate_question(question)
+                if question is None or len(accepted[i]) >= wanted[i]:
+                    continue
+                if is_duplicate(question, [q for shard in accepted for q in shard]):
+                    continue
+                accepted[i].append(question)
+
+    questions = [q for shard in accepted for q in shard]
+    if not questions:
+        raise ValueError("No valid questions were generated")
+    if len(questions) < total:
+        logging.warning(f"Quiz has {len(questions)} of {total} questions after {attempts} attempts")
+    return questions
@@ -2,11 +2,14 @@ import azure.functions as func
 import logging
 import json
 import os
-from azure.storage.blob import BlobServiceClient
-from azure.storage.blob import BlobServiceClient
 from shared.auth import authenticate_request
-from process_file.ingestion_logic import generate_summary, store_document_metadata, extract_text_from_pdf
+from shared.clients import get_blob_service_client
+from shared.telemetry import instrument
+from process_file.ingestion_logic import generate_summary, store_document_metadata
+from process_file.extractors import extract_text
+from shared.llm import INTERACTIVE
 
+@instrument("api_regenerate_summary")
 @authenticate_request
 def main(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Python HTTP trigger function processed a request to regenerate summary.')
@@ -29,7 +32,7 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
         return func.HttpResponse("Storage configuration error", status_code=500)
 
     try:
-        blob_service_client = BlobServiceClient.from_connection_string(connection_string)
+        blob_service_client = get_blob_service_client()
         container_name = "docs"
         blob_client = blob_service_client.get_blob_client(container=container_name, blob=f"{project_id}/{filename}")
         
@@ -39,23 +42,14 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
         download_stream = blob_client.download_blob()
         file_content = download_stream.readall()
         
-        # 4. Extract Text
-        text = ""
-        if filename.lower().endswith('.txt'):
-            try:
-                text = file_content.decode('utf-8')
-            except UnicodeDecodeError:
-                text = file_content.decode('latin-1')
-        else:
-            # For PDF or others, use Document Intelligence
-            # extract_text_from_pdf expects bytes
-            text = extract_text_from_pdf(file_content)
+        # 4. Extract Text (locally for text-native formats, Document Intelligence for PDFs and images)
+        text = extract_text(filename, file_content)
         
         if not text.strip():
              return func.HttpResponse("Could not extract text from file", status_code=400)
 
         # 5. Generate Summary
-        summary = generate_summary(text)
+        summary = generate_summary(text, lane=INTERACTIVE)
         
         # 6. Store/Update Metadata
         store_document_metadata(filename, summary, project_id)
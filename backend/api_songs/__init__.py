@@ -1,79 +1,122 @@
 import azure.functions as func
+import asyncio
 import logging
-import json
 import os
-from datetime import datetime, timedelta
-from bson.objectid import ObjectId
+from datetime import datetime
 from bson.objectid import ObjectId
 from shared.auth import authenticate_request
-from shared.clients import get_openai_client, get_mongo_db
-from shared.rag import perform_vector_search
-from azure.storage.blob import BlobServiceClient, generate_blob_sas, BlobSasPermissions
-from elevenlabs.client import ElevenLabs
-
+from shared.clients import get_async_mongo_db, get_async_blob_service_client
+from shared.rag import generate_embedding_async, vector_search_async
+from shared.single_flight import single_flight, flight_key
+from shared.llm import chat_completion_async, fallback_deployments, with_deadline, INTERACTIVE
+from shared.telemetry import instrument, span, set_attribute
+from shared.responses import json_response, cursor_response_async, etag_for, not_modified
+from shared.projections import SONG_PROJECTION
+from shared import song_cache, storage_usage
+from shared.blob_urls import SONGS_CONTAINER, sas_window, with_audio_url_async
+
+@instrument("api_songs")
+@with_deadline("api_songs")
 @authenticate_request
-def main(req: func.HttpRequest) -> func.HttpResponse:
+async def main(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Python HTTP trigger function processed a songs request.')
     
     uid = req.user['uid']
 
-    db = get_mongo_db()
+    db = get_async_mongo_db()
     
     action = req.route_params.get('action')
+    set_attribute("action", action)
 
     if action == 'generate-lyrics' and req.method == 'POST':
-        return generate_lyrics(req, uid, db)
+        return await generate_lyrics(req, uid, db)
 
     if req.method == 'GET':
-        return get_songs(req, uid, db)
+        return await get_songs(req, uid, db)
     elif req.method == 'POST':
-        return create_song(req, uid, db)
+        return await create_song(req, uid, db)
     elif req.method == 'DELETE':
-        return delete_song(req, uid, db)
+        return await delete_song(req, uid, db)
     else:
         return func.HttpResponse("Method not allowed", status_code=405)
 
-def get_songs(req, uid, db):
+async def get_songs(req, uid, db):
     project_id = req.params.get('projectId')
     if not project_id:
         return func.HttpResponse("projectId is required", status_code=400)
-    
-    songs = list(db.songs.find({"projectId": project_id, "userId": uid}).sort("createdAt", -1))
-    for s in songs:
-        s['_id'] = str(s['_id'])
-    
-    return func.HttpResponse(json.dumps(songs), mimetype="application/json", status_code=200)
-
-def delete_song(req, uid, db):
+    if not ObjectId.is_valid(project_id):
+        return func.HttpResponse("Invalid Project ID", status_code=400)
+
+    # Verify ownership, reading the songVersion the list's ETag is derived from
+    project = await db.projects.find_one({"_id": ObjectId(project_id), "ownerId": uid}, {"songVersion": 1})
+    if not project:
+        return func.HttpResponse("Project not found", status_code=404)
+
+    # Audio URLs are re-signed every SAS window, so a cached list is only good within one
+    etag = etag_for("songs", project_id, uid, project.get("songVersion", 0), sas_window())
+    cached = not_modified(req, etag)
+    if cached:
+        return cached
+    songs = db.songs.find({"projectId": project_id, "userId": uid}, SONG_PROJECTION).sort("createdAt", -1)
+    return await cursor_response_async(_signed(songs), req=req, etag=etag)
+
+async def _signed(songs):
+    async for song in songs:
+        yield await with_audio_url_async(song)
+
+async def _songs_changed(db, uid, project_id):
+    # Cached song lists (and workspaces) of the project are stale now
+    if project_id and ObjectId.is_valid(project_id):
+        await db.projects.update_one({"_id": ObjectId(project_id), "ownerId": uid}, {"$inc": {"songVersion": 1}})
+
+async def delete_song(req, uid, db):
     song_id = req.params.get('songId')
     if not song_id:
         return func.HttpResponse("songId is required", status_code=400)
     
-    result = db.songs.delete_one({"_id": ObjectId(song_id), "userId": uid})
-    if result.deleted_count == 0:
+    song = await db.songs.find_one_and_delete({"_id": ObjectId(song_id), "userId": uid}, projection={"projectId": 1})
+    if not song:
         return func.HttpResponse("Song not found or unauthorized", status_code=404)
+    await _songs_changed(db, uid, song.get("projectId"))
         
-    return func.HttpResponse(json.dumps({"message": "Deleted"}), mimetype="application/json", status_code=200)
+    return json_response({"message": "Deleted"})
 
-def generate_lyrics(req, uid, db):
+async def generate_lyrics(req, uid, db):
     try:
         req_body = req.get_json()
         project_id = req_body.get('projectId')
         prompt_text = req_body.get('prompt')
         genre = req_body.get('genre', 'Pop')
+        # Asks for new lyrics even if the same ones were written for this prompt before
+        regenerate = bool(req_body.get('regenerate'))
     except ValueError:
         return func.HttpResponse("Invalid JSON", status_code=400)
 
     if not project_id or not prompt_text:
         return func.HttpResponse("projectId and prompt are required", status_code=400)
 
+    # Double-clicks and retries of the same request share one generation
+    key = flight_key("generate-lyrics", project_id, uid, prompt=prompt_text, genre=genre, regenerate=regenerate)
+    return await single_flight(key, lambda: compose_lyrics(db, uid, project_id, prompt_text, genre, regenerate), db)
+
+async def compose_lyrics(db, uid, project_id, prompt_text, genre, regenerate=False):
     try:
+        # Verify project ownership, reading the content version the lyrics cache is keyed by
+        project = await db.projects.find_one({"_id": ObjectId(project_id), "ownerId": uid}, {"contentVersion": 1})
+        if not project:
+            return func.HttpResponse("Project not found", status_code=404)
+
+        cache_key = song_cache.lyrics_key(project_id, project.get("contentVersion", 0), prompt_text, genre)
+        lyrics = None if regenerate else await song_cache.get_lyrics(db, cache_key)
+        if lyrics:
+            return json_response({"lyrics": lyrics, "cached": True})
+
         # Vector Search
-        results = perform_vector_search(project_id, prompt_text)
+        query_vector = await generate_embedding_async(prompt_text)
+        results = await vector_search_async(project_id, query_vector)
         context = "\n\n".join([doc['text'] for doc in results])
         
         # Generate Lyrics
-        openai_client = get_openai_client()
         llm_prompt = f"""
         Write catchy song lyrics based on the following context. Keep the lyrics short and punchy. 2 short verses and a short chorus.
         The lyrics are for learning purposes, so the lyrics must be meaningful to the content and help them learn key concepts
@@ -83,19 +126,24 @@ def generate_lyrics(req, uid, db):
         Context:
         {context}
         """
-        completion = openai_client.chat.completions.create(
-            model=os.getenv("AZURE_OPENAI_CHAT_DEPLOYMENT") or "gpt-35-turbo",
-            messages=[{"role": "user", "content": llm_prompt}],
-            temperature=0.7
-        )
+        chat_deployment = os.getenv("AZURE_OPENAI_CHAT_DEPLOYMENT") or "gpt-35-turbo"
+        with span("llm.lyrics_completion", deployment=chat_deployment):
+            completion = await chat_completion_async(
+                lane=INTERACTIVE,
+                fallbacks=fallback_deployments(),
+                model=chat_deployment,
+                messages=[{"role": "user", "content": llm_prompt}],
+                temperature=0.7
+            )
         lyrics = completion.choices[0].message.content
-        return func.HttpResponse(json.dumps({"lyrics": lyrics}), mimetype="application/json", status_code=200)
+        await song_cache.put_lyrics(db, cache_key, project_id, lyrics)
+        return json_response({"lyrics": lyrics})
 
     except Exception as e:
         logging.error(f"Error generating lyrics: {e}")
         return func.HttpResponse(f"Error generating lyrics: {str(e)}", status_code=500)
 
-def create_song(req, uid, db):
+async def create_song(req, uid, db):
     try:
         req_body = req.get_json()
         project_id = req_body.get('projectId')
@@ -118,30 +166,15 @@ def create_song(req, uid, db):
     # Since we pass lyrics separately, 'text' describes the music style.
     final_prompt = f"Genre: {genre}. A high quality song with clear vocals. No music intro, start with lyrics right away. Mood: {genre}. Tempo: Dynamic. Lyrics: '{lyrics}'"
     
-    # 2. Call ElevenLabs
-    api_key = os.getenv("ELEVENLABS_API_KEY")
-    if not api_key:
-        return func.HttpResponse("ELEVENLABS_API_KEY not configured", status_code=500)
-
     try:
-        
-        client = ElevenLabs(api_key=api_key)
-        audio_generator = client.music.compose(
-            prompt=final_prompt,
-            music_length_ms=float(duration)
-        )
-        
-        audio_bytes = b"".join(audio_generator)
-        
-        # 3. Upload to Blob
         connection_string = os.getenv("BLOB_STORAGE_CONNECTION_STRING")
         if not connection_string:
              return func.HttpResponse("BLOB_STORAGE_CONNECTION_STRING not configured", status_code=500)
              
-        blob_service_client = BlobServiceClient.from_connection_string(connection_string)
-        container_name = "songs"
+        blob_service_client = get_async_blob_service_client()
+        container_name = SONGS_CONTAINER
         try:
-            blob_service_client.create_container(container_name)
+            await blob_service_client.create_container(container_name)
         # Set public access? 
         # By default containers are private. We need SAS.
         except:
@@ -149,21 +182,47 @@ def create_song(req, uid, db):
 
         song_id = str(ObjectId())
         blob_name = f"{project_id}/{song_id}.mp3"
-        blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob_name)
-        blob_client.upload_blob(audio_bytes, overwrite=True, content_type="audio/mpeg")
-        
-        # 4. Generate SAS URL
-        sas_token = generate_blob_sas(
-            account_name=blob_service_client.account_name,
-            container_name=container_name,
-            blob_name=blob_name,
-            account_key=blob_service_client.credential.account_key,
-            permission=BlobSasPermissions(read=True),
-            expiry=datetime.utcnow() + timedelta(hours=24)
-        )
-        audio_url = f"{blob_client.url}?{sas_token}"
+
+        # 2. Same lyrics, genre and length as an earlier song: copy its audio instead of composing
+        audio_key = song_cache.audio_key(lyrics, genre, duration)
+        cached_blob = await song_cache.get_audio(db, audio_key)
+        reused = bool(cached_blob) and \
+            await song_cache.copy_audio(db, audio_key, blob_service_client, cached_blob, blob_name)
+        set_attribute("song.audioReused", reused)
+        if reused:
+            try:
+                copied = blob_service_client.get_blob_client(container=container_name, blob=blob_name)
+                size = (await copied.get_blob_properties()).size
+                await storage_usage.record_async(db, storage_usage.project_of(blob_name), container_name, size, 1)
+            except Exception as e:
+                logging.warning(f"Storage usage not updated for copied song {blob_name}: {e}")
+
+        if not reused:
+            # 3. Call ElevenLabs
+            api_key = os.getenv("ELEVENLABS_API_KEY")
+            if not api_key:
+                return func.HttpResponse("ELEVENLABS_API_KEY not configured", status_code=500)
+
+            def compose():
+                from elevenlabs.client import ElevenLabs
+                client = ElevenLabs(api_key=api_key)
+                audio_generator = client.music.compose(
+                    prompt=final_prompt,
+                    music_length_ms=float(duration)
+                )
+                return b"".join(audio_generator)
+
+            # The ElevenLabs SDK is synchronous, run it off the event loop
+            with span("elevenlabs.compose", durationMs=duration):
+                audio_bytes = await asyncio.to_thread(compose)
+
+            # Upload to Blob
+            blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob_name)
+            await blob_client.upload_blob(audio_bytes, overwrite=True, content_type="audio/mpeg")
+            await storage_usage.record_async(db, storage_usage.project_of(blob_name), container_name, len(audio_bytes), 1)
+            await song_cache.put_audio(db, audio_key, blob_name)
         
-        # 5. Save to DB
+        # 4. Save to DB, with the blob path only: read URLs are signed when songs are served
         song_entry = {
             "_id": ObjectId(song_id),
             "projectId": project_id,
@@ -171,15 +230,15 @@ def create_song(req, uid, db):
             "title": title,
             "genre": genre,
             "lyrics": lyrics,
-            "audioUrl": audio_url,
+            "audioBlob": blob_name,
             "status": "completed",
             "createdAt": datetime.utcnow().isoformat()
         }
         
-        db.songs.insert_one(song_entry)
-        song_entry['_id'] = str(song_entry['_id'])
+        await db.songs.insert_one(song_entry)
+        await _songs_changed(db, uid, project_id)
 
-        return func.HttpResponse(json.dumps(song_entry), mimetype="application/json", status_code=201)
+        return json_response(await with_audio_url_async(song_entry), status_code=201)
 
     except Exception as e:
         logging.error(f"Error creating song: {e}")
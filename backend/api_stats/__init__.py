@@ -1,9 +1,11 @@
 import azure.functions as func
 import logging
-import json
 from shared.auth import authenticate_request
 from shared.clients import get_mongo_db
+from shared.telemetry import instrument
+from shared.responses import json_response
 
+@instrument("api_stats")
 @authenticate_request
 def main(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Python HTTP trigger function processed a stats request.')
@@ -42,8 +44,4 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
         "totalQuizzes": len(results)
     }
 
-    return func.HttpResponse(
-        json.dumps(stats),
-        mimetype="application/json",
-        status_code=200
-    )
+    return json_response(stats, req=req)
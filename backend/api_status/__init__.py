@@ -0,0 +1,41 @@
+import azure.functions as func
+import asyncio
+import logging
+from bson.objectid import ObjectId
+from shared.auth import authenticate_request
+from shared.clients import get_mongo_db, get_async_mongo_db
+from shared.telemetry import instrument
+from shared import ingestion_state
+from shared.status_feed import wait_for_change
+from shared.responses import json_response
+
+@instrument("api_status")
+@authenticate_request
+async def main(req: func.HttpRequest) -> func.HttpResponse:
+    logging.info('Python HTTP trigger function processed a status request.')
+
+    uid = req.user['uid']
+    project_id = req.route_params.get('id')
+    if not project_id or not ObjectId.is_valid(project_id):
+        return func.HttpResponse("Invalid Project ID", status_code=400)
+
+    since = req.params.get('since')
+    try:
+        since = int(since) if since is not None else None
+    except ValueError:
+        return func.HttpResponse("since must be a status version", status_code=400)
+
+    # Status reads (and failing stale documents) share the sync code path of /documents/status
+    db = get_mongo_db()
+    status = await asyncio.to_thread(ingestion_state.project_status, db, project_id, uid)
+    if not status:
+        return func.HttpResponse("Project not found", status_code=404)
+
+    # Long poll: the caller already has this version, hold the request until it changes
+    if since is not None and status["version"] == since:
+        if await wait_for_change(get_async_mongo_db(), project_id, since):
+            status = await asyncio.to_thread(ingestion_state.project_status, db, project_id, uid)
+            if not status:
+                return func.HttpResponse("Project not found", status_code=404)
+
+    return json_response(status)
@@ -1,12 +1,14 @@
 import azure.functions as func
 import logging
 import os
-from azure.storage.blob import BlobServiceClient
 from shared.auth import authenticate_request
-from shared.clients import get_mongo_db
+from shared.clients import get_mongo_db, get_blob_service_client
+from shared import ingestion_queue, ingestion_state, storage_usage
 from bson.objectid import ObjectId
 from urllib.parse import unquote
+from shared.telemetry import instrument, set_attribute
 
+@instrument("api_upload")
 @authenticate_request
 def main(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Python HTTP trigger function processed an upload request.')
@@ -27,6 +29,7 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
     
     if not project_id or not filename:
         return func.HttpResponse("X-Project-Id and X-Filename headers are required", status_code=400)
+    set_attribute("projectId", project_id)
 
     # Verify project ownership
     db = get_mongo_db()
@@ -40,7 +43,7 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
         return func.HttpResponse("Storage configuration error", status_code=500)
 
     try:
-        blob_service_client = BlobServiceClient.from_connection_string(connection_string)
+        blob_service_client = get_blob_service_client()
         container_name = "docs" # Must match the container in process_file trigger
         
         # Create container if not exists
@@ -49,22 +52,29 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
         except:
             pass # Container might exist
 
-        # 2.5 Update Project Status (Increment processing count)
-        # We do this BEFORE upload to ensure the processor doesn't finish before we increment if it's super fast,
+        # 2.5 Mark the document queued (counts it in the project's processingCount once).
+        # We do this BEFORE upload to ensure the processor doesn't finish before we count it if it's super fast,
         # but mainly to show UI status immediately.
-        db.projects.update_one(
-            {"_id": ObjectId(project_id)},
-            {
-                "$inc": {"processingCount": 1},
-                "$set": {"status": "processing"}
-            }
-        )
+        ingestion_state.mark_active(db, project_id, filename, ingestion_state.QUEUED)
 
         blob_client = blob_service_client.get_blob_client(container=container_name, blob=f"{project_id}/{filename}")
         
         # Upload data
         file_content = req.get_body()
-        blob_client.upload_blob(file_content, overwrite=True)
+        # Re-uploading a file replaces its blob, which only changes the project's byte count.
+        # Usage is best effort: the probe never raises, so it can't fail the upload.
+        previous_size = storage_usage.blob_size(blob_client)
+        try:
+            blob_client.upload_blob(file_content, overwrite=True)
+            storage_usage.record_upload(db, container_name, blob_client.blob_name, len(file_content), previous_size)
+
+            # 4. Schedule ingestion (queue mode). Otherwise the process_file blob trigger picks it up.
+            if ingestion_queue.is_enabled():
+                ingestion_queue.enqueue_ingestion_job(project_id, filename)
+        except Exception as e:
+            # Nothing will pick the document up, don't leave the project processing
+            ingestion_state.mark_finished(db, project_id, filename, ingestion_state.FAILED, error=f"Upload failed: {e}")
+            raise
         
         return func.HttpResponse("File uploaded successfully", status_code=200)
 
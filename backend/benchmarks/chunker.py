@@ -0,0 +1,86 @@
+import os
+import sys
+import time
+import argparse
+import statistics
+import tracemalloc
+
+# Chunker benchmark: the native structure-aware chunker (process_file/chunker.py) against
+# langchain's RecursiveCharacterTextSplitter, which ingestion used before, on the same
+# synthetic document. Both produce chunks of about the same size (256 tokens ~ 1000 chars).
+#
+#   cd backend
+#   python -m benchmarks.chunker --paragraphs 20000
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from benchmarks.fake_services import fake_text
+from process_file.chunker import Block, chunk_blocks, blocks_from_text, count_tokens
+
+
+def build_document(paragraphs, paragraphs_per_page=12, paragraphs_per_section=40):
+    blocks = []
+    for i in range(paragraphs):
+        page = i // paragraphs_per_page + 1
+        if i % paragraphs_per_section == 0:
+            blocks.append(Block(f"Section {i // paragraphs_per_section + 1}", page, "sectionHeading"))
+        blocks.append(Block(fake_text(60 + (i * 37) % 120, seed=i).capitalize() + ".", page))
+    return blocks
+
+
+def native(blocks, text):
+    return [chunk.text for chunk in chunk_blocks(blocks)]
+
+
+def native_text(blocks, text):
+    return [chunk.text for chunk in chunk_blocks(blocks_from_text(text))]
+
+
+def langchain(blocks, text):
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200, length_function=len)
+    return splitter.split_text(text)
+
+
+def measure(fn, blocks, text, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        chunks = fn(blocks, text)
+        times.append((time.perf_counter() - start) * 1000)
+    tracemalloc.start()
+    fn(blocks, text)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return chunks, statistics.median(times), peak / 1024
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Native chunker vs langchain text splitter")
+    parser.add_argument("--paragraphs", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    blocks = build_document(args.paragraphs)
+    text = "\n\n".join(block.text for block in blocks)
+    count_tokens("warm up the encoding")
+    print(f"Document: {len(blocks)} paragraphs, {len(text) / 1024 / 1024:.1f} MB\n")
+
+    candidates = {"native (blocks)": native, "native (plain text)": native_text, "langchain": langchain}
+    print(f"{'chunker':<22} {'chunks':>8} {'median ms':>10} {'MB/s':>8} {'peak KB':>10} {'avg tokens':>11}")
+    for name, fn in candidates.items():
+        try:
+            chunks, ms, peak_kb = measure(fn, blocks, text, args.repeat)
+        except ImportError as e:
+            print(f"{name:<22} skipped ({e})")
+            continue
+        mb_per_s = (len(text) / 1024 / 1024) / (ms / 1000) if ms else 0.0
+        avg_tokens = statistics.mean(count_tokens(chunk) for chunk in chunks[:500]) if chunks else 0
+        print(f"{name:<22} {len(chunks):>8} {ms:>10.1f} {mb_per_s:>8.1f} {peak_kb:>10.1f} {avg_tokens:>11.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,289 @@
+import re
+import json
+import time
+import random
+import hashlib
+import threading
+import uuid
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse
+
+# Fake Azure OpenAI + Document Intelligence HTTP server used by the offline benchmarks.
+# Only the routes the backend actually calls are implemented:
+#   POST /openai/deployments/{deployment}/chat/completions
+#   POST /openai/deployments/{deployment}/embeddings
+#   POST /documentintelligence/documentModels/{model}:analyze   (long running, polled)
+#   GET  /documentintelligence/operations/{id}
+# Latency and output size are configurable so benchmarks can model a slow completion tail, and an
+# optional requests-per-minute quota answers 429 with Retry-After like Azure OpenAI does.
+
+WORDS = (
+    "photosynthesis mitochondria osmosis enzyme catalyst membrane protein nucleus ribosome "
+    "chlorophyll glucose respiration diffusion gradient molecule energy cell tissue organ"
+).split()
+
+
+class FakeServiceConfig:
+    def __init__(self, latency_ms=50, jitter_ms=10, completion_tokens=200,
+                 embedding_dims=1536, embedding_latency_ms=None, docintel_pages=5, openai_rpm=None,
+                 tail_ratio=0.0, tail_ms=0, ms_per_token=0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.completion_tokens = completion_tokens
+        self.embedding_dims = embedding_dims
+        self.embedding_latency_ms = latency_ms if embedding_latency_ms is None else embedding_latency_ms
+        self.docintel_pages = docintel_pages
+        # A tail_ratio share of chat completions takes tail_ms longer
+        self.tail_ratio = tail_ratio
+        self.tail_ms = tail_ms
+        # Completions also take ms_per_token per output token, like a model generating them
+        self.ms_per_token = ms_per_token
+        # Azure OpenAI style quota: more than openai_rpm / 6 requests in 10 seconds get a 429
+        self.openai_rpm = openai_rpm
+        self.recent_requests = []
+        # Counters, useful for asserting how many upstream calls a code path made
+        self.calls = {"chat": 0, "embeddings": 0, "embedding_inputs": 0, "docintel": 0, "throttled": 0}
+        self.lock = threading.Lock()
+
+    def count(self, key, amount=1):
+        with self.lock:
+            self.calls[key] += amount
+
+    def throttle(self):
+        """Seconds until the next request would fit the quota window, or 0 if this one is admitted."""
+        if not self.openai_rpm:
+            return 0
+        now = time.monotonic()
+        with self.lock:
+            self.recent_requests = [t for t in self.recent_requests if now - t < 10]
+            if len(self.recent_requests) >= max(1, self.openai_rpm // 6):
+                self.calls["throttled"] += 1
+                return 10 - (now - self.recent_requests[0])
+            self.recent_requests.append(now)
+            return 0
+
+
+def fake_embedding(text, dims):
+    """Deterministic unit vector derived from the text, so identical inputs map to identical vectors."""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    rng = random.Random(seed)
+    vector = [rng.uniform(-1, 1) for _ in range(dims)]
+    norm = sum(v * v for v in vector) ** 0.5 or 1.0
+    return [v / norm for v in vector]
+
+
+def fake_text(token_count, seed=0):
+    rng = random.Random(seed)
+    return " ".join(rng.choice(WORDS) for _ in range(token_count))
+
+
+def fake_quiz(question_count=10, seed=0):
+    questions = []
+    for i in range(question_count):
+        options = [f"Option {i}-{j}" for j in range(4)]
+        questions.append({
+            "question": f"Sample question {i} about {fake_text(3, seed=seed * 100 + i)}?",
+            "options": options,
+            "correctAnswer": options[0],
+            "explanation": f"Because {WORDS[(i + 1) % len(WORDS)]} explains it."
+        })
+    return {"questions": questions}
+
+
+def fake_analyze_result(pages):
+    result_pages = []
+    paragraphs = []
+    content_parts = []
+    for page_number in range(1, pages + 1):
+        lines = [fake_text(12, seed=page_number * 100 + i) for i in range(30)]
+        result_pages.append({
+            "pageNumber": page_number,
+            "lines": [{"content": line} for line in lines]
+        })
+        paragraphs.append({
+            "role": "sectionHeading",
+            "content": f"Section {page_number}",
+            "boundingRegions": [{"pageNumber": page_number, "polygon": []}]
+        })
+        for i in range(0, len(lines), 5):
+            paragraphs.append({
+                "content": " ".join(lines[i:i + 5]),
+                "boundingRegions": [{"pageNumber": page_number, "polygon": []}]
+            })
+        content_parts.extend(lines)
+    return {
+        "apiVersion": "2024-11-30",
+        "modelId": "prebuilt-layout",
+        "content": "\n".join(content_parts),
+        "pages": result_pages,
+        "paragraphs": paragraphs
+    }
+
+
+def make_handler(config):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _sleep(self, base_ms):
+            delay = base_ms + random.uniform(-config.jitter_ms, config.jitter_ms)
+            if delay > 0:
+                time.sleep(delay / 1000)
+
+        def _send_json(self, payload, status=200, headers=None):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            try:
+                self.wfile.write(body)
+            except (BrokenPipeError, ConnectionResetError):
+                # The client gave up on the request, e.g. the cancelled loser of a hedged call
+                pass
+
+        def _read_body(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            return self.rfile.read(length) if length else b""
+
+        def do_POST(self):
+            path = urlparse(self.path).path
+            body = self._read_body()
+
+            if path.startswith("/openai/"):
+                retry_after = config.throttle()
+                if retry_after:
+                    return self._send_json({"error": {"code": "429", "message": "Rate limit is exceeded."}}, status=429,
+                                           headers={"retry-after-ms": str(int(retry_after * 1000)),
+                                                    "retry-after": str(int(retry_after) + 1)})
+            if path.endswith("/chat/completions"):
+                return self._chat(json.loads(body or b"{}"))
+            if path.endswith("/embeddings"):
+                return self._embeddings(json.loads(body or b"{}"))
+            if path.startswith("/documentintelligence/documentModels/") and path.endswith(":analyze"):
+                return self._analyze()
+            self._send_json({"error": f"unknown route {path}"}, status=404)
+
+        def do_GET(self):
+            path = urlparse(self.path).path
+            if path.startswith("/documentintelligence/operations/"):
+                return self._send_json({
+                    "status": "succeeded",
+                    "createdDateTime": "2024-01-01T00:00:00Z",
+                    "lastUpdatedDateTime": "2024-01-01T00:00:00Z",
+                    "analyzeResult": fake_analyze_result(config.docintel_pages)
+                })
+            self._send_json({"error": f"unknown route {path}"}, status=404)
+
+        def _chat(self, payload):
+            config.count("chat")
+            prompt = json.dumps(payload.get("messages", []))
+            queries = re.search(r"generate (\d+) short search queries", prompt)
+            if queries:
+                content = json.dumps({"queries": [fake_text(4, seed=i) for i in range(int(queries.group(1)))]})
+            elif (payload.get("response_format") or {}).get("type") == "json_object":
+                # As many questions as the prompt asks for, different for every prompt
+                requested = re.search(r"quiz with (\d+) questions", prompt)
+                content = json.dumps(fake_quiz(int(requested.group(1)) if requested else 10, seed=len(prompt)))
+            else:
+                content = fake_text(config.completion_tokens, seed=len(prompt))
+            prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in payload.get("messages", []))
+            completion_tokens = len(content.split())
+            tail = config.tail_ms if random.random() < config.tail_ratio else 0
+            self._sleep(config.latency_ms + tail + config.ms_per_token * completion_tokens)
+            self._send_json({
+                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": payload.get("model", "fake"),
+                "choices": [{
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": content}
+                }],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens
+                }
+            })
+
+        def _embeddings(self, payload):
+            inputs = payload.get("input") or []
+            if isinstance(inputs, str):
+                inputs = [inputs]
+            config.count("embeddings")
+            config.count("embedding_inputs", len(inputs))
+            self._sleep(config.embedding_latency_ms)
+            tokens = sum(len(str(text).split()) for text in inputs)
+            self._send_json({
+                "object": "list",
+                "model": payload.get("model", "fake"),
+                "data": [
+                    {"object": "embedding", "index": i, "embedding": fake_embedding(str(text), config.embedding_dims)}
+                    for i, text in enumerate(inputs)
+                ],
+                "usage": {"prompt_tokens": tokens, "total_tokens": tokens}
+            })
+
+        def _analyze(self):
+            config.count("docintel")
+            self._sleep(config.latency_ms)
+            operation_id = uuid.uuid4().hex
+            host = self.headers.get("Host")
+            self.send_response(202)
+            self.send_header("Operation-Location",
+                             f"http://{host}/documentintelligence/operations/{operation_id}?api-version=2024-11-30")
+            self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+    return Handler
+
+
+class FakeServices:
+    """Runs the fake server on a background thread. Use as a context manager."""
+
+    def __init__(self, config=None, host="127.0.0.1", port=0):
+        self.config = config or FakeServiceConfig()
+        self.server = ThreadingHTTPServer((host, port), make_handler(self.config))
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def endpoint(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run the fake Azure OpenAI / Document Intelligence server")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--completion-tokens", type=int, default=200)
+    args = parser.parse_args()
+
+    services = FakeServices(FakeServiceConfig(latency_ms=args.latency_ms, completion_tokens=args.completion_tokens),
+                            port=args.port)
+    print(f"Fake services listening on {services.endpoint}")
+    services.server.serve_forever()
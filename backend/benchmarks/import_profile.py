@@ -0,0 +1,122 @@
+import os
+import re
+import sys
+import json
+import argparse
+import subprocess
+import statistics
+
+# Import-time (cold start) profile of every function in the app.
+# Each function module is imported in a fresh interpreter with `-X importtime` and the
+# cumulative import time of the function module plus its heaviest dependencies is
+# recorded. Results can be saved as a baseline so cold-start regressions (e.g. a heavy
+# SDK imported at module level again) get caught.
+#
+#   cd backend
+#   python -m benchmarks.import_profile                   # compare against the saved baseline
+#   python -m benchmarks.import_profile --save-baseline
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "import_times.json")
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+# Always loaded by the Functions worker before any function, so not attributable to our code
+WORKER_MODULES = ("azure.functions",)
+
+
+def function_modules():
+    """Every directory with a function.json is a function whose __init__ is imported by the worker."""
+    modules = []
+    for name in sorted(os.listdir(BACKEND_DIR)):
+        if os.path.isfile(os.path.join(BACKEND_DIR, name, "function.json")):
+            modules.append(name)
+    return modules
+
+
+def profile_module(module):
+    """Returns (total_ms, {module: cumulative_ms}) for importing `module` in a fresh interpreter."""
+    preload = "; ".join(f"import {m}" for m in WORKER_MODULES)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"{preload}; import sys; sys.stderr.write('---\\n'); import {module}"],
+        cwd=BACKEND_DIR, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+
+    stderr = result.stderr.split("---\n", 1)[-1]
+    cumulative = {}
+    for line in stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            cumulative[match.group(4)] = int(match.group(2)) / 1000
+    return cumulative.get(module, 0.0), cumulative
+
+
+def run(repeat, top):
+    results = {}
+    for module in function_modules():
+        totals = []
+        heaviest = {}
+        for _ in range(repeat):
+            total, cumulative = profile_module(module)
+            totals.append(total)
+            heaviest = cumulative
+        top_modules = sorted(
+            ((name, ms) for name, ms in heaviest.items() if name != module and "." not in name),
+            key=lambda item: item[1], reverse=True
+        )[:top]
+        results[module] = {
+            "import_ms": round(statistics.median(totals), 1),
+            "top_level_packages": {name: round(ms, 1) for name, ms in top_modules}
+        }
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-function import time profile (cold start)")
+    parser.add_argument("--repeat", type=int, default=3, help="Fresh interpreters per module (median is reported)")
+    parser.add_argument("--top", type=int, default=5, help="Heaviest top-level packages to report per module")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="Allowed relative regression (0.3 = 30%%)")
+    parser.add_argument("--min-delta-ms", type=float, default=20, help="Ignore regressions smaller than this")
+    args = parser.parse_args(argv)
+
+    results = run(args.repeat, args.top)
+
+    print(f"{'function':<26} {'import ms':>10}  heaviest packages")
+    for module, r in results.items():
+        packages = ", ".join(f"{name} {ms}" for name, ms in r["top_level_packages"].items())
+        print(f"{module:<26} {r['import_ms']:>10}  {packages}")
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nBaseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = []
+    for module, r in results.items():
+        previous = baseline.get(module)
+        if not previous:
+            continue
+        delta = r["import_ms"] - previous["import_ms"]
+        if delta > args.min_delta_ms and r["import_ms"] > previous["import_ms"] * (1 + args.tolerance):
+            regressions.append(f"{module}: {previous['import_ms']} ms -> {r['import_ms']} ms")
+    if regressions:
+        print("\nImport time regressions versus baseline:")
+        for line in regressions:
+            print(f"  - {line}")
+        return 1
+    print("\nNo import time regressions versus baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
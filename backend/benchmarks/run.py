@@ -0,0 +1,336 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import inspect
+import threading
+import argparse
+import logging
+import platform
+import subprocess
+import tracemalloc
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+# Offline end-to-end benchmarks for the function app.
+# Runs the real handler code (api_chat, api_quiz, api_upload, process_file) against local
+# stand-ins (see standins.py / fake_services.py) and reports throughput, latency percentiles
+# and peak traced memory per endpoint. Results can be saved as a baseline and compared on
+# later runs so regressions show up across commits.
+#
+#   cd backend
+#   python -m benchmarks.run                        # run and compare against the saved baseline
+#   python -m benchmarks.run --save-baseline        # record a new baseline
+#   python -m benchmarks.run --latency-ms 200 --iterations 100 --concurrency 8
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+import azure.functions as func
+from benchmarks import standins
+from benchmarks.fake_services import FakeServices, FakeServiceConfig, fake_embedding, fake_text
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+class SharedEventLoop:
+    """
+    One event loop on a background thread, like the Functions worker: async handlers
+    from all benchmark threads are scheduled on it and share its async clients.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def resolve(self, result):
+        if inspect.isawaitable(result):
+            return asyncio.run_coroutine_threadsafe(result, self.loop).result()
+        return result
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+def http_request(method, route, body=None, params=None, route_params=None, headers=None, raw_body=None):
+    request_headers = {"Authorization": "Bearer bench-token", "Content-Type": "application/json"}
+    request_headers.update(headers or {})
+    if raw_body is None:
+        raw_body = json.dumps(body).encode("utf-8") if body is not None else b""
+    return func.HttpRequest(
+        method=method,
+        url=f"http://localhost:7071/api/{route}",
+        headers=request_headers,
+        params=params or {},
+        route_params=route_params or {},
+        body=raw_body
+    )
+
+
+def seed_project(db, name, chunk_count, dims):
+    from bson import ObjectId
+    from shared import chunk_store
+    project_id = ObjectId()
+    db.projects.insert_one({
+        "_id": project_id,
+        "name": name,
+        "subject": "Biology",
+        "ownerId": standins.BENCH_UID,
+        "status": "ready",
+        "processingCount": 0,
+        "createdAt": datetime.utcnow().isoformat()
+    })
+    project_id = str(project_id)
+    chunks = []
+    for i in range(chunk_count):
+        text = fake_text(150, seed=i)
+        chunks.append({
+            "_id": f"{project_id}/seed.pdf#{i}",
+            "filename": "seed.pdf",
+            "chunk_index": i,
+            "text": text,
+            "vector": fake_embedding(text, dims),
+            "metadata": {"source": "seed.pdf", "projectId": project_id}
+        })
+    chunk_store.insert_chunks(db, chunks)
+    db.documents.insert_one({
+        "filename": "seed.pdf",
+        "projectId": project_id,
+        "summary": "<h1>Seed</h1>",
+        "uploadedAt": datetime.utcnow().isoformat()
+    })
+    return project_id
+
+
+def build_scenarios(db, args, blob_available, event_loop):
+    import api_chat
+    import api_quiz
+    import api_upload
+    import process_file
+
+    project_id = seed_project(db, "bench", args.chunks, args.embedding_dims)
+    ingest_project_id = seed_project(db, "bench-ingest", 0, args.embedding_dims)
+
+    quiz_response = event_loop.resolve(api_quiz.main(http_request(
+        "POST", "quiz/generate", {"projectId": project_id, "topic": "cells"}, route_params={"action": "generate"})))
+    quiz_id = json.loads(quiz_response.get_body())["quizId"]
+
+    document_text = "\n\n".join(fake_text(120, seed=i) for i in range(args.document_paragraphs)).encode("utf-8")
+
+    scenarios = {
+        "api_chat": lambda i: api_chat.main(http_request(
+            "POST", "chat", {"projectId": project_id, "message": f"Explain topic {i % 7}"})),
+        # Unique topics: identical requests within a few seconds share one generation (single-flight)
+        "api_quiz.generate": lambda i: api_quiz.main(http_request(
+            "POST", "quiz/generate", {"projectId": project_id, "topic": f"topic {i}"},
+            route_params={"action": "generate"})),
+        "api_quiz.submit": lambda i: api_quiz.main(http_request(
+            "POST", "quiz/submit", {"quizId": quiz_id, "answers": ["Option 0-0"] * 10},
+            route_params={"action": "submit"})),
+        "process_file.txt": lambda i: process_file.main(func.blob.InputStream(
+            data=document_text, name=f"docs/{ingest_project_id}/bench-{i}.txt", length=len(document_text))),
+        "process_file.pdf": lambda i: process_file.main(func.blob.InputStream(
+            data=b"%PDF-1.4 bench", name=f"docs/{ingest_project_id}/bench-{i}.pdf", length=14)),
+    }
+    if blob_available:
+        scenarios["api_upload"] = lambda i: api_upload.main(http_request(
+            "POST", "upload", raw_body=document_text,
+            headers={"X-Project-Id": project_id, "X-Filename": f"upload-{i}.txt"}))
+    return scenarios
+
+
+class BackgroundIngestion:
+    """Keeps `threads` ingestion loops running, to measure interactive endpoints under ingestion load."""
+
+    def __init__(self, call, threads, event_loop):
+        self.stopped = threading.Event()
+        self.threads = [threading.Thread(target=self._loop, args=(call, event_loop, 10_000_000 * (t + 1)), daemon=True)
+                        for t in range(threads)]
+        for thread in self.threads:
+            thread.start()
+
+    def _loop(self, call, event_loop, start):
+        i = start
+        while not self.stopped.is_set():
+            try:
+                event_loop.resolve(call(i))
+            except Exception as e:
+                logging.warning(f"Background ingestion {i} failed: {e}")
+            i += 1
+
+    def stop(self):
+        self.stopped.set()
+        for thread in self.threads:
+            thread.join()
+
+
+def run_scenario(name, call, iterations, concurrency, memory_iterations, event_loop):
+    def timed_call(i):
+        start = time.perf_counter()
+        try:
+            response = event_loop.resolve(call(i))
+            status = getattr(response, "status_code", 200)
+            ok = status is None or status < 400
+        except Exception as e:
+            logging.warning(f"{name} iteration {i} failed: {e}")
+            ok = False
+        return (time.perf_counter() - start) * 1000, ok
+
+    # Warm-up (imports, connection pools) is not part of the measurement
+    timed_call(0)
+
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(timed_call, range(1, iterations + 1)))
+    wall_seconds = time.perf_counter() - wall_start
+
+    latencies = sorted(ms for ms, _ in outcomes)
+    errors = sum(1 for _, ok in outcomes if not ok)
+
+    # Peak memory is traced in a separate sequential pass, tracemalloc slows everything down
+    tracemalloc.start()
+    for i in range(memory_iterations):
+        timed_call(iterations + 1 + i)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "iterations": iterations,
+        "concurrency": concurrency,
+        "errors": errors,
+        "throughput_rps": round(iterations / wall_seconds, 2) if wall_seconds else 0.0,
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "peak_memory_kb": round(peak / 1024, 1)
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def compare(results, baseline, tolerance):
+    """Returns a list of human readable regressions versus the baseline."""
+    regressions = []
+    for name, current in results["endpoints"].items():
+        previous = baseline.get("endpoints", {}).get(name)
+        if not previous:
+            continue
+        for key in ("p50_ms", "p95_ms", "p99_ms", "peak_memory_kb"):
+            if previous[key] and current[key] > previous[key] * (1 + tolerance):
+                regressions.append(f"{name}: {key} {previous[key]} -> {current[key]}")
+        if previous["throughput_rps"] and current["throughput_rps"] < previous["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput_rps {previous['throughput_rps']} -> {current['throughput_rps']}")
+        if current["errors"] > previous["errors"]:
+            regressions.append(f"{name}: errors {previous['errors']} -> {current['errors']}")
+    return regressions
+
+
+def print_table(results):
+    header = f"{'endpoint':<20} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'peak KB':>10} {'errors':>7}"
+    print(header)
+    print("-" * len(header))
+    for name, r in results["endpoints"].items():
+        print(f"{name:<20} {r['throughput_rps']:>8} {r['p50_ms']:>9} {r['p95_ms']:>9} {r['p99_ms']:>9} "
+              f"{r['peak_memory_kb']:>10} {r['errors']:>7}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmarks for the LearnAI backend")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--memory-iterations", type=int, default=3)
+    parser.add_argument("--latency-ms", type=float, default=50, help="Fake OpenAI / Document Intelligence latency")
+    parser.add_argument("--jitter-ms", type=float, default=10)
+    parser.add_argument("--tail-ratio", type=float, default=0.0, help="Share of chat completions that are slow")
+    parser.add_argument("--tail-ms", type=float, default=0, help="Extra latency of the slow completions")
+    parser.add_argument("--ms-per-token", type=float, default=0, help="Extra completion latency per output token")
+    parser.add_argument("--completion-tokens", type=int, default=200)
+    parser.add_argument("--embedding-dims", type=int, default=1536)
+    parser.add_argument("--chunks", type=int, default=200, help="Chunks seeded into the benchmark project")
+    parser.add_argument("--document-paragraphs", type=int, default=40, help="Paragraphs in the ingested .txt file")
+    parser.add_argument("--openai-rpm", type=int, help="Quota of the fake OpenAI endpoint, 429s above it")
+    parser.add_argument("--background-ingestion", type=int, default=0,
+                        help="Threads ingesting documents in the background while endpoints are measured")
+    parser.add_argument("--only", nargs="*", help="Run only these endpoints")
+    parser.add_argument("--baseline", default=os.path.join(BASELINE_DIR, "baseline.json"))
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression (0.2 = 20%%)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+
+    config = FakeServiceConfig(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                               completion_tokens=args.completion_tokens, embedding_dims=args.embedding_dims,
+                               openai_rpm=args.openai_rpm, tail_ratio=args.tail_ratio, tail_ms=args.tail_ms,
+                               ms_per_token=args.ms_per_token)
+    event_loop = SharedEventLoop()
+    with FakeServices(config) as services:
+        db = standins.install(services.endpoint)
+        blob_available = standins.blob_storage_available(os.environ["BLOB_STORAGE_CONNECTION_STRING"])
+        scenarios = build_scenarios(db, args, blob_available, event_loop)
+
+        results = {
+            "meta": {
+                "commit": git_commit(),
+                "timestamp": datetime.utcnow().isoformat(),
+                "python": platform.python_version(),
+                "mongo": "mongod" if os.getenv("BENCH_MONGO_URI") else "mongomock",
+                "config": {k: v for k, v in vars(args).items() if k not in ("baseline", "save_baseline", "only")}
+            },
+            "endpoints": {}
+        }
+        background = BackgroundIngestion(scenarios["process_file.txt"], args.background_ingestion, event_loop)
+        for name, call in scenarios.items():
+            if args.only and name not in args.only:
+                continue
+            results["endpoints"][name] = run_scenario(
+                name, call, args.iterations, args.concurrency, args.memory_iterations, event_loop)
+        background.stop()
+        results["meta"]["upstream_calls"] = dict(config.calls)
+    event_loop.stop()
+
+    print_table(results)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    with open(os.path.join(RESULTS_DIR, "latest.json"), "w") as f:
+        json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nBaseline saved to {args.baseline}")
+        return 0
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\nRegressions versus baseline ({baseline['meta'].get('commit')}):")
+            for line in regressions:
+                print(f"  - {line}")
+            return 1
+        print(f"\nNo regressions versus baseline ({baseline['meta'].get('commit')}).")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,226 @@
+import os
+import uuid
+import asyncio
+import logging
+import numpy as np
+
+# Local stand-ins for the managed services the function app talks to.
+#  - Mongo: mongomock by default, or a real local mongod when BENCH_MONGO_URI is set.
+#    Neither supports Atlas `$vectorSearch`, so aggregate() pipelines starting with it are
+#    answered by a brute-force cosine search and the rest of the pipeline runs on the server.
+#    Async handlers get the same collections behind an async facade.
+#  - Blob Storage: Azurite (BENCH_BLOB_CONNECTION_STRING, defaults to UseDevelopmentStorage=true).
+#  - Azure OpenAI / Document Intelligence: benchmarks.fake_services.
+#  - Firebase: token verification is replaced with a fixed benchmark user.
+# install() must run before any handler module is imported, because handlers bind
+# `get_mongo_db` & co. at import time.
+
+BENCH_UID = "bench-user"
+SCORE_FIELD = "__vs_score"
+
+
+def _get_path(doc, path):
+    value = doc
+    for part in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def _replace_score_meta(value):
+    if isinstance(value, dict):
+        if value == {"$meta": "vectorSearchScore"}:
+            return f"${SCORE_FIELD}"
+        return {k: _replace_score_meta(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_replace_score_meta(v) for v in value]
+    return value
+
+
+class VectorSearchCollection:
+    """Delegates to a real collection, emulating a leading `$vectorSearch` stage in aggregate()."""
+
+    def __init__(self, database, collection):
+        self._database = database
+        self._collection = collection
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+    def aggregate(self, pipeline, *args, **kwargs):
+        if not pipeline or "$vectorSearch" not in pipeline[0]:
+            return self._collection.aggregate(pipeline, *args, **kwargs)
+        return self._vector_search(pipeline[0]["$vectorSearch"], pipeline[1:])
+
+    def _vector_search(self, spec, rest):
+        candidates = list(self._collection.find(spec.get("filter") or {}))
+        candidates = [doc for doc in candidates if _get_path(doc, spec["path"]) is not None]
+        if not candidates:
+            return iter([])
+
+        matrix = np.array([_get_path(doc, spec["path"]) for doc in candidates], dtype=np.float32)
+        query = np.array(spec["queryVector"], dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1) * (np.linalg.norm(query) or 1.0)
+        cosine = matrix @ query / np.where(norms == 0, 1.0, norms)
+        top = np.argsort(-cosine)[:spec["limit"]]
+
+        scratch = self._database.raw[f"_vs_scratch_{uuid.uuid4().hex}"]
+        try:
+            hits = []
+            for i in top:
+                doc = dict(candidates[i])
+                # Atlas reports cosine similarity normalised to [0, 1]
+                doc[SCORE_FIELD] = float((1 + cosine[i]) / 2)
+                hits.append(doc)
+            scratch.insert_many(hits)
+            stages = [{"$sort": {SCORE_FIELD: -1}}] + _replace_score_meta(rest)
+            return iter(list(scratch.aggregate(stages)))
+        finally:
+            scratch.drop()
+
+
+class VectorSearchDatabase:
+    """Database wrapper handing out VectorSearchCollection instances."""
+
+    def __init__(self, database):
+        self.raw = database
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return VectorSearchCollection(self, self.raw[name])
+
+    def __getitem__(self, name):
+        return VectorSearchCollection(self, self.raw[name])
+
+
+class MongoClientShim:
+    def __init__(self, client, database):
+        self.raw = client
+        self._database = database
+
+    def __getitem__(self, name):
+        return self._database
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+
+class AsyncCursorShim:
+    """Async cursor facade (to_list / async iteration) over a sync cursor."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        # Chaining methods (sort, limit, skip, ...) keep returning the async facade
+        method = getattr(self._cursor, name)
+
+        def chain(*args, **kwargs):
+            return AsyncCursorShim(method(*args, **kwargs))
+        return chain
+
+    async def to_list(self, length=None):
+        items = await asyncio.to_thread(list, self._cursor)
+        return items[:length] if length else items
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for item in await self.to_list():
+            yield item
+
+
+class AsyncCollectionShim:
+    """
+    Async facade over a (vector search emulating) sync collection, standing in for the
+    pymongo AsyncCollection used by the async handlers. Calls run in worker threads so the
+    shared event loop is not blocked.
+    """
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def find(self, *args, **kwargs):
+        return AsyncCursorShim(self._collection.find(*args, **kwargs))
+
+    async def aggregate(self, pipeline, *args, **kwargs):
+        cursor = await asyncio.to_thread(self._collection.aggregate, pipeline, *args, **kwargs)
+        return AsyncCursorShim(cursor)
+
+    def __getattr__(self, name):
+        method = getattr(self._collection, name)
+
+        async def call(*args, **kwargs):
+            return await asyncio.to_thread(method, *args, **kwargs)
+        return call
+
+
+class AsyncDatabaseShim:
+    def __init__(self, database):
+        self._database = database
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return AsyncCollectionShim(self._database[name])
+
+    def __getitem__(self, name):
+        return AsyncCollectionShim(self._database[name])
+
+
+def create_mongo_client():
+    mongo_uri = os.getenv("BENCH_MONGO_URI")
+    if mongo_uri:
+        from pymongo import MongoClient
+        from shared.telemetry import mongo_command_listener
+        logging.info(f"Benchmarks using local mongod at {mongo_uri}")
+        return MongoClient(mongo_uri, event_listeners=[mongo_command_listener()])
+
+    import mongomock
+    return mongomock.MongoClient()
+
+
+def blob_storage_available(connection_string):
+    """Returns True when Azurite (or a real account) answers on the configured connection string."""
+    try:
+        from azure.storage.blob import BlobServiceClient
+        client = BlobServiceClient.from_connection_string(
+            connection_string, connection_timeout=2, read_timeout=2, retry_total=0
+        )
+        client.get_service_properties()
+        return True
+    except Exception as e:
+        logging.warning(f"Blob storage stand-in not reachable, blob benchmarks will be skipped: {e}")
+        return False
+
+
+def install(fake_endpoint, database_name="mnemoniq", uid=BENCH_UID):
+    """Points the shared client factories at the local stand-ins. Returns the (wrapped) database."""
+    os.environ["AZURE_OPENAI_ENDPOINT"] = fake_endpoint
+    os.environ["AZURE_OPENAI_API_KEY"] = "bench"
+    os.environ.setdefault("AZURE_OPENAI_EMBEDDING_DEPLOYMENT", "text-embedding-3-small")
+    os.environ.setdefault("AZURE_OPENAI_CHAT_DEPLOYMENT", "gpt-4o-mini")
+    os.environ["AZURE_FORM_RECOGNIZER_ENDPOINT"] = fake_endpoint
+    os.environ["AZURE_FORM_RECOGNIZER_KEY"] = "bench"
+    os.environ["MONGO_DB_CONNECTION_STRING"] = os.getenv("BENCH_MONGO_URI") or "mongodb://mongomock"
+    os.environ["BLOB_STORAGE_CONNECTION_STRING"] = (
+        os.getenv("BENCH_BLOB_CONNECTION_STRING") or "UseDevelopmentStorage=true"
+    )
+    # Handlers are measured on their own, not racing a background instance warm-up
+    os.environ.setdefault("WARMUP_ON_FIRST_INVOCATION", "false")
+
+    client = create_mongo_client()
+    database = VectorSearchDatabase(client[database_name])
+    client_shim = MongoClientShim(client, database)
+    async_database = AsyncDatabaseShim(database)
+
+    from shared import clients, auth
+    clients.get_mongo_client = lambda: client_shim
+    clients.get_mongo_db = lambda: database
+    clients.get_async_mongo_client = lambda: MongoClientShim(client, async_database)
+    clients.get_async_mongo_db = lambda: async_database
+    auth.verify_token = lambda id_token: {"uid": uid}
+    return database
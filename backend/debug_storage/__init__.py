@@ -1,8 +1,23 @@
 import logging
 import azure.functions as func
 import os
-from azure.storage.blob import BlobServiceClient
+from bson.objectid import ObjectId
+from shared.clients import get_blob_service_client, get_mongo_db
+from shared.telemetry import instrument, set_attribute
+from shared.responses import json_response
+from shared import storage_usage
 
+# Storage inventory (function key).
+#   GET                                    containers, and the projects using the most storage
+#   GET ?container=docs[&prefix=][&pageSize=][&continuation=]
+#                                          one page of the container's blobs; pass the returned
+#                                          continuation to get the next page
+#   GET ?projectId=...                     the project's usage rollup
+#   POST ?projectId=...                    recount the project's blobs into its rollup
+# Listings are paged, so a request costs the same however large the containers grow.
+# Usage comes from the storage_usage rollup (shared/storage_usage.py), not from scanning.
+
+@instrument("debug_storage")
 def main(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Debug Storage function processing request.')
 
@@ -13,35 +28,44 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             status_code=500
         )
 
-    results = {
-        "status": "Check complete",
-        "connection_string_found": True,
-        "containers": [],
-        "docs_blobs": []
-    }
+    container = req.params.get('container')
+    project_id = req.params.get('projectId')
+    if project_id and not ObjectId.is_valid(project_id) and project_id != storage_usage.UNASSIGNED:
+        return func.HttpResponse("Invalid Project ID", status_code=400)
+    set_attribute("container", container)
+    set_attribute("projectId", project_id)
 
     try:
-        blob_service_client = BlobServiceClient.from_connection_string(conn_str)
-        
-        # 1. List Containers
-        containers = blob_service_client.list_containers()
-        results["containers"] = [c.name for c in containers]
-
-        # 2. List Blobs in 'docs'
-        container_client = blob_service_client.get_container_client("docs")
-        if container_client.exists():
-            blobs = container_client.list_blobs()
-            results["docs_blobs"] = [b.name for b in blobs]
-        else:
-             results["error"] = "Container 'docs' does not exist."
+        blob_service_client = get_blob_service_client()
 
-        return func.HttpResponse(
-            str(results),
-            status_code=200,
-            mimetype="application/json"
-        )
+        if req.method == 'POST':
+            if not project_id or project_id == storage_usage.UNASSIGNED:
+                return func.HttpResponse("projectId is required", status_code=400)
+            return json_response(storage_usage.rebuild(get_mongo_db(), blob_service_client, project_id))
+
+        if project_id:
+            return json_response(storage_usage.usage(get_mongo_db(), project_id))
+
+        if container:
+            container_client = blob_service_client.get_container_client(container)
+            if not container_client.exists():
+                return func.HttpResponse(f"Container '{container}' does not exist.", status_code=404)
+            blobs, continuation = storage_usage.list_page(
+                container_client,
+                prefix=req.params.get('prefix'),
+                limit=req.params.get('pageSize'),
+                continuation=req.params.get('continuation')
+            )
+            return json_response({"container": container, "blobs": blobs, "continuation": continuation})
+
+        top = get_mongo_db().storage_usage.find().sort("bytes", -1).limit(storage_usage.page_size(req.params.get('pageSize')))
+        return json_response({
+            "containers": [c.name for c in blob_service_client.list_containers()],
+            "projects": list(top)
+        })
 
     except Exception as e:
+        logging.error(f"Storage inventory failed: {e}")
         return func.HttpResponse(
             f"EXCEPTION: {str(e)}",
             status_code=500
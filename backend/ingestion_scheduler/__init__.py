@@ -0,0 +1,40 @@
+import os
+import json
+import logging
+import azure.functions as func
+from shared import ingestion_queue
+from shared.telemetry import instrument
+
+HOST_JSON = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "host.json")
+
+
+def function_timeout_seconds():
+    """functionTimeout from host.json, or the Consumption plan default (5 minutes) if it isn't set."""
+    try:
+        with open(HOST_JSON) as f:
+            hours, minutes, seconds = json.load(f)["functionTimeout"].split(":")
+        return int(hours) * 3600 + int(minutes) * 60 + int(float(seconds))
+    except Exception:
+        return 300
+
+def time_budget_seconds(job_seconds):
+    """
+    How long the scheduler keeps starting jobs. In-flight jobs get `job_seconds` more to finish,
+    and 30s are left to settle the queue, so a run ends before the function timeout.
+    """
+    if os.getenv("INGESTION_SCHEDULER_BUDGET_SECONDS"):
+        return int(os.getenv("INGESTION_SCHEDULER_BUDGET_SECONDS"))
+    return max(30, function_timeout_seconds() - job_seconds - 30)
+
+@instrument("ingestion_scheduler")
+def main(timer: func.TimerRequest) -> None:
+    if not ingestion_queue.is_enabled():
+        return
+
+    # Imported here so the timer stays cheap while queue mode is disabled
+    from process_file.scheduler import IngestionScheduler
+
+    # Timer functions run as a singleton, so this is also the app-wide concurrency cap
+    scheduler = IngestionScheduler()
+    stats = scheduler.run(time_budget_seconds=time_budget_seconds(scheduler.job_seconds))
+    logging.info(f"Ingestion scheduler stats: {stats}")
@@ -1,12 +1,21 @@
 import logging
 import azure.functions as func
 from . import ingestion_logic
+from shared import ingestion_queue
+from shared.telemetry import instrument, set_attribute
 
+@instrument("process_file")
 def main(myblob: func.InputStream):
     logging.info(f"Python blob trigger function processed blob \n"
                  f"Name: {myblob.name} \n"
                  f"Blob Size: {myblob.length} bytes")
 
+    if ingestion_queue.is_enabled():
+        # Uploads enqueue ingestion jobs which the ingestion_scheduler processes.
+        # Disable this function (AzureWebJobs.process_file.Disabled) to skip the blob read entirely.
+        logging.info(f"Ingestion queue enabled, skipping blob trigger for {myblob.name}")
+        return
+
     try:
         # Expected path structure: docs/{project_id}/{filename}
         # myblob.name typically returns the full path including container, e.g., "docs/123/example.pdf"
@@ -32,6 +41,7 @@ def main(myblob: func.InputStream):
         name = "/".join(parts[1:])
         
         logging.info(f"Parsed project_id: {project_id}, name: {name}")
+        set_attribute("projectId", project_id)
 
         # Read the blob content
         file_content = myblob.read()
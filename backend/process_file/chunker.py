@@ -0,0 +1,212 @@
+import os
+import re
+import logging
+from functools import lru_cache
+from typing import Iterable, Iterator, List, Optional
+
+# Structure-aware chunker.
+# Works on the paragraphs Document Intelligence returns (with their page numbers and roles)
+# instead of a flattened string:
+#  - chunks are sized in tokens (tiktoken's cl100k_base when available, otherwise an estimate),
+#  - a chunk never spans two sections: a new title / section heading closes the current chunk,
+#  - every chunk carries the page range it was taken from and the headings it sits under,
+#  - consecutive chunks overlap by whole sentences, up to CHUNK_OVERLAP_TOKENS.
+# Page headers, footers and page numbers are dropped, they only add noise to the embeddings.
+# Everything is a generator, so it plugs into the streaming ingestion pipeline.
+
+SKIPPED_ROLES = ("pageHeader", "pageFooter", "pageNumber")
+TITLE_ROLE = "title"
+HEADING_ROLE = "sectionHeading"
+
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+MARKDOWN_HEADING = re.compile(r"^(#{1,6})\s+(.*)$")
+PAGE_BREAK = re.compile(r"\f")
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+
+
+class Block:
+    """One paragraph of a document."""
+
+    __slots__ = ("text", "page", "role")
+
+    def __init__(self, text: str, page: Optional[int] = None, role: Optional[str] = None):
+        self.text = text
+        self.page = page
+        self.role = role
+
+
+class Chunk:
+    __slots__ = ("text", "page_start", "page_end", "headings", "tokens")
+
+    def __init__(self, text: str, page_start: Optional[int], page_end: Optional[int], headings: List[str], tokens: int):
+        self.text = text
+        self.page_start = page_start
+        self.page_end = page_end
+        self.headings = headings
+        self.tokens = tokens
+
+    def metadata(self) -> dict:
+        metadata = {"headings": self.headings}
+        if self.page_start is not None:
+            metadata["pageStart"] = self.page_start
+            metadata["pageEnd"] = self.page_end
+        return metadata
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(os.getenv("CHUNK_TOKEN_ENCODING", "cl100k_base"))
+    except Exception as e:
+        # No tiktoken, or its encoding file can't be downloaded
+        logging.warning(f"tiktoken unavailable, estimating chunk token counts: {e}")
+        return None
+
+def count_tokens(text: str) -> int:
+    encoding = _encoding()
+    if encoding is not None:
+        return len(encoding.encode_ordinary(text))
+    # Roughly 4 characters per token for English text
+    return (len(text) + 3) // 4
+
+
+# Block sources
+
+def _role(paragraph) -> Optional[str]:
+    role = getattr(paragraph, "role", None)
+    return str(role.value if hasattr(role, "value") else role) if role else None
+
+def blocks_from_result(result) -> Iterator[Block]:
+    """Paragraphs of a Document Intelligence layout result, in reading order."""
+    if result.paragraphs:
+        for paragraph in result.paragraphs:
+            if not paragraph.content.strip():
+                continue
+            regions = paragraph.bounding_regions or []
+            page = regions[0].page_number if regions else None
+            yield Block(paragraph.content, page, _role(paragraph))
+    elif result.pages:
+        # No paragraph analysis, fall back to one block per page
+        for page in result.pages:
+            text = "\n".join(line.content for line in page.lines or [])
+            if text.strip():
+                yield Block(text, page.page_number)
+    elif result.content:
+        yield Block(result.content)
+
+def _split(text: str, separator) -> Iterator[str]:
+    """Lazy re.split, so a large text isn't copied into a list of parts up front."""
+    start = 0
+    for match in separator.finditer(text):
+        yield text[start:match.start()]
+        start = match.end()
+    yield text[start:]
+
+def blocks_from_text(text: str) -> Iterator[Block]:
+    """
+    Paragraphs (blank-line separated) of a plain text document. Form feeds start a new page
+    and Markdown style `#` lines are treated as headings.
+    """
+    paged = "\f" in text
+    for page_index, page in enumerate(_split(text, PAGE_BREAK)):
+        page_number = page_index + 1 if paged else None
+        for paragraph in _split(page, PARAGRAPH_BREAK):
+            paragraph = paragraph.strip()
+            if not paragraph:
+                continue
+            heading = MARKDOWN_HEADING.match(paragraph)
+            if heading and "\n" not in paragraph:
+                yield Block(heading.group(2), page_number, TITLE_ROLE if len(heading.group(1)) == 1 else HEADING_ROLE)
+            else:
+                yield Block(paragraph, page_number)
+
+
+# Chunking
+
+class Chunker:
+    def __init__(self, max_tokens: int = None, overlap_tokens: int = None):
+        self.max_tokens = max_tokens or int(os.getenv("CHUNK_MAX_TOKENS", 256))
+        overlap = overlap_tokens if overlap_tokens is not None else int(os.getenv("CHUNK_OVERLAP_TOKENS", 48))
+        self.overlap_tokens = min(overlap, self.max_tokens // 2)
+
+    def _pieces(self, block: Block) -> Iterator[tuple]:
+        """Splits a block into (text, tokens) pieces no larger than max_tokens, at sentence boundaries."""
+        tokens = count_tokens(block.text)
+        if tokens <= self.max_tokens:
+            yield block.text, tokens
+            return
+        for sentence in SENTENCE_END.split(block.text):
+            sentence_tokens = count_tokens(sentence)
+            if sentence_tokens <= self.max_tokens:
+                yield sentence, sentence_tokens
+                continue
+            # A "sentence" longer than a chunk (tables, lists without punctuation): cut by words
+            words = sentence.split()
+            step = max(1, len(words) * self.max_tokens // sentence_tokens)
+            for i in range(0, len(words), step):
+                part = " ".join(words[i:i + step])
+                yield part, count_tokens(part)
+
+    def _overlap(self, pieces: List[tuple]) -> List[tuple]:
+        """Trailing sentences of the closed chunk that fit in the overlap budget."""
+        carried = []
+        budget = self.overlap_tokens
+        for text, tokens, page in reversed(pieces):
+            for sentence in reversed(SENTENCE_END.split(text)):
+                sentence_tokens = count_tokens(sentence)
+                if sentence_tokens > budget:
+                    return carried
+                carried.insert(0, (sentence, sentence_tokens, page))
+                budget -= sentence_tokens
+        return carried
+
+    def chunks(self, blocks: Iterable[Block]) -> Iterator[Chunk]:
+        title = None
+        headings: List[str] = []
+        current: List[tuple] = []  # (text, tokens, page)
+        current_tokens = 0
+        fresh = False  # whether `current` holds anything beyond the overlap of the previous chunk
+
+        def emit():
+            pages = [page for _, _, page in current if page is not None]
+            text = "\n".join(text for text, _, _ in current)
+            return Chunk(text, min(pages) if pages else None, max(pages) if pages else None,
+                         list(headings), current_tokens)
+
+        for block in blocks:
+            if block.role in SKIPPED_ROLES:
+                continue
+            if block.role in (TITLE_ROLE, HEADING_ROLE):
+                # Sections don't share chunks
+                if fresh:
+                    yield emit()
+                current, current_tokens, fresh = [], 0, False
+                if block.role == TITLE_ROLE:
+                    title = block.text
+                    headings = [title]
+                else:
+                    headings = ([title] if title else []) + [block.text]
+                continue
+
+            for text, tokens in self._pieces(block):
+                if current and current_tokens + tokens > self.max_tokens:
+                    if fresh:
+                        yield emit()
+                        current = self._overlap(current)
+                    else:
+                        current = []
+                    current_tokens = sum(t for _, t, _ in current)
+                    # The overlap must leave room for the piece
+                    while current and current_tokens + tokens > self.max_tokens:
+                        current_tokens -= current.pop(0)[1]
+                current.append((text, tokens, block.page))
+                current_tokens += tokens
+                fresh = True
+
+        if fresh:
+            yield emit()
+
+
+def chunk_blocks(blocks: Iterable[Block], max_tokens: int = None, overlap_tokens: int = None) -> Iterator[Chunk]:
+    return Chunker(max_tokens, overlap_tokens).chunks(blocks)
@@ -0,0 +1,320 @@
+import os
+import re
+import logging
+import zipfile
+import posixpath
+from io import BytesIO
+from html.parser import HTMLParser
+from typing import Callable, Dict, Iterator, List, Optional
+from xml.etree import ElementTree
+from shared.clients import get_document_intelligence_client
+from shared.telemetry import timed, set_attribute
+from .chunker import Block, TITLE_ROLE, HEADING_ROLE, blocks_from_result, blocks_from_text
+
+# Text extraction, one extractor per file type.
+# Formats that already carry their text (Word, PowerPoint, Markdown, HTML, plain text) are
+# parsed locally with the standard library, in milliseconds. PDFs and images, which need OCR
+# and layout analysis, go to Document Intelligence, and so does any type without an extractor
+# (.xlsx, .doc, ...), as every file did before.
+# Every extractor yields chunker Blocks, so structure survives extraction:
+#  - Word: paragraph styles (Title, Heading 1-9) become title / section heading blocks, tables
+#    one block per table with a row per line,
+#  - PowerPoint: one page per slide, slide titles are section headings,
+#  - HTML: <h1> is a title and <h2>-<h6> section headings; scripts, styles and <head> are skipped,
+#  - Markdown: `#` headings (outside code fences) are headings.
+# New formats register with @extractor(".ext", ...).
+
+DOCUMENT_INTELLIGENCE_TYPES = (".pdf", ".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".heif")
+
+W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+A = "{http://schemas.openxmlformats.org/drawingml/2006/main}"
+P = "{http://schemas.openxmlformats.org/presentationml/2006/main}"
+R = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+REL = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+EXTRACTORS: Dict[str, Callable[[bytes], Iterator[Block]]] = {}
+
+
+def extractor(*extensions):
+    """Registers the decorated function as the extractor of the given file extensions."""
+    def register(f):
+        for extension in extensions:
+            EXTRACTORS[extension] = f
+        return f
+    return register
+
+def file_type(filename: str) -> str:
+    return os.path.splitext(filename)[1].lower()
+
+def extract_blocks(filename: str, file_stream: bytes) -> Iterator[Block]:
+    """The paragraphs of a document, read by the extractor registered for its file type."""
+    extension = file_type(filename)
+    extract = EXTRACTORS.get(extension, extract_with_document_intelligence)
+    logging.info(f"Processing {filename} with {extract.__name__}")
+    set_attribute("ingest.extractor", extract.__name__)
+    return extract(file_stream)
+
+def extract_text(filename: str, file_stream: bytes) -> str:
+    return "\n".join(block.text for block in extract_blocks(filename, file_stream))
+
+
+# Plain text and Markdown
+
+def decode_text(file_stream: bytes) -> str:
+    try:
+        return file_stream.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        # Fallback to latin-1 if utf-8 fails
+        return file_stream.decode('latin-1')
+
+@extractor(".txt", ".text")
+def extract_plain_text(file_stream: bytes) -> Iterator[Block]:
+    return blocks_from_text(decode_text(file_stream))
+
+MARKDOWN_HEADING = re.compile(r"^ {0,3}(#{1,6})\s+(.*?)\s*#*\s*$")
+MARKDOWN_FENCE = re.compile(r"^ {0,3}(```|~~~)")
+
+@extractor(".md", ".markdown")
+def extract_markdown(file_stream: bytes) -> Iterator[Block]:
+    paragraph: List[str] = []
+    fence = None
+    for line in decode_text(file_stream).splitlines():
+        if fence:
+            paragraph.append(line)
+            if line.strip().startswith(fence):
+                fence = None
+            continue
+        opening = MARKDOWN_FENCE.match(line)
+        heading = MARKDOWN_HEADING.match(line)
+        if opening:
+            fence = opening.group(1)
+            paragraph.append(line)
+        elif heading:
+            if paragraph:
+                yield Block("\n".join(paragraph))
+                paragraph = []
+            yield Block(heading.group(2), role=TITLE_ROLE if len(heading.group(1)) == 1 else HEADING_ROLE)
+        elif not line.strip():
+            if paragraph:
+                yield Block("\n".join(paragraph))
+                paragraph = []
+        else:
+            paragraph.append(line)
+    if paragraph:
+        yield Block("\n".join(paragraph))
+
+
+# Office Open XML (Word, PowerPoint)
+
+def _xml(archive: zipfile.ZipFile, name: str) -> Optional[ElementTree.Element]:
+    try:
+        data = archive.read(name)
+    except KeyError:
+        return None
+    # OOXML parts never declare a DTD, refusing one keeps entity expansion out
+    if b"<!DOCTYPE" in data[:1024].upper():
+        raise ValueError(f"Unexpected DTD in {name}")
+    return ElementTree.fromstring(data)
+
+def _open_package(file_stream: bytes) -> zipfile.ZipFile:
+    try:
+        return zipfile.ZipFile(BytesIO(file_stream))
+    except zipfile.BadZipFile as e:
+        raise ValueError(f"Not an Office Open XML document: {e}")
+
+def _docx_styles(archive) -> Dict[str, str]:
+    """Style id -> built-in style name (ids are localized, e.g. "Kop1", names are not)."""
+    styles = _xml(archive, "word/styles.xml")
+    if styles is None:
+        return {}
+    names = {}
+    for style in styles.iter(f"{W}style"):
+        name = style.find(f"{W}name")
+        if name is not None:
+            names[style.get(f"{W}styleId")] = name.get(f"{W}val", "").lower()
+    return names
+
+def _docx_text(paragraph) -> str:
+    parts = []
+    for node in paragraph.iter():
+        if node.tag == f"{W}t":
+            parts.append(node.text or "")
+        elif node.tag == f"{W}tab":
+            parts.append("\t")
+        elif node.tag in (f"{W}br", f"{W}cr"):
+            parts.append("\n")
+    return "".join(parts).strip()
+
+def _docx_role(paragraph, styles) -> Optional[str]:
+    properties = paragraph.find(f"{W}pPr")
+    if properties is None:
+        return None
+    style = properties.find(f"{W}pStyle")
+    style_id = style.get(f"{W}val", "") if style is not None else ""
+    name = styles.get(style_id, style_id.lower())
+    if name == "title":
+        return TITLE_ROLE
+    # Level 9 is body text
+    outline = properties.find(f"{W}outlineLvl")
+    if name.startswith("heading") or (outline is not None and outline.get(f"{W}val") != "9"):
+        return HEADING_ROLE
+    return None
+
+@extractor(".docx")
+@timed("ingest.extract_docx")
+def extract_docx(file_stream: bytes) -> List[Block]:
+    with _open_package(file_stream) as archive:
+        document = _xml(archive, "word/document.xml")
+        styles = _docx_styles(archive)
+    if document is None:
+        raise ValueError("Word document has no word/document.xml")
+    body = document.find(f"{W}body")
+    blocks = []
+    for node in body if body is not None else []:
+        if node.tag == f"{W}p":
+            text = _docx_text(node)
+            if text:
+                blocks.append(Block(text, role=_docx_role(node, styles)))
+        elif node.tag == f"{W}tbl":
+            rows = []
+            for row in node.iter(f"{W}tr"):
+                cells = [" ".join(filter(None, (_docx_text(p) for p in cell.iter(f"{W}p"))))
+                         for cell in row.iter(f"{W}tc")]
+                if any(cells):
+                    rows.append(" | ".join(cells))
+            if rows:
+                blocks.append(Block("\n".join(rows)))
+    return blocks
+
+def _pptx_slides(archive) -> List[str]:
+    """Slide part names in presentation order."""
+    presentation = _xml(archive, "ppt/presentation.xml")
+    relationships = _xml(archive, "ppt/_rels/presentation.xml.rels")
+    if presentation is not None and relationships is not None:
+        targets = {rel.get("Id"): rel.get("Target") for rel in relationships.iter(f"{REL}Relationship")}
+        slides = [targets.get(slide.get(f"{R}id")) for slide in presentation.iter(f"{P}sldId")]
+        slides = [posixpath.normpath(target.lstrip("/") if target.startswith("/") else posixpath.join("ppt", target))
+                  for target in slides if target]
+        if slides:
+            return slides
+    # No usable presentation part, fall back to the slide numbers in the part names
+    names = [name for name in archive.namelist() if re.fullmatch(r"ppt/slides/slide\d+\.xml", name)]
+    return sorted(names, key=lambda name: int(re.search(r"(\d+)\.xml$", name).group(1)))
+
+def _pptx_paragraphs(element) -> List[str]:
+    paragraphs = ("".join(t.text or "" for t in p.iter(f"{A}t")).strip() for p in element.iter(f"{A}p"))
+    return [text for text in paragraphs if text]
+
+@extractor(".pptx")
+@timed("ingest.extract_pptx")
+def extract_pptx(file_stream: bytes) -> List[Block]:
+    blocks = []
+    with _open_package(file_stream) as archive:
+        for number, name in enumerate(_pptx_slides(archive), start=1):
+            slide = _xml(archive, name)
+            if slide is None:
+                continue
+            for shape in slide.iter():
+                if shape.tag == f"{P}sp":
+                    placeholder = shape.find(f"{P}nvSpPr/{P}nvPr/{P}ph")
+                    kind = placeholder.get("type") if placeholder is not None else None
+                    paragraphs = _pptx_paragraphs(shape)
+                    if not paragraphs:
+                        continue
+                    if kind in ("title", "ctrTitle"):
+                        blocks.append(Block(" ".join(paragraphs), number,
+                                            TITLE_ROLE if kind == "ctrTitle" else HEADING_ROLE))
+                    elif kind not in ("sldNum", "dt", "ftr"):
+                        blocks.append(Block("\n".join(paragraphs), number))
+                elif shape.tag == f"{A}tbl":
+                    rows = [" | ".join(" ".join(_pptx_paragraphs(cell)) for cell in row.iter(f"{A}tc"))
+                            for row in shape.iter(f"{A}tr")]
+                    rows = [row for row in rows if row.strip(" |")]
+                    if rows:
+                        blocks.append(Block("\n".join(rows), number))
+    return blocks
+
+
+# HTML
+
+class _HTMLBlocks(HTMLParser):
+    BLOCK_TAGS = {"p", "div", "section", "article", "main", "aside", "header", "footer", "li", "dt", "dd",
+                  "blockquote", "pre", "table", "tr", "ul", "ol", "dl", "figcaption", "br", "hr"}
+    SKIPPED_TAGS = {"head", "script", "style", "noscript", "template", "svg"}
+    HEADINGS = {"h1": TITLE_ROLE, "h2": HEADING_ROLE, "h3": HEADING_ROLE, "h4": HEADING_ROLE,
+                "h5": HEADING_ROLE, "h6": HEADING_ROLE}
+
+    def __init__(self):
+        super().__init__()
+        self.blocks: List[Block] = []
+        self.text: List[str] = []
+        self.role = None
+        self.skipping = 0
+        self.preformatted = 0
+
+    def flush(self):
+        text = "".join(self.text)
+        text = text.strip() if self.preformatted else re.sub(r"\s+", " ", text).strip()
+        if text:
+            self.blocks.append(Block(text, role=self.role))
+        self.text = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIPPED_TAGS:
+            self.skipping += 1
+        elif tag in self.HEADINGS:
+            self.flush()
+            self.role = self.HEADINGS[tag]
+        elif tag in self.BLOCK_TAGS:
+            self.flush()
+            if tag == "pre":
+                self.preformatted += 1
+        elif tag in ("td", "th") and self.text:
+            self.text.append(" | ")
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIPPED_TAGS:
+            self.skipping = max(0, self.skipping - 1)
+        elif tag in self.HEADINGS:
+            self.flush()
+            self.role = None
+        elif tag in self.BLOCK_TAGS:
+            self.flush()
+            if tag == "pre" and self.preformatted:
+                self.preformatted -= 1
+
+    def handle_data(self, data):
+        if not self.skipping:
+            self.text.append(data)
+
+@extractor(".html", ".htm")
+@timed("ingest.extract_html")
+def extract_html(file_stream: bytes) -> List[Block]:
+    parser = _HTMLBlocks()
+    parser.feed(decode_text(file_stream))
+    parser.close()
+    parser.flush()
+    return parser.blocks
+
+
+# PDFs and images
+
+@timed("ingest.analyze_document")
+def analyze_document(file_stream: bytes):
+    """Runs Azure Document Intelligence layout analysis on a file stream and returns the result."""
+    try:
+        client = get_document_intelligence_client()
+        poller = client.begin_analyze_document(
+            "prebuilt-layout",
+            body=file_stream,
+            content_type="application/octet-stream"
+        )
+        return poller.result()
+
+    except Exception as e:
+        logging.error(f"Error extracting text from PDF with Document Intelligence: {e}")
+        raise
+
+@extractor(*DOCUMENT_INTELLIGENCE_TYPES)
+def extract_with_document_intelligence(file_stream: bytes) -> Iterator[Block]:
+    return blocks_from_result(analyze_document(file_stream))
@@ -1,10 +1,22 @@
 import os
 import logging
 import io
-from typing import List, Dict, Any
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from azure.ai.documentintelligence.models import AnalyzeResult
-from shared.clients import get_openai_client, get_document_intelligence_client, get_mongo_db
+import hashlib
+from typing import List, Dict, Any, Iterable, Iterator
+from bson import ObjectId
+from shared.clients import get_mongo_db
+from shared.llm import chat_completion, BACKGROUND
+from shared.telemetry import span, timed
+from shared.embedding_batcher import get_embedding_aggregator
+from shared.ingestion_state import (DocumentIngestion, EXTRACTING, EMBEDDING, bump_status_version,
+                                    bump_content_version)
+from shared.topic_map import TopicMapUpdate
+from shared import chunk_store
+from .chunker import Block, Chunk, blocks_from_text, chunk_blocks
+from .extractors import analyze_document, extract_blocks
+
+# Characters of the document sent to the summary model
+SUMMARY_INPUT_CHARS = 100000
 
 # Initialize MongoDB Collection
 def get_mongo_collection():
@@ -16,9 +28,9 @@ def get_documents_collection():
     db = get_mongo_db()
     return db["documents"]
 
-def generate_summary(text: str) -> str:
+@timed("ingest.generate_summary")
+def generate_summary(text: str, lane: str = BACKGROUND) -> str:
     """Generates a high-level summary of the document using Azure OpenAI."""
-    client = get_openai_client()
     deployment = os.getenv("AZURE_OPENAI_DEPLOYMENT_ID") # Use the chat model for summarization
 
     if not deployment:
@@ -31,7 +43,7 @@ def generate_summary(text: str) -> str:
     
     # Truncate text if too long to avoid token limits. 
     # 100k chars is roughly 25k tokens, safe for gpt-4o-mini or similar.
-    truncated_text = text[:100000] 
+    truncated_text = text[:SUMMARY_INPUT_CHARS] 
 
     prompt = (
         "You are a helpful study assistant. Please provide a high-level summary of the following document content. "
@@ -42,7 +54,9 @@ def generate_summary(text: str) -> str:
     )
 
     try:
-        response = client.chat.completions.create(
+        # Ingestion runs in the background lane and yields to interactive chat / quiz calls
+        response = chat_completion(
+            lane=lane,
             model=deployment,
             messages=[
                 {"role": "system", "content": "You are a helpful AI assistant."},
@@ -74,153 +88,189 @@ def store_document_metadata(filename: str, summary: str, project_id: str):
         {"$set": doc},
         upsert=True
     )
+    # Cached document lists and lyrics of the project are stale now
+    bump_status_version(collection.database, project_id)
+    bump_content_version(collection.database, project_id)
     logging.info(f"Stored metadata for {filename} in MongoDB.")
 
+def iter_result_pages(result) -> Iterator[str]:
+    """Yields the text of each page of a Document Intelligence result."""
+    # We can also extract tables, selection marks, etc. if needed.
+    # For now, we just want the text content.
+    if result.pages:
+        logging.info(f"Document Intelligence found {len(result.pages)} pages.")
+        # Explicitly iterate over pages to ensure we get everything
+        for page in result.pages:
+            yield "\n".join(line.content for line in page.lines or [])
+    elif result.content:
+        yield result.content
+
+@timed("ingest.extract_text_from_pdf")
 def extract_text_from_pdf(file_stream: bytes) -> str:
     """Extracts text from a PDF file stream using Azure Document Intelligence."""
-    try:
-        client = get_document_intelligence_client()
-        
-        # Document Intelligence expects a file-like object or bytes
-        # For 'begin_analyze_document', we can pass the bytes directly if we use the 'analyze_document' method 
-        # but the SDK structure for bytes usually requires a Poller.
-        # Let's use the synchronous client's begin_analyze_document which returns a poller.
-        
-        poller = client.begin_analyze_document(
-            "prebuilt-layout", 
-            body=file_stream,
-            content_type="application/octet-stream"
-        )
-        result: AnalyzeResult = poller.result()
-        
-        # Extract text from the result
-        # We can also extract tables, selection marks, etc. if needed.
-        # For now, we just want the full text content.
-        if result.pages:
-            logging.info(f"Document Intelligence found {len(result.pages)} pages.")
-            # Explicitly iterate over pages to ensure we get everything
-            full_text = []
-            for page in result.pages:
-                for line in page.lines:
-                    full_text.append(line.content)
-            return "\n".join(full_text)
-        elif result.content:
-            return result.content
-        return ""
+    return "\n".join(iter_result_pages(analyze_document(file_stream)))
 
-    except Exception as e:
-        logging.error(f"Error extracting text from PDF with Document Intelligence: {e}")
-        raise
+def chunk_text(text: str, max_tokens: int = None, overlap_tokens: int = None) -> List[str]:
+    """Splits plain text into token-sized chunks (see chunker.py)."""
+    return [chunk.text for chunk in chunk_blocks(blocks_from_text(text), max_tokens, overlap_tokens)]
 
-def chunk_text(text: str, chunk_size: int = 1000, chunk_overlap: int = 200) -> List[str]:
-    """Splits text into chunks."""
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=chunk_size,
-        chunk_overlap=chunk_overlap,
-        length_function=len,
-    )
-    return text_splitter.split_text(text)
+def batched(items: Iterable, size: int) -> Iterator[list]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
 
+@timed("ingest.generate_embeddings")
 def generate_embeddings(text_chunks: List[str]) -> List[List[float]]:
-    """Generates embeddings for a list of text chunks using Azure OpenAI."""
-    client = get_openai_client()
-    deployment = os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT")
-
-    # Throw exception if the deployment is not set
-    if not deployment:
-        raise ValueError("AZURE_OPENAI_EMBEDDING_DEPLOYMENT is not set")
-    
-    embeddings = []
-    # Process in batches to avoid hitting limits if necessary, but for now simple loop
-    # OpenAI API can handle multiple inputs
+    """
+    Generates embeddings for a list of text chunks using Azure OpenAI. The chunks are sent
+    through the instance's embedding aggregator, batched together with those of other
+    documents being ingested at the same time.
+    """
     try:
-        response = client.embeddings.create(input=text_chunks, model=deployment)
-        # Sort by index to ensure order matches
-        data = sorted(response.data, key=lambda x: x.index)
-        embeddings = [item.embedding for item in data]
-        return embeddings
+        return get_embedding_aggregator().embed(text_chunks)
     except Exception as e:
         logging.error(f"Error generating embeddings: {e}")
         raise
 
-def store_vectors(filename: str, chunks: List[str], embeddings: List[List[float]], project_id: str):
-    """Stores text chunks and their embeddings in MongoDB."""
-    collection = get_mongo_collection()
-    
+def chunk_id(project_id: str, filename: str, content_hash: str, chunk_index: int) -> str:
+    # Deterministic, so a re-run of the same content finds the chunks a crashed run already stored
+    return f"{project_id}/{filename}@{content_hash}#{chunk_index}"
+
+@timed("ingest.store_vectors")
+def store_vectors(filename: str, chunks: List[Chunk], embeddings: List[List[float]], project_id: str,
+                  start_index: int = 0, content_hash: str = None):
+    """Stores a batch of chunks and their embeddings in MongoDB (text and vectors apart, see chunk_store.py)."""
     docs = []
-    for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
+    for i, (chunk, embedding) in enumerate(zip(chunks, embeddings), start=start_index):
         doc = {
             "filename": filename,
             "chunk_index": i,
-            "text": chunk,
+            "text": chunk.text,
             "vector": embedding,
             "metadata": {
                 "source": filename,
-                "projectId": project_id
+                "projectId": project_id,
+                **chunk.metadata()
             }
         }
+        if content_hash:
+            doc["_id"] = chunk_id(project_id, filename, content_hash, i)
+            doc["contentHash"] = content_hash
+        else:
+            # The text and the vector document share it
+            doc["_id"] = ObjectId()
         docs.append(doc)
     
     if docs:
-        collection.insert_many(docs)
+        chunk_store.insert_chunks(get_mongo_db(), docs)
         logging.info(f"Stored {len(docs)} chunks for {filename} in MongoDB.")
 
+def stored_chunk_ids(ids: List[str]) -> set:
+    return {doc["_id"] for doc in get_mongo_collection().find({"_id": {"$in": ids}}, {"_id": 1})}
+
+def remove_previous_versions(filename: str, project_id: str, content_hash: str, topics: TopicMapUpdate = None):
+    """Removes chunks of earlier uploads of the same file once the new version is fully stored."""
+    previous = {
+        "metadata.projectId": project_id,
+        "metadata.source": filename,
+        "contentHash": {"$ne": content_hash}
+    }
+    if topics is not None:
+        topics.remove_matching(previous)
+    db = get_mongo_db()
+    result = chunk_store.delete_chunks(db, previous)
+    if result.deleted_count:
+        bump_content_version(db, project_id)
+        logging.info(f"Removed {result.deleted_count} chunks of previous versions of {filename}")
+
+def iter_document_blocks(filename: str, file_stream: bytes) -> Iterator[Block]:
+    # Local parsers for text-native formats, Document Intelligence for PDFs and images (extractors.py)
+    return extract_blocks(filename, file_stream)
+
+class TextHead:
+    """Passes blocks through while keeping the first `limit` characters (the summary input)."""
+
+    def __init__(self, blocks: Iterable[Block], limit: int):
+        self.blocks = blocks
+        self.limit = limit
+        self.parts = []
+        self.length = 0
+
+    def __iter__(self):
+        for block in self.blocks:
+            if self.length < self.limit:
+                self.parts.append(block.text[:self.limit - self.length])
+                self.length += len(self.parts[-1]) + 1
+            yield block
+
+    @property
+    def text(self) -> str:
+        return "\n".join(self.parts)
+
+@timed("ingest.process_document")
 def process_document(filename: str, file_stream: bytes, project_id: str = "global"):
-    """Orchestrates the document processing flow."""
+    """
+    Orchestrates the document processing flow as a stream:
+    paragraphs -> chunks -> batches of EMBEDDING_BATCH_SIZE chunks -> embeddings -> insert_many,
+    with each batch folded into the project's topic map.
+    Memory stays flat with document size, and every stored batch survives a crash: chunk ids
+    are derived from the content hash, so a retry skips the batches that are already stored.
+    """
     logging.info(f"Starting processing for {filename}")
-    
-    # 1. Extract
-    if filename.lower().endswith('.txt'):
-        logging.info(f"Processing {filename} as text file")
-        try:
-            text = file_stream.decode('utf-8')
-        except UnicodeDecodeError:
-            # Fallback to latin-1 if utf-8 fails
-            text = file_stream.decode('latin-1')
-    else:
-        logging.info(f"Processing {filename} with Document Intelligence")
-        text = extract_text_from_pdf(file_stream)
-    if not text.strip():
-        logging.warning(f"No text extracted from {filename}")
-        return
-
-    # 1.5 Generate and Store Summary
-    logging.info(f"Generating summary for {filename}")
-    summary = generate_summary(text)
-    store_document_metadata(filename, summary, project_id)
-
-    # 2. Chunk
-    chunks = chunk_text(text)
-    logging.info(f"Generated {len(chunks)} chunks for {filename}")
-
-    # 3. Embed
-    embeddings = generate_embeddings(chunks)
-    logging.info(f"Generated {len(embeddings)} embeddings for {filename}")
-
-    # 4. Store
-    store_vectors(filename, chunks, embeddings, project_id)
-    logging.info(f"Completed processing for {filename}")
-
-    # 5. Update Project Status (Decrement processing count)
+    ingestion = DocumentIngestion(project_id, filename)
+    batch_size = int(os.getenv("INGESTION_EMBED_BATCH_SIZE", 64))
+    content_hash = hashlib.sha1(file_stream).hexdigest()[:16]
+    topics = TopicMapUpdate(project_id, get_mongo_db())
+
     try:
-        from bson.objectid import ObjectId
-        db = get_mongo_db()
-        
-        # Decrement
-        db.projects.update_one(
-            {"_id": ObjectId(project_id)},
-            {"$inc": {"processingCount": -1}}
-        )
-        
-        # Check if done
-        project = db.projects.find_one({"_id": ObjectId(project_id)})
-        # If count < 0, reset to 0 just in case. If <= 0, set to ready.
-        if project and project.get("processingCount", 0) <= 0:
-            db.projects.update_one(
-                {"_id": ObjectId(project_id)},
-                {"$set": {"status": "ready", "processingCount": 0}}
-            )
-            logging.info(f"Project {project_id} is now READY.")
-            
+        # 1. Extract (Document Intelligence analyses the whole file up front, paragraphs are read lazily)
+        ingestion.stage(EXTRACTING)
+        blocks = TextHead(iter_document_blocks(filename, file_stream), limit=SUMMARY_INPUT_CHARS)
+
+        # 2. Chunk, 3. Embed and 4. Store, one batch at a time
+        ingestion.stage(EMBEDDING, chunksEmbedded=0)
+        chunk_count = 0
+        for batch in batched(chunk_blocks(blocks), batch_size):
+            start_index = chunk_count
+            chunk_count += len(batch)
+            ids = [chunk_id(project_id, filename, content_hash, start_index + i) for i in range(len(batch))]
+            if len(stored_chunk_ids(ids)) == len(ids):
+                # Stored by an earlier attempt, which may not have reached the topic map
+                topics.skipped(len(ids))
+                ingestion.progress(chunksEmbedded=chunk_count)
+                continue
+            embeddings = generate_embeddings([chunk.text for chunk in batch])
+            store_vectors(filename, batch, embeddings, project_id, start_index=start_index, content_hash=content_hash)
+            topics.add(ids, embeddings, [chunk.headings[-1] if chunk.headings else None for chunk in batch])
+            ingestion.progress(chunksEmbedded=chunk_count)
+        logging.info(f"Stored {chunk_count} chunks for {filename}")
+
+        if chunk_count == 0:
+            logging.warning(f"No text extracted from {filename}")
+            ingestion.failed("No text could be extracted from the document")
+            return
+        ingestion.progress(chunksTotal=chunk_count)
+        remove_previous_versions(filename, project_id, content_hash, topics)
+
+        # 5. Generate and Store Summary (from the head of the document collected while streaming)
+        logging.info(f"Generating summary for {filename}")
+        with span("ingest.summary_stage"):
+            summary = generate_summary(blocks.text)
+            store_document_metadata(filename, summary, project_id)
+        logging.info(f"Completed processing for {filename}")
     except Exception as e:
-        logging.error(f"Error updating project status: {e}")
+        # Failed documents leave the project's processing count too, a retry re-enters it
+        ingestion.failed(e)
+        raise
+
+    # 6. Update document and project status
+    ingestion.stored()
+
+    # 7. Fold the document into the project's topic map (derived data, the document is usable already)
+    with span("ingest.topic_map"):
+        topics.commit()
@@ -0,0 +1,224 @@
+import os
+import time
+import logging
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from shared import ingestion_queue
+from shared.clients import get_blob_service_client
+from shared.telemetry import request_scope, span
+from . import ingestion_logic
+
+# Ingestion scheduler.
+# Drains the ingestion job queue with:
+#  - per-project fairness: received jobs are interleaved round-robin across projects, so one
+#    user's bulk upload can't starve everyone else's single file,
+#  - a concurrency cap: at most INGESTION_MAX_CONCURRENCY documents (and therefore their
+#    Document Intelligence / OpenAI calls) are processed at once,
+#  - retries through queue visibility timeouts with exponential backoff, and a poison queue
+#    for jobs that fail INGESTION_MAX_ATTEMPTS times,
+#  - a hard stop: jobs are only started within the time budget, and jobs still running
+#    INGESTION_JOB_SECONDS (the worst-case time of one document) after it are abandoned, so
+#    the run returns and releases the jobs it never started before the function times out.
+#    An abandoned job stays invisible until its visibility timeout and is then retried.
+# process_document stays the unit of work; one queue message is one document.
+
+class IngestionJob:
+    def __init__(self, message, project_id=None, filename=None):
+        self.message = message
+        self.project_id = project_id
+        self.filename = filename
+        self.pop_receipt = message.pop_receipt
+
+    @property
+    def dequeue_count(self):
+        return self.message.dequeue_count or 1
+
+
+def interleave_by_project(jobs, busy=None):
+    """
+    Orders jobs round-robin across projects: one job per project per round. Projects that
+    already have jobs running (`busy`: project_id -> count) go last, otherwise first-seen order.
+    """
+    busy = busy or {}
+    by_project = OrderedDict()
+    for job in jobs:
+        by_project.setdefault(job.project_id, deque()).append(job)
+    by_project = OrderedDict(sorted(by_project.items(), key=lambda item: busy.get(item[0], 0)))
+
+    ordered = []
+    while by_project:
+        for project_id in list(by_project):
+            project_jobs = by_project[project_id]
+            ordered.append(project_jobs.popleft())
+            if not project_jobs:
+                del by_project[project_id]
+    return ordered
+
+
+def download_document(project_id, filename):
+    blob_client = get_blob_service_client().get_blob_client(container="docs", blob=f"{project_id}/{filename}")
+    return blob_client.download_blob().readall()
+
+
+class IngestionScheduler:
+    def __init__(self, queue_client=None, poison_queue_client=None, process=None, download=None,
+                 max_concurrency=None, visibility_timeout=None, max_attempts=None,
+                 retry_base_seconds=None, job_seconds=None, batch_size=32):
+        self.queue_client = queue_client or ingestion_queue.get_queue_client()
+        self.poison_queue_client = poison_queue_client or ingestion_queue.get_queue_client(
+            ingestion_queue.poison_queue_name())
+        self.process = process or ingestion_logic.process_document
+        self.download = download or download_document
+        self.max_concurrency = max_concurrency or int(os.getenv("INGESTION_MAX_CONCURRENCY", 4))
+        # How long a received job stays invisible to other consumers. Extended while it is being processed.
+        self.visibility_timeout = visibility_timeout or int(os.getenv("INGESTION_VISIBILITY_TIMEOUT", 300))
+        self.max_attempts = max_attempts or int(os.getenv("INGESTION_MAX_ATTEMPTS", 5))
+        self.retry_base_seconds = retry_base_seconds if retry_base_seconds is not None else \
+            int(os.getenv("INGESTION_RETRY_BASE_SECONDS", 30))
+        # Worst-case time of one job, how long in-flight jobs get to finish once the budget is used up
+        self.job_seconds = job_seconds if job_seconds is not None else \
+            int(os.getenv("INGESTION_JOB_SECONDS", 240))
+        self.batch_size = batch_size
+        self.poisoned = 0
+
+    # Queue operations
+
+    def _receive(self):
+        jobs = []
+        messages = self.queue_client.receive_messages(
+            max_messages=self.batch_size, visibility_timeout=self.visibility_timeout)
+        for message in messages:
+            job = IngestionJob(message)
+            try:
+                decoded = ingestion_queue.decode_job(message.content)
+                job.project_id = decoded["projectId"]
+                job.filename = decoded["filename"]
+            except Exception as e:
+                self._poison(job, f"Undecodable message: {e}")
+                continue
+
+            # A job that keeps crashing the worker never reaches the failure handler, catch it here
+            if job.dequeue_count > self.max_attempts:
+                self._poison(job, "Exceeded max attempts")
+                continue
+            jobs.append(job)
+        return jobs
+
+    def _delete(self, job):
+        self.queue_client.delete_message(job.message.id, job.pop_receipt)
+
+    def _set_visibility(self, job, seconds):
+        receipt = self.queue_client.update_message(job.message.id, job.pop_receipt, visibility_timeout=seconds)
+        job.pop_receipt = receipt.pop_receipt
+
+    def _poison(self, job, reason):
+        logging.error(f"Moving ingestion job {job.message.id} to poison queue: {reason}")
+        self.poison_queue_client.send_message(job.message.content)
+        self._delete(job)
+        self.poisoned += 1
+
+    def _retry(self, job, error):
+        if job.dequeue_count >= self.max_attempts:
+            self._poison(job, f"Failed {job.dequeue_count} times, last error: {error}")
+            return
+        delay = min(self.retry_base_seconds * (2 ** (job.dequeue_count - 1)), 7 * 24 * 3600)
+        logging.warning(f"Ingestion job {job.project_id}/{job.filename} failed (attempt {job.dequeue_count}), "
+                        f"retrying in {delay}s: {error}")
+        self._set_visibility(job, delay)
+
+    # Work
+
+    def _run_job(self, job):
+        with request_scope("ingestion_job", projectId=job.project_id, attempt=job.dequeue_count):
+            try:
+                with span("ingest.download_blob"):
+                    content = self.download(job.project_id, job.filename)
+            except Exception as e:
+                if type(e).__name__ == "ResourceNotFoundError":
+                    logging.warning(f"Blob for {job.project_id}/{job.filename} no longer exists, dropping job")
+                    return
+                raise
+            self.process(job.filename, content, job.project_id)
+
+    def run(self, time_budget_seconds=240):
+        """
+        Processes jobs until the queue is empty or the time budget is used up. Jobs still running
+        `job_seconds` after the budget are abandoned. Returns counters of what happened.
+        """
+        deadline = time.monotonic() + time_budget_seconds
+        hard_deadline = deadline + self.job_seconds
+        heartbeat = max(1, self.visibility_timeout // 2)
+        stats = {"processed": 0, "failed": 0, "poisoned": 0, "abandoned": 0}
+
+        pending = deque()
+        in_flight = {}
+        queue_drained = False
+        last_extended = time.monotonic()
+
+        pool = ThreadPoolExecutor(max_workers=self.max_concurrency)
+        try:
+            while True:
+                now = time.monotonic()
+
+                # Refill the local backlog once it runs low. Holding a full batch lets us look past one
+                # project's burst and interleave other projects' jobs in between.
+                if not queue_drained and now < deadline and len(pending) < self.max_concurrency:
+                    received = self._receive()
+                    queue_drained = not received
+                    busy = {}
+                    for job in in_flight.values():
+                        busy[job.project_id] = busy.get(job.project_id, 0) + 1
+                    pending = deque(interleave_by_project(list(pending) + received, busy))
+
+                while pending and len(in_flight) < self.max_concurrency and now < deadline:
+                    job = pending.popleft()
+                    in_flight[pool.submit(self._run_job, job)] = job
+
+                if not in_flight:
+                    break
+                if now >= hard_deadline:
+                    # Waiting longer risks the function timeout, which would lose the releases below
+                    for job in in_flight.values():
+                        logging.warning(f"Abandoning ingestion job {job.project_id}/{job.filename}, still running "
+                                        f"{self.job_seconds}s after the time budget")
+                    stats["abandoned"] = len(in_flight)
+                    break
+
+                done, _ = wait(in_flight, timeout=min(heartbeat, max(0, hard_deadline - now)),
+                               return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = in_flight.pop(future)
+                    error = future.exception()
+                    try:
+                        if error is None:
+                            self._delete(job)
+                            stats["processed"] += 1
+                        else:
+                            stats["failed"] += 1
+                            self._retry(job, error)
+                    except Exception as e:
+                        # Losing the pop receipt only means the job becomes visible again later
+                        logging.error(f"Error settling ingestion job {job.message.id}: {e}")
+
+                # Keep received jobs invisible while they wait or run
+                if time.monotonic() - last_extended >= heartbeat:
+                    for job in list(in_flight.values()) + list(pending):
+                        try:
+                            self._set_visibility(job, self.visibility_timeout)
+                        except Exception as e:
+                            logging.warning(f"Could not extend visibility of job {job.message.id}: {e}")
+                    last_extended = time.monotonic()
+        finally:
+            # Don't block on abandoned jobs
+            pool.shutdown(wait=not in_flight, cancel_futures=True)
+
+        # Out of time: hand jobs we never started back to the queue straight away
+        for job in pending:
+            try:
+                self._set_visibility(job, 0)
+            except Exception as e:
+                logging.warning(f"Could not release job {job.message.id}: {e}")
+
+        stats["poisoned"] = self.poisoned
+        logging.info(f"Ingestion scheduler run finished: {stats}")
+        return stats
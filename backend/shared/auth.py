@@ -1,13 +1,15 @@
 import os
-import firebase_admin
-from firebase_admin import credentials, auth
 import logging
+from .telemetry import timed
 
 # Initialize Firebase Admin
 # We expect FIREBASE_SERVICE_ACCOUNT_KEY to be the JSON content of the service account key.
 # Alternatively, FIREBASE_PROJECT_ID can be provided for limited functionality/identity-based auth.
 
 def initialize_firebase():
+    # firebase_admin (and its google-cloud dependencies) is imported on first use to keep cold starts short
+    import firebase_admin
+    from firebase_admin import credentials
     try:
         firebase_admin.get_app()
     except ValueError:
@@ -39,8 +41,10 @@ def initialize_firebase():
             logging.warning("No Firebase credentials or project ID found in environment variables.")
             firebase_admin.initialize_app()
 
+@timed("auth.verify_token")
 def verify_token(id_token: str):
     initialize_firebase()
+    from firebase_admin import auth
     try:
         decoded_token = auth.verify_id_token(id_token, clock_skew_seconds=5)
         return decoded_token
@@ -48,18 +52,40 @@ def verify_token(id_token: str):
         logging.error(f"Token verification failed: {e}")
         raise ValueError("Invalid token")
 
+import asyncio
 import functools
+import inspect
 import azure.functions as func
 
+def _bearer_token(req: func.HttpRequest):
+    auth_header = req.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return None
+    return auth_header.split(' ')[1]
+
 def authenticate_request(f):
+    if inspect.iscoroutinefunction(f):
+        @functools.wraps(f)
+        async def async_wrapper(req: func.HttpRequest, *args, **kwargs):
+            token = _bearer_token(req)
+            if not token:
+                return func.HttpResponse("Unauthorized", status_code=401)
+            try:
+                # Firebase verification is blocking (key fetch + signature check), keep it off the event loop
+                req.user = await asyncio.to_thread(verify_token, token)
+            except ValueError:
+                return func.HttpResponse("Invalid Token", status_code=401)
+
+            return await f(req, *args, **kwargs)
+        return async_wrapper
+
     @functools.wraps(f)
     def wrapper(req: func.HttpRequest, *args, **kwargs):
         # 1. Verify Token
-        auth_header = req.headers.get('Authorization')
-        if not auth_header or not auth_header.startswith('Bearer '):
+        token = _bearer_token(req)
+        if not token:
             return func.HttpResponse("Unauthorized", status_code=401)
         
-        token = auth_header.split(' ')[1]
         try:
             user = verify_token(token)
             # Attach user to the request object so the wrapped function can access it
@@ -0,0 +1,142 @@
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlparse, unquote
+from .clients import get_blob_service_client, get_async_blob_service_client
+
+# Read URLs for private blobs (song audio), signed when they are served.
+# Song documents store the blob path only (`audioBlob`); a SAS is added at read time, so links
+# don't die a day after the song was made. Time is cut into BLOB_SAS_WINDOW_MINUTES windows
+# (default 60) and a URL signed in window n is valid until the end of window n + 1: every URL
+# handed out has at least one window left, and within a window the same URL is served from
+# an in-process cache (so song list responses, and their ETags, stay stable per window).
+# With a token credential (Azure AD) the SAS is signed with a user delegation key, fetched
+# once per window and shared by all blobs; with the account key from a connection string it
+# is signed locally. Either way signing a URL makes no request per blob.
+
+SONGS_CONTAINER = "songs"
+CLOCK_SKEW = timedelta(minutes=5)
+
+_urls = OrderedDict()
+_delegation_keys = {}
+_lock = threading.Lock()
+
+
+def window_minutes():
+    return max(1, int(os.getenv("BLOB_SAS_WINDOW_MINUTES", 60)))
+
+def _cache_size():
+    return int(os.getenv("BLOB_SAS_CACHE_SIZE", 10000))
+
+def sas_window(now=None):
+    """Index of the signing window `now` (default: the current time) falls in."""
+    now = now or datetime.now(timezone.utc)
+    return int(now.timestamp() // (window_minutes() * 60))
+
+def _validity(window):
+    length = window_minutes() * 60
+    start = datetime.fromtimestamp(window * length, timezone.utc) - CLOCK_SKEW
+    expiry = datetime.fromtimestamp((window + 2) * length, timezone.utc)
+    return start, expiry
+
+def blob_from_url(url, container=SONGS_CONTAINER):
+    """The blob name in a stored blob URL (songs saved before audioBlob existed), or None."""
+    if not url:
+        return None
+    parts = unquote(urlparse(url).path).lstrip("/").split("/", 1)
+    # Azurite puts the account name first: /devstoreaccount1/songs/...
+    if len(parts) == 2 and parts[0] != container and parts[1].startswith(f"{container}/"):
+        parts = parts[1].split("/", 1)
+    if len(parts) != 2 or parts[0] != container:
+        return None
+    return parts[1]
+
+def _cached(container, blob_name, window):
+    with _lock:
+        entry = _urls.get((container, blob_name))
+        if entry and entry[0] == window:
+            _urls.move_to_end((container, blob_name))
+            return entry[1]
+    return None
+
+def _remember(container, blob_name, window, url):
+    with _lock:
+        _urls[(container, blob_name)] = (window, url)
+        _urls.move_to_end((container, blob_name))
+        while len(_urls) > _cache_size():
+            _urls.popitem(last=False)
+    return url
+
+def _sign(client, container, blob_name, window, delegation_key):
+    from azure.storage.blob import generate_blob_sas, BlobSasPermissions
+    start, expiry = _validity(window)
+    token = generate_blob_sas(
+        account_name=client.account_name,
+        container_name=container,
+        blob_name=blob_name,
+        account_key=None if delegation_key else client.credential.account_key,
+        user_delegation_key=delegation_key,
+        permission=BlobSasPermissions(read=True),
+        start=start,
+        expiry=expiry
+    )
+    return f"{client.get_blob_client(container=container, blob=blob_name).url}?{token}"
+
+def _uses_delegation(client):
+    return not getattr(client.credential, "account_key", None)
+
+def _delegation_key(client, window):
+    with _lock:
+        key = _delegation_keys.get(window)
+    if key is None:
+        key = client.get_user_delegation_key(*_validity(window))
+        with _lock:
+            _delegation_keys.clear()
+            _delegation_keys[window] = key
+    return key
+
+async def _delegation_key_async(client, window):
+    with _lock:
+        key = _delegation_keys.get(window)
+    if key is None:
+        key = await client.get_user_delegation_key(*_validity(window))
+        with _lock:
+            _delegation_keys.clear()
+            _delegation_keys[window] = key
+    return key
+
+def signed_url(blob_name, container=SONGS_CONTAINER):
+    """A read URL for the blob, valid for at least one more signing window."""
+    window = sas_window()
+    url = _cached(container, blob_name, window)
+    if url:
+        return url
+    client = get_blob_service_client()
+    key = _delegation_key(client, window) if _uses_delegation(client) else None
+    return _remember(container, blob_name, window, _sign(client, container, blob_name, window, key))
+
+async def signed_url_async(blob_name, container=SONGS_CONTAINER):
+    window = sas_window()
+    url = _cached(container, blob_name, window)
+    if url:
+        return url
+    client = get_async_blob_service_client()
+    key = await _delegation_key_async(client, window) if _uses_delegation(client) else None
+    return _remember(container, blob_name, window, _sign(client, container, blob_name, window, key))
+
+def _audio_blob(song):
+    return song.pop("audioBlob", None) or blob_from_url(song.get("audioUrl"))
+
+def with_audio_url(song):
+    """The song with a freshly signed audioUrl in place of its stored blob path."""
+    blob_name = _audio_blob(song)
+    if blob_name:
+        song["audioUrl"] = signed_url(blob_name)
+    return song
+
+async def with_audio_url_async(song):
+    blob_name = _audio_blob(song)
+    if blob_name:
+        song["audioUrl"] = await signed_url_async(blob_name)
+    return song
@@ -0,0 +1,55 @@
+import os
+from bson import ObjectId
+from .projections import CHAT_PROJECTION
+
+# Chat history pages, newest last like the chat panel shows them.
+# The project workspace returns the latest page; GET /chat?projectId=...&before=<message id>
+# returns the page of messages older than the given one (the oldest the client has), so the
+# "load earlier" control walks back through the history one page at a time.
+# Pages are read newest first with one extra message to know if there is more, then reversed.
+# Messages are ordered by timestamp, with the _id breaking ties between equal timestamps.
+
+PAGE_SORT = [("timestamp", -1), ("_id", -1)]
+
+
+def page_size():
+    return max(1, int(os.getenv("CHAT_PAGE_SIZE", 50)))
+
+def _query(project_id, uid, anchor=None):
+    query = {"projectId": project_id, "userId": uid}
+    if anchor:
+        query["$or"] = [{"timestamp": {"$lt": anchor["timestamp"]}},
+                        {"timestamp": anchor["timestamp"], "_id": {"$lt": anchor["_id"]}}]
+    return query
+
+def _anchor_query(project_id, uid, before):
+    return {"_id": ObjectId(before), "projectId": project_id, "userId": uid}
+
+def _page(history, limit):
+    return {"messages": history[:limit][::-1], "hasMore": len(history) > limit}
+
+def page(db, uid, project_id, limit=None, before=None):
+    """
+    The page of `limit` messages before the message `before` (the latest page without it),
+    as {"messages", "hasMore"}. None if `before` is not a message of this chat.
+    """
+    limit = limit or page_size()
+    anchor = None
+    if before:
+        anchor = db.chat_history.find_one(_anchor_query(project_id, uid, before), {"timestamp": 1})
+        if not anchor:
+            return None
+    history = list(db.chat_history.find(_query(project_id, uid, anchor), CHAT_PROJECTION)
+                   .sort(PAGE_SORT).limit(limit + 1))
+    return _page(history, limit)
+
+async def page_async(db, uid, project_id, limit=None, before=None):
+    limit = limit or page_size()
+    anchor = None
+    if before:
+        anchor = await db.chat_history.find_one(_anchor_query(project_id, uid, before), {"timestamp": 1})
+        if not anchor:
+            return None
+    history = await db.chat_history.find(_query(project_id, uid, anchor), CHAT_PROJECTION) \
+        .sort(PAGE_SORT).limit(limit + 1).to_list(length=limit + 1)
+    return _page(history, limit)
@@ -0,0 +1,69 @@
+import logging
+
+# Chunk storage, split in two collections:
+#  - `docs` holds a chunk's text and metadata (what prompts, quizzes and topic labels read),
+#  - `doc_vectors` holds its embedding, with only the fields vector search and deletes filter on
+#    (metadata.projectId, metadata.source, contentHash). The Atlas `vector_index` is defined on it.
+# Both share the chunk's _id. Vector search runs on the lean collection and looks up the text of
+# the top-k hits only, so the index and the documents it scans stay small enough to stay in RAM,
+# and text reads never pull embeddings through the cache.
+# Writes go vectors first, then text: a chunk counts as stored (see stored_chunk_ids in
+# process_file/ingestion_logic.py) once its text is there, by which time its vector is too.
+# Chunks stored before the split keep their vector in `docs` until migrate_vectors() moves it
+# (`python -m shared.chunk_store`).
+
+TEXT_COLLECTION = "docs"
+VECTOR_COLLECTION = "doc_vectors"
+
+
+def vector_document(chunk):
+    """The doc_vectors entry of a chunk (a `docs` document that still has its vector)."""
+    metadata = chunk.get("metadata") or {}
+    entry = {
+        "_id": chunk["_id"],
+        "vector": chunk["vector"],
+        "metadata": {"projectId": metadata.get("projectId"), "source": metadata.get("source")}
+    }
+    if chunk.get("contentHash"):
+        entry["contentHash"] = chunk["contentHash"]
+    return entry
+
+def _insert_many(collection, documents):
+    from pymongo.errors import BulkWriteError
+    try:
+        # Unordered, so one duplicate (already stored by an earlier attempt) doesn't stop the rest
+        collection.insert_many(documents, ordered=False)
+    except BulkWriteError as e:
+        if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+            raise
+
+def insert_chunks(db, chunks):
+    """Stores chunks (with _ids and vectors) as a vector and a text document each."""
+    if not chunks:
+        return
+    _insert_many(db[VECTOR_COLLECTION], [vector_document(chunk) for chunk in chunks])
+    _insert_many(db[TEXT_COLLECTION], [{k: v for k, v in chunk.items() if k != "vector"} for chunk in chunks])
+
+def delete_chunks(db, chunk_filter):
+    """Deletes the chunks matching a filter on metadata.projectId / metadata.source / contentHash."""
+    db[VECTOR_COLLECTION].delete_many(chunk_filter)
+    return db[TEXT_COLLECTION].delete_many(chunk_filter)
+
+def migrate_vectors(db, batch_size=500):
+    """Moves vectors still stored in `docs` to doc_vectors. Safe to re-run and to interrupt."""
+    moved = 0
+    projection = {"vector": 1, "metadata.projectId": 1, "metadata.source": 1, "contentHash": 1}
+    while True:
+        batch = list(db[TEXT_COLLECTION].find({"vector": {"$exists": True}}, projection).limit(batch_size))
+        if not batch:
+            return moved
+        _insert_many(db[VECTOR_COLLECTION], [vector_document(chunk) for chunk in batch])
+        db[TEXT_COLLECTION].update_many({"_id": {"$in": [chunk["_id"] for chunk in batch]}}, {"$unset": {"vector": ""}})
+        moved += len(batch)
+        logging.info(f"Moved {moved} vectors to {VECTOR_COLLECTION}")
+
+
+if __name__ == "__main__":
+    from .clients import get_mongo_db
+    logging.basicConfig(level=logging.INFO)
+    print(f"Moved {migrate_vectors(get_mongo_db())} vectors")
@@ -1,15 +1,34 @@
 import os
-from openai import AzureOpenAI
-from pymongo import MongoClient
-from azure.storage.blob import BlobServiceClient
-from azure.core.credentials import AzureKeyCredential
-from azure.ai.documentintelligence import DocumentIntelligenceClient
+import asyncio
+import weakref
+import functools
+from .telemetry import mongo_command_listener, azure_client_hooks
 
-def get_openai_client():
+# SDK imports live inside the factories so each function only pays the import cost
+# (a large part of cold start) for the clients it actually uses. Sync clients are
+# thread-safe and cached per configuration, so they are built once per instance
+# (see shared/warmup.py) instead of once per request.
+
+@functools.lru_cache(maxsize=None)
+def _openai_client(api_key, azure_endpoint):
+    from openai import AzureOpenAI
     return AzureOpenAI(
-        api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+        api_key=api_key,
         api_version="2024-12-01-preview",
-        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT")
+        azure_endpoint=azure_endpoint
+    )
+
+def get_openai_client():
+    return _openai_client(os.getenv("AZURE_OPENAI_API_KEY"), os.getenv("AZURE_OPENAI_ENDPOINT"))
+
+@functools.lru_cache(maxsize=None)
+def _document_intelligence_client(endpoint, key):
+    from azure.core.credentials import AzureKeyCredential
+    from azure.ai.documentintelligence import DocumentIntelligenceClient
+    return DocumentIntelligenceClient(
+        endpoint=endpoint,
+        credential=AzureKeyCredential(key),
+        **azure_client_hooks("docintel")
     )
 
 def get_document_intelligence_client():
@@ -19,20 +38,95 @@ def get_document_intelligence_client():
     if not endpoint or not key:
         raise ValueError("AZURE_FORM_RECOGNIZER_ENDPOINT and AZURE_FORM_RECOGNIZER_KEY must be set")
 
-    return DocumentIntelligenceClient(endpoint=endpoint, credential=AzureKeyCredential(key))
+    return _document_intelligence_client(endpoint, key)
+
+@functools.lru_cache(maxsize=None)
+def _mongo_client(connection_string):
+    from pymongo import MongoClient
+    return MongoClient(connection_string, event_listeners=[mongo_command_listener()])
 
 def get_mongo_client():
     connection_string = os.getenv("MONGO_DB_CONNECTION_STRING")
     if not connection_string:
         raise ValueError("MONGO_DB_CONNECTION_STRING is not set")
-    return MongoClient(connection_string)
+    return _mongo_client(connection_string)
 
 def get_mongo_db():
     client = get_mongo_client()
     return client["mnemoniq"]
 
+@functools.lru_cache(maxsize=None)
+def _blob_service_client(connection_string):
+    from azure.storage.blob import BlobServiceClient
+    return BlobServiceClient.from_connection_string(
+        connection_string,
+        **azure_client_hooks("blob")
+    )
+
 def get_blob_service_client():
     connection_string = os.getenv("BLOB_STORAGE_CONNECTION_STRING")
     if not connection_string:
         raise ValueError("BLOB_STORAGE_CONNECTION_STRING must be set")
-    return BlobServiceClient.from_connection_string(connection_string)
+    return _blob_service_client(connection_string)
+
+@functools.lru_cache(maxsize=None)
+def _queue_service_client(connection_string):
+    from azure.storage.queue import QueueServiceClient
+    return QueueServiceClient.from_connection_string(
+        connection_string,
+        **azure_client_hooks("queue")
+    )
+
+def get_queue_service_client():
+    # Queues live in the same storage account as the blobs (Azurite locally)
+    connection_string = os.getenv("BLOB_STORAGE_CONNECTION_STRING")
+    if not connection_string:
+        raise ValueError("BLOB_STORAGE_CONNECTION_STRING must be set")
+    return _queue_service_client(connection_string)
+
+# Async clients
+# Async clients hold connection pools bound to the event loop they were created on.
+# The Functions worker runs every async invocation on one shared loop, so they are
+# created once per loop and reused across invocations instead of per request.
+_async_clients = weakref.WeakKeyDictionary()
+
+def _get_loop_client(name, factory):
+    loop = asyncio.get_running_loop()
+    clients = _async_clients.setdefault(loop, {})
+    client = clients.get(name)
+    if client is None:
+        client = factory()
+        clients[name] = client
+    return client
+
+def get_async_openai_client():
+    from openai import AsyncAzureOpenAI
+    return _get_loop_client("openai", lambda: AsyncAzureOpenAI(
+        api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+        api_version="2024-12-01-preview",
+        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT")
+    ))
+
+def get_async_mongo_client():
+    connection_string = os.getenv("MONGO_DB_CONNECTION_STRING")
+    if not connection_string:
+        raise ValueError("MONGO_DB_CONNECTION_STRING is not set")
+    from pymongo import AsyncMongoClient
+    return _get_loop_client("mongo", lambda: AsyncMongoClient(
+        connection_string,
+        event_listeners=[mongo_command_listener()]
+    ))
+
+def get_async_mongo_db():
+    client = get_async_mongo_client()
+    return client["mnemoniq"]
+
+def get_async_blob_service_client():
+    connection_string = os.getenv("BLOB_STORAGE_CONNECTION_STRING")
+    if not connection_string:
+        raise ValueError("BLOB_STORAGE_CONNECTION_STRING must be set")
+    from azure.storage.blob.aio import BlobServiceClient as AsyncBlobServiceClient
+    return _get_loop_client("blob", lambda: AsyncBlobServiceClient.from_connection_string(
+        connection_string,
+        **azure_client_hooks("blob")
+    ))
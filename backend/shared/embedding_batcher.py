@@ -0,0 +1,171 @@
+import os
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from .llm import create_embeddings, BACKGROUND
+from .telemetry import timed, current_record
+
+# Cross-document embedding batching.
+# Concurrent ingestion jobs on an instance (blob trigger invocations on the worker's thread
+# pool, or the ingestion scheduler's workers) hand their chunks to one aggregator instead of
+# each calling the embeddings endpoint. The aggregator collects inputs for up to
+# EMBED_BATCH_WINDOW_MS after the oldest one arrived, or until a batch reaches
+# EMBED_BATCH_MAX_INPUTS inputs / EMBED_BATCH_MAX_TOKENS estimated tokens, sends full batches
+# (at most EMBED_MAX_IN_FLIGHT at once) and routes every vector back to the job that asked
+# for it. A bulk upload of 30 files then costs a handful of large requests instead of 30+.
+
+def _embedding_deployment():
+    deployment = os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT")
+    if not deployment:
+        raise ValueError("AZURE_OPENAI_EMBEDDING_DEPLOYMENT is not set")
+    return deployment
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+def embed_batch(texts):
+    """Embeds one batch with Azure OpenAI. Returns (vectors in input order, model, prompt tokens)."""
+    deployment = _embedding_deployment()
+    response = create_embeddings(texts, deployment, lane=BACKGROUND)
+    data = sorted(response.data, key=lambda x: x.index)
+    usage = getattr(response, "usage", None)
+    return [item.embedding for item in data], deployment, getattr(usage, "prompt_tokens", 0) or 0
+
+
+class _Request:
+    __slots__ = ("vectors", "remaining", "error", "done", "record")
+
+    def __init__(self, size, record):
+        self.vectors = [None] * size
+        self.remaining = size
+        self.error = None
+        self.done = threading.Event()
+        self.record = record
+
+
+class EmbeddingAggregator:
+    def __init__(self, embed=None, window_ms=None, max_inputs=None, max_tokens=None, max_in_flight=None):
+        self.embed_batch = embed or embed_batch
+        self.window = (window_ms if window_ms is not None else float(os.getenv("EMBED_BATCH_WINDOW_MS", 50))) / 1000
+        self.max_inputs = max_inputs or int(os.getenv("EMBED_BATCH_MAX_INPUTS", 512))
+        self.max_tokens = max_tokens or int(os.getenv("EMBED_BATCH_MAX_TOKENS", 120000))
+        max_in_flight = max_in_flight or int(os.getenv("EMBED_MAX_IN_FLIGHT", 4))
+
+        self._condition = threading.Condition()
+        # Pending inputs: (request, index, text, tokens, arrived_at)
+        self._pending = deque()
+        self._pending_tokens = 0
+        self._results_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._pool = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="embedding-batch")
+        self._dispatcher = None
+        self.batches_sent = 0
+
+    @timed("embed.aggregated")
+    def embed(self, texts):
+        """Embeds `texts` as part of whatever batches are being formed. Blocks until all vectors are back."""
+        if not texts:
+            return []
+        request = _Request(len(texts), current_record())
+        now = time.monotonic()
+        with self._condition:
+            for index, text in enumerate(texts):
+                tokens = estimate_tokens(text)
+                self._pending.append((request, index, text, tokens, now))
+                self._pending_tokens += tokens
+            if self._dispatcher is None:
+                self._dispatcher = threading.Thread(target=self._dispatch, name="embedding-aggregator", daemon=True)
+                self._dispatcher.start()
+            self._condition.notify_all()
+
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.vectors
+
+    # Dispatcher
+
+    def _batch_ready(self):
+        if len(self._pending) >= self.max_inputs or self._pending_tokens >= self.max_tokens:
+            return True
+        return time.monotonic() - self._pending[0][4] >= self.window
+
+    def _take_batch(self):
+        batch = []
+        tokens = 0
+        while self._pending and len(batch) < self.max_inputs:
+            item = self._pending[0]
+            if batch and tokens + item[3] > self.max_tokens:
+                break
+            self._pending.popleft()
+            self._pending_tokens -= item[3]
+            tokens += item[3]
+            batch.append(item)
+        return batch
+
+    def _dispatch(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                while not self._batch_ready():
+                    self._condition.wait(max(0.0, self.window - (time.monotonic() - self._pending[0][4])))
+                batch = self._take_batch()
+            self._slots.acquire()
+            self._pool.submit(self._send, batch)
+
+    def _send(self, batch):
+        try:
+            try:
+                vectors, model, prompt_tokens = self.embed_batch([item[2] for item in batch])
+                if len(vectors) != len(batch):
+                    raise ValueError(f"Expected {len(batch)} embeddings, got {len(vectors)}")
+            except Exception as e:
+                logging.error(f"Error generating embeddings for a batch of {len(batch)} inputs: {e}")
+                self._fail(batch, e)
+                return
+            self.batches_sent += 1
+            self._attribute_usage(batch, model, prompt_tokens)
+
+            with self._results_lock:
+                for (request, index, _, _, _), vector in zip(batch, vectors):
+                    request.vectors[index] = vector
+                    request.remaining -= 1
+                    if request.remaining == 0 and request.error is None:
+                        request.done.set()
+        finally:
+            self._slots.release()
+
+    def _fail(self, batch, error):
+        with self._results_lock:
+            for request, _, _, _, _ in batch:
+                if request.error is None:
+                    request.error = error
+                    request.done.set()
+
+    @staticmethod
+    def _attribute_usage(batch, model, prompt_tokens):
+        # Split the batch's token usage across the invocations whose inputs were in it
+        shares = {}
+        for request, _, _, tokens, _ in batch:
+            shares[request] = shares.get(request, 0) + tokens
+        total = sum(shares.values()) or 1
+        for request, tokens in shares.items():
+            if request.record is not None:
+                share = round(prompt_tokens * tokens / total)
+                request.record.add_usage(model, prompt_tokens=share, total_tokens=share)
+
+
+_aggregator = None
+_aggregator_lock = threading.Lock()
+
+def get_embedding_aggregator():
+    """The instance-wide aggregator shared by all ingestion jobs."""
+    global _aggregator
+    if _aggregator is None:
+        with _aggregator_lock:
+            if _aggregator is None:
+                _aggregator = EmbeddingAggregator()
+    return _aggregator
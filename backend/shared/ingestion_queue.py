@@ -0,0 +1,55 @@
+import os
+import json
+import logging
+from datetime import datetime
+from .clients import get_queue_service_client
+from .telemetry import timed
+
+# Ingestion job queue.
+# When INGESTION_QUEUE_ENABLED is set, uploads enqueue one job per file into a storage
+# queue instead of relying on the `process_file` blob trigger. The jobs are drained by
+# the `ingestion_scheduler` function (see process_file/scheduler.py), which applies
+# per-project fairness, a concurrency cap and retries. Jobs that keep failing are moved
+# to the poison queue.
+
+def is_enabled():
+    return os.getenv("INGESTION_QUEUE_ENABLED", "false").lower() in ("1", "true", "yes")
+
+def queue_name():
+    return os.getenv("INGESTION_QUEUE_NAME", "ingestion-jobs")
+
+def poison_queue_name():
+    return f"{queue_name()}-poison"
+
+_created_queues = set()
+
+def get_queue_client(name=None):
+    name = name or queue_name()
+    client = get_queue_service_client().get_queue_client(name)
+    if name not in _created_queues:
+        try:
+            client.create_queue()
+        except Exception:
+            pass # Queue might exist
+        _created_queues.add(name)
+    return client
+
+def encode_job(project_id: str, filename: str) -> str:
+    return json.dumps({
+        "projectId": project_id,
+        "filename": filename,
+        "enqueuedAt": datetime.utcnow().isoformat()
+    })
+
+def decode_job(content: str) -> dict:
+    job = json.loads(content)
+    if not job.get("projectId") or not job.get("filename"):
+        raise ValueError(f"Invalid ingestion job: {content}")
+    return job
+
+@timed("queue.enqueue_ingestion_job")
+def enqueue_ingestion_job(project_id: str, filename: str, queue_client=None):
+    """Adds an ingestion job for docs/{project_id}/{filename}."""
+    queue_client = queue_client or get_queue_client()
+    queue_client.send_message(encode_job(project_id, filename))
+    logging.info(f"Enqueued ingestion job for {project_id}/{filename}")
@@ -0,0 +1,244 @@
+import os
+import time
+import logging
+from datetime import datetime, timedelta
+from bson.objectid import ObjectId
+from .clients import get_mongo_db
+
+# Per-document ingestion state.
+# Every uploaded file has a record in the `documents` collection (the same record that later
+# holds its summary) with:
+#   status            queued -> extracting -> embedding -> stored | failed
+#   progress          stage progress, e.g. {"chunksTotal": 40, "chunksEmbedded": 40}
+#   timings           milliseconds spent per stage, e.g. {"extractingMs": 812, "embeddingMs": 310}
+#   error             last failure message (failed only)
+#   statusUpdatedAt   ISO timestamp of the last transition
+#
+# The project's `processingCount` is the number of its documents in an active state. It only
+# changes when a document enters or leaves the active states, and each of those transitions is
+# a single atomic find_one_and_update on the document, so the count can't drift when documents
+# finish together or fail. The project status is derived from the count in the same update.
+#
+# Every change a status poll would see (transitions, progress, counts) also increments the
+# project's `statusVersion`, which the status feed (shared/status_feed.py) waits on.
+
+QUEUED = "queued"
+EXTRACTING = "extracting"
+EMBEDDING = "embedding"
+STORED = "stored"
+FAILED = "failed"
+
+ACTIVE_STATES = [QUEUED, EXTRACTING, EMBEDDING]
+
+# Fields returned to the status poll, so it never ships summaries around
+STATUS_PROJECTION = {"_id": 0, "filename": 1, "status": 1, "progress": 1, "timings": 1,
+                     "error": 1, "statusUpdatedAt": 1}
+PROJECT_STATUS_PROJECTION = {"status": 1, "processingCount": 1, "statusVersion": 1}
+
+def _now():
+    return datetime.utcnow().isoformat()
+
+def stale_after_minutes():
+    # A document that hasn't moved for this long is assumed lost (worker crashed / timed out)
+    return int(os.getenv("INGESTION_STALE_MINUTES", 30))
+
+def bump_status_version(db, project_id: str):
+    """Tells status feed waiters (and document list ETags) that the project's documents changed."""
+    if not ObjectId.is_valid(project_id):
+        return
+    db.projects.update_one({"_id": ObjectId(project_id)}, {"$inc": {"statusVersion": 1}})
+
+def bump_content_version(db, project_id: str):
+    """
+    The project's document content changed (a document stored, replaced or deleted). Unlike
+    statusVersion, progress and failures don't move it, so caches of generated content
+    (lyrics, see shared/song_cache.py) are keyed by it.
+    """
+    if not ObjectId.is_valid(project_id):
+        return
+    db.projects.update_one({"_id": ObjectId(project_id)}, {"$inc": {"contentVersion": 1}})
+
+def adjust_project(db, project_id: str, delta: int):
+    """
+    Adds `delta` to the project's processingCount (never below 0) and derives its status,
+    in one atomic update. Returns the updated {status, processingCount}.
+    """
+    from pymongo import ReturnDocument
+    project = db.projects.find_one_and_update(
+        {"_id": ObjectId(project_id)},
+        [
+            {"$set": {"processingCount": {"$max": [0, {"$add": [{"$ifNull": ["$processingCount", 0]}, delta]}]},
+                      "statusVersion": {"$add": [{"$ifNull": ["$statusVersion", 0]}, 1]}}},
+            {"$set": {"status": {"$cond": [{"$gt": ["$processingCount", 0]}, "processing", "ready"]}}}
+        ],
+        projection={"status": 1, "processingCount": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if project and project["status"] == "ready" and delta < 0:
+        logging.info(f"Project {project_id} is now READY.")
+    return project
+
+def mark_active(db, project_id: str, filename: str, state: str, extra: dict = None):
+    """
+    Moves a document into an active state (creating its record if needed). The project is
+    only counted once per document, however many active states it passes through.
+    """
+    from pymongo import ReturnDocument
+    update = {"status": state, "statusUpdatedAt": _now()}
+    unset = {"error": ""}
+    if state == QUEUED:
+        # A new upload starts a new run, drop what the previous one recorded
+        update["queuedAt"] = update["statusUpdatedAt"]
+        unset.update({"progress": "", "timings": ""})
+    update.update(extra or {})
+    previous = db.documents.find_one_and_update(
+        {"projectId": project_id, "filename": filename},
+        {"$set": update, "$unset": unset},
+        projection={"status": 1},
+        upsert=True,
+        return_document=ReturnDocument.BEFORE
+    )
+    if not previous or previous.get("status") not in ACTIVE_STATES:
+        adjust_project(db, project_id, 1)
+    else:
+        bump_status_version(db, project_id)
+
+def mark_finished(db, project_id: str, filename: str, state: str, error: str = None, extra: dict = None):
+    """
+    Moves a document from an active state to `state` (stored/failed). Returns False if the
+    document wasn't active, e.g. it was already finished by someone else or deleted.
+    """
+    update = {"status": state, "statusUpdatedAt": _now()}
+    if error is not None:
+        update["error"] = error[:1000]
+    update.update(extra or {})
+    previous = db.documents.find_one_and_update(
+        {"projectId": project_id, "filename": filename, "status": {"$in": ACTIVE_STATES}},
+        {"$set": update},
+        projection={"status": 1}
+    )
+    if not previous:
+        return False
+    adjust_project(db, project_id, -1)
+    return True
+
+def fail_stale(db, project_id: str, documents: list):
+    """Marks active documents that haven't moved for too long as failed. Returns how many."""
+    cutoff = (datetime.utcnow() - timedelta(minutes=stale_after_minutes())).isoformat()
+    failed = 0
+    for doc in documents:
+        if doc.get("status") in ACTIVE_STATES and (doc.get("statusUpdatedAt") or "") < cutoff:
+            if mark_finished(db, project_id, doc["filename"], FAILED, error="Processing timed out"):
+                doc["status"] = FAILED
+                doc["error"] = "Processing timed out"
+                failed += 1
+    return failed
+
+def reconcile_project(db, project_id: str, project: dict, documents: list):
+    """
+    Corrects a project whose processingCount disagrees with its documents (records created
+    before per-document tracking, manual edits). Compare-and-set, so a concurrent transition wins.
+    """
+    from pymongo import ReturnDocument
+    active = sum(1 for doc in documents if doc.get("status") in ACTIVE_STATES)
+    current = project.get("processingCount", 0)
+    if current == active:
+        return project
+    # A transition in flight updates the document first and the project right after, so only
+    # trust the documents once nothing has moved for a while
+    settled = (datetime.utcnow() - timedelta(seconds=60)).isoformat()
+    if any((doc.get("statusUpdatedAt") or "") > settled for doc in documents):
+        return project
+    logging.warning(f"Project {project_id} processingCount {current} does not match {active} active documents, correcting")
+    updated = db.projects.find_one_and_update(
+        {"_id": ObjectId(project_id), "processingCount": current if current else {"$in": [0, None]}},
+        {"$set": {"processingCount": active, "status": "processing" if active > 0 else "ready"},
+         "$inc": {"statusVersion": 1}},
+        projection=PROJECT_STATUS_PROJECTION,
+        return_document=ReturnDocument.AFTER
+    )
+    return updated or project
+
+def project_status(db, project_id: str, uid: str = None):
+    """
+    The project's ingestion status with per-document progress (no summaries), or None if the
+    project doesn't exist or isn't owned by `uid`. Fails stale documents on the way.
+    """
+    query = {"_id": ObjectId(project_id)}
+    if uid is not None:
+        query["ownerId"] = uid
+    project = db.projects.find_one(query, PROJECT_STATUS_PROJECTION)
+    if not project:
+        return None
+
+    docs = list(db.documents.find({"projectId": project_id}, STATUS_PROJECTION))
+    # Documents whose worker died never finish on their own
+    if fail_stale(db, project_id, docs):
+        project = db.projects.find_one({"_id": ObjectId(project_id)}, PROJECT_STATUS_PROJECTION)
+    project = reconcile_project(db, project_id, project, docs)
+    return {
+        "status": project.get("status"),
+        "processingCount": project.get("processingCount", 0),
+        "version": project.get("statusVersion", 0),
+        "documents": docs
+    }
+
+
+class DocumentIngestion:
+    """
+    Tracks one run of process_document: stage transitions, progress and per-stage timings.
+    Failures while recording state are logged and never fail the ingestion itself.
+    """
+
+    def __init__(self, project_id: str, filename: str, db=None):
+        self.project_id = project_id
+        self.filename = filename
+        self.db = db if db is not None else get_mongo_db()
+        self.state = None
+        self.started = time.perf_counter()
+        self.stage_started = self.started
+        self.timings = {}
+
+    def _close_stage(self):
+        now = time.perf_counter()
+        if self.state:
+            self.timings[f"{self.state}Ms"] = round((now - self.stage_started) * 1000)
+        self.stage_started = now
+
+    def _timing_fields(self):
+        return {f"timings.{key}": value for key, value in self.timings.items()}
+
+    def stage(self, state: str, **progress):
+        self._close_stage()
+        self.state = state
+        extra = self._timing_fields()
+        extra.update({f"progress.{key}": value for key, value in progress.items()})
+        try:
+            mark_active(self.db, self.project_id, self.filename, state, extra)
+        except Exception as e:
+            logging.error(f"Error recording {state} for {self.filename}: {e}")
+
+    def progress(self, **progress):
+        try:
+            self.db.documents.update_one(
+                {"projectId": self.project_id, "filename": self.filename},
+                {"$set": {f"progress.{key}": value for key, value in progress.items()}}
+            )
+            bump_status_version(self.db, self.project_id)
+        except Exception as e:
+            logging.error(f"Error recording progress for {self.filename}: {e}")
+
+    def _finish(self, state: str, error: str = None):
+        self._close_stage()
+        self.timings["totalMs"] = round((time.perf_counter() - self.started) * 1000)
+        self.state = state
+        try:
+            mark_finished(self.db, self.project_id, self.filename, state, error, self._timing_fields())
+        except Exception as e:
+            logging.error(f"Error recording {state} for {self.filename}: {e}")
+
+    def stored(self):
+        self._finish(STORED)
+
+    def failed(self, error):
+        self._finish(FAILED, str(error) or type(error).__name__)
@@ -0,0 +1,282 @@
+import os
+import time
+import asyncio
+import logging
+import functools
+import threading
+import contextvars
+from collections import deque
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from .clients import get_openai_client, get_async_openai_client
+from .rate_governor import get_rate_governor, INTERACTIVE, BACKGROUND
+from .telemetry import record_usage, set_attribute, current_record
+
+# Azure OpenAI calls.
+# All chat completions and embeddings go through these helpers so they are admitted by the
+# rate governor (shared/rate_governor.py) in the caller's lane, usage is recorded, and 429s
+# are retried here with the governor's back-off instead of the SDK's own blind retries.
+# Async calls also honour the request's deadline (see with_deadline): waiting for the governor,
+# the call itself and retries all stop when it runs out. chat_completion_async can hedge a
+# slow call with a duplicate request and fall back to other deployments.
+
+DEFAULT_DEADLINES = {"api_chat": 30, "api_quiz": 90, "api_songs": 60}
+
+_deadline = contextvars.ContextVar("llm_deadline", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request's LLM deadline ran out before a response came back."""
+
+
+def deadline_for(endpoint):
+    """Seconds an endpoint may spend on LLM calls, LLM_DEADLINE_<ENDPOINT> overrides the default."""
+    return float(os.getenv(f"LLM_DEADLINE_{endpoint.upper()}", DEFAULT_DEADLINES.get(endpoint, 60)))
+
+def with_deadline(endpoint):
+    """Decorator for async entry points: every LLM call made during the invocation shares one deadline."""
+    def decorator(f):
+        @functools.wraps(f)
+        async def wrapper(*args, **kwargs):
+            token = _deadline.set(time.monotonic() + deadline_for(endpoint))
+            try:
+                return await f(*args, **kwargs)
+            finally:
+                _deadline.reset(token)
+        return wrapper
+    return decorator
+
+def time_left():
+    """Seconds until the current request's deadline, None when there is none."""
+    deadline = _deadline.get()
+    return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+
+class LatencyTracker:
+    """Recent call latencies per deployment, used to pick the hedge delay, and the hedge budget."""
+
+    def __init__(self, size=200):
+        self.size = size
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._calls = {}
+        self._hedges = {}
+
+    def observe(self, deployment, seconds):
+        with self._lock:
+            self._samples.setdefault(deployment, deque(maxlen=self.size)).append(seconds)
+
+    def percentile(self, deployment, pct):
+        with self._lock:
+            samples = sorted(self._samples.get(deployment) or [])
+        if len(samples) < 20:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+    def count_call(self, deployment):
+        with self._lock:
+            self._calls[deployment] = self._calls.get(deployment, 0) + 1
+
+    def take_hedge(self, deployment, ratio):
+        """Allows a hedge while hedges stay within `ratio` of calls."""
+        with self._lock:
+            hedges = self._hedges.get(deployment, 0)
+            if hedges > ratio * self._calls.get(deployment, 0):
+                return False
+            self._hedges[deployment] = hedges + 1
+            return True
+
+_latencies = LatencyTracker()
+
+
+def _max_retries():
+    return int(os.getenv("OPENAI_RATE_LIMIT_RETRIES", 3))
+
+def _text_tokens(value):
+    if isinstance(value, str):
+        return len(value) // 4 + 1
+    if isinstance(value, list):
+        return sum(_text_tokens(item) for item in value)
+    if isinstance(value, dict):
+        return _text_tokens(value.get("content") or "") + 4
+    return 1
+
+def estimate_chat_tokens(kwargs):
+    # Prompt estimate plus the completion budget, which is what Azure counts against TPM at admission
+    return _text_tokens(kwargs.get("messages") or []) + (kwargs.get("max_tokens") or 1000)
+
+def estimate_embedding_tokens(inputs):
+    return _text_tokens(inputs)
+
+def retry_after_seconds(error, attempt):
+    """Reads Retry-After (ms or seconds or HTTP date) from a 429, or falls back to exponential back-off."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if value:
+            try:
+                return float(value)
+            except ValueError:
+                return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except Exception:
+        pass
+    return min(2 ** attempt, 30)
+
+def _is_rate_limited(error):
+    return getattr(error, "status_code", None) == 429 or type(error).__name__ == "RateLimitError"
+
+def _used_tokens(response):
+    usage = getattr(response, "usage", None)
+    return getattr(usage, "total_tokens", 0) if usage else 0
+
+def _note_wait(waited):
+    if waited and current_record() is not None:
+        set_attribute("llm.rate_wait_ms", round(waited * 1000, 1))
+
+def _call(create, deployment, estimated, lane):
+    governor = get_rate_governor()
+    attempt = 0
+    while True:
+        _note_wait(governor.acquire(deployment, estimated, lane))
+        try:
+            response = create()
+        except Exception as e:
+            if not _is_rate_limited(e) or attempt >= _max_retries():
+                raise
+            attempt += 1
+            governor.record_rate_limited(deployment, retry_after_seconds(e, attempt))
+            continue
+        governor.record_success(deployment, estimated, _used_tokens(response))
+        record_usage(response, deployment)
+        return response
+
+async def _call_async(create, deployment, estimated, lane, admitted=False):
+    governor = get_rate_governor()
+    attempt = 0
+    while True:
+        try:
+            if not admitted:
+                _note_wait(await governor.acquire_async(deployment, estimated, lane, timeout=time_left()))
+            admitted = False
+            started = time.monotonic()
+            left = time_left()
+            response = await (create() if left is None else asyncio.wait_for(create(), left))
+        except (TimeoutError, asyncio.TimeoutError) as e:
+            raise DeadlineExceeded(str(e) or f"{deployment} didn't answer before the deadline") from e
+        except Exception as e:
+            if not _is_rate_limited(e) or attempt >= _max_retries():
+                raise
+            attempt += 1
+            governor.record_rate_limited(deployment, retry_after_seconds(e, attempt))
+            continue
+        _latencies.observe(deployment, time.monotonic() - started)
+        governor.record_success(deployment, estimated, _used_tokens(response))
+        record_usage(response, deployment)
+        return response
+
+def _hedge_delay(deployment):
+    """Observed LLM_HEDGE_PERCENTILE latency of the deployment, LLM_HEDGE_DELAY_MS until there are enough samples."""
+    delay = _latencies.percentile(deployment, float(os.getenv("LLM_HEDGE_PERCENTILE", 95)))
+    if delay is None:
+        delay = float(os.getenv("LLM_HEDGE_DELAY_MS", 5000)) / 1000
+    return max(delay, float(os.getenv("LLM_HEDGE_MIN_DELAY_MS", 500)) / 1000)
+
+def _hedge_target(deployments, estimated, lane):
+    """First deployment with spare budget for a duplicate call, admitted without waiting."""
+    if not _latencies.take_hedge(deployments[0], float(os.getenv("LLM_HEDGE_MAX_RATIO", 0.1))):
+        return None
+    governor = get_rate_governor()
+    for deployment in deployments:
+        if governor.try_acquire(deployment, estimated, lane):
+            return deployment
+    return None
+
+async def _hedged_call(make_create, deployments, estimated, lane):
+    """
+    Sends the call to deployments[0] and, if it hasn't answered after the hedge delay, a duplicate
+    to the first deployment with spare budget. The first success wins and the other is cancelled.
+    """
+    primary = deployments[0]
+    _latencies.count_call(primary)
+    tasks = {asyncio.ensure_future(_call_async(make_create(primary), primary, estimated, lane)): primary}
+    try:
+        delay = _hedge_delay(primary)
+        left = time_left()
+        if left is None or delay < left:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                target = _hedge_target(deployments, estimated, lane)
+                if target:
+                    set_attribute("llm.hedged", target)
+                    tasks[asyncio.ensure_future(
+                        _call_async(make_create(target), target, estimated, lane, admitted=True))] = target
+
+        pending, error = set(tasks), None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if len(tasks) > 1:
+                        set_attribute("llm.hedge_won", task is not next(iter(tasks)))
+                    return task.result()
+                error = error or task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+def _should_fall_back(error):
+    if isinstance(error, DeadlineExceeded):
+        # Only worth it when the deployment was blocked, not when the request is out of time
+        left = time_left()
+        return left is not None and left > 1.0
+    status = getattr(error, "status_code", None) or 0
+    return _is_rate_limited(error) or status >= 500 or type(error).__name__ in ("APIConnectionError", "APITimeoutError")
+
+def chat_completion(lane=BACKGROUND, **kwargs):
+    """client.chat.completions.create(**kwargs) through the rate governor."""
+    client = get_openai_client().with_options(max_retries=0)
+    return _call(lambda: client.chat.completions.create(**kwargs), kwargs["model"],
+                 estimate_chat_tokens(kwargs), lane)
+
+async def chat_completion_async(lane=INTERACTIVE, hedge=False, fallbacks=(), **kwargs):
+    """
+    Async chat completion through the rate governor, within the request's deadline.
+    hedge      duplicate the call if it is slower than the deployment's usual tail and take the first answer.
+    fallbacks  deployments to try, in order, when kwargs["model"] is throttled past the deadline or failing.
+    """
+    client = get_async_openai_client().with_options(max_retries=0)
+    estimated = estimate_chat_tokens(kwargs)
+
+    def make_create(deployment):
+        return lambda: client.chat.completions.create(**{**kwargs, "model": deployment})
+
+    deployments = [kwargs["model"]] + [d for d in fallbacks if d and d != kwargs["model"]]
+    for i, deployment in enumerate(deployments):
+        try:
+            if hedge:
+                return await _hedged_call(make_create, deployments[i:], estimated, lane)
+            return await _call_async(make_create(deployment), deployment, estimated, lane)
+        except Exception as e:
+            if i == len(deployments) - 1 or not _should_fall_back(e):
+                raise
+            logging.warning(f"Chat completion on {deployment} failed ({e}), falling back to {deployments[i + 1]}")
+            set_attribute("llm.fallback", deployments[i + 1])
+
+def fallback_deployments():
+    """Chat deployments to fall back to, from AZURE_OPENAI_CHAT_FALLBACK_DEPLOYMENTS (comma separated)."""
+    return [d.strip() for d in os.getenv("AZURE_OPENAI_CHAT_FALLBACK_DEPLOYMENTS", "").split(",") if d.strip()]
+
+def create_embeddings(input, model, lane=BACKGROUND):
+    client = get_openai_client().with_options(max_retries=0)
+    return _call(lambda: client.embeddings.create(input=input, model=model), model,
+                 estimate_embedding_tokens(input), lane)
+
+async def create_embeddings_async(input, model, lane=INTERACTIVE):
+    client = get_async_openai_client().with_options(max_retries=0)
+    return await _call_async(lambda: client.embeddings.create(input=input, model=model), model,
+                             estimate_embedding_tokens(input), lane)
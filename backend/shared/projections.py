@@ -0,0 +1,15 @@
+# Fields the frontend reads from each collection, shared by the list endpoints and the
+# project workspace so both return the same shape without fetching what nobody shows.
+
+PROJECT_PROJECTION = {"name": 1, "subject": 1, "status": 1, "processingCount": 1, "createdAt": 1}
+DOCUMENT_PROJECTION = {"filename": 1, "summary": 1, "uploadedAt": 1, "status": 1, "progress": 1, "error": 1}
+CHAT_PROJECTION = {"message": 1, "answer": 1, "timestamp": 1}
+SONG_PROJECTION = {"title": 1, "genre": 1, "lyrics": 1, "originalPrompt": 1, "audioBlob": 1, "audioUrl": 1,
+                   "status": 1, "createdAt": 1}
+
+# Version counters on the project, moved by every change to its documents, chat and songs
+VERSION_PROJECTION = {"statusVersion": 1, "chatVersion": 1, "songVersion": 1}
+
+# Chunks in `docs`, as vector search returns them (text reads never need more; vectors live
+# in doc_vectors, see shared/chunk_store.py)
+CHUNK_PROJECTION = {"text": 1, "chunk_index": 1, "metadata": 1}
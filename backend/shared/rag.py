@@ -1,27 +1,126 @@
 import os
+import asyncio
 import logging
-from .clients import get_openai_client, get_mongo_db
+from concurrent.futures import ThreadPoolExecutor
+from .clients import get_mongo_db, get_async_mongo_db
+from .llm import create_embeddings, create_embeddings_async, INTERACTIVE
+from .telemetry import timed
+from .chunk_store import TEXT_COLLECTION, VECTOR_COLLECTION
 
-def generate_embedding(text):
-    openai_client = get_openai_client()
+# Runs the searches of a multi-query perform_vector_search concurrently; shared by all calls
+# (threads are started on first use)
+_search_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="vector-search")
+
+def _embedding_deployment():
     deployment = os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT")
     if not deployment:
         raise ValueError("Embedding deployment not configured")
+    return deployment
+
+def _vector_search_pipeline(project_id, query_vector, limit):
+    # Searches the vector-only collection and joins the text of the top `limit` hits by chunk id
+    return [
+        {
+            "$vectorSearch": {
+                "index": "vector_index",
+                "path": "vector",
+                "queryVector": query_vector,
+                "numCandidates": 100,
+                "limit": limit,
+                "filter": {
+                    "metadata.projectId": project_id
+                }
+            }
+        },
+        {"$project": {"score": {"$meta": "vectorSearchScore"}}},
+        {"$lookup": {"from": TEXT_COLLECTION, "localField": "_id", "foreignField": "_id", "as": "chunk"}},
+        # A vector whose text isn't stored (yet) is skipped
+        {"$unwind": "$chunk"},
+        {
+            "$project": {
+                "_id": 0,
+                "text": "$chunk.text",
+                "chunk_index": "$chunk.chunk_index",
+                "metadata": "$chunk.metadata",
+                "score": 1
+            }
+        }
+    ]
+
+@timed("rag.generate_embedding")
+def generate_embedding(text):
+    deployment = _embedding_deployment()
 
     try:
-        response = openai_client.embeddings.create(input=[text], model=deployment)
+        response = create_embeddings([text], deployment, lane=INTERACTIVE)
         return response.data[0].embedding
     except Exception as e:
         logging.error(f"Error generating embedding: {e}")
         raise e
 
-def perform_vector_search(project_id, query_text, limit=5):
+def _embed_many(response):
+    return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+@timed("rag.generate_embeddings")
+def generate_embeddings(texts):
+    """Embeds several queries in one embeddings call."""
+    try:
+        return _embed_many(create_embeddings(list(texts), _embedding_deployment(), lane=INTERACTIVE))
+    except Exception as e:
+        logging.error(f"Error generating embeddings: {e}")
+        raise e
+
+def _chunk_key(doc):
+    metadata = doc.get("metadata") or {}
+    if doc.get("chunk_index") is None:
+        return (metadata.get("source"), doc.get("text"))
+    return (metadata.get("source"), doc["chunk_index"])
+
+def merge_results(result_lists, limit=None):
+    """
+    Merges the results of several queries: interleaved by rank so every query gets its best
+    hits in, each chunk once with its best score.
+    """
+    merged = {}
+    for rank in range(max((len(results) for results in result_lists), default=0)):
+        for results in result_lists:
+            if rank >= len(results):
+                continue
+            doc = results[rank]
+            key = _chunk_key(doc)
+            if key in merged:
+                merged[key]["score"] = max(merged[key].get("score") or 0, doc.get("score") or 0)
+            else:
+                merged[key] = doc
+    merged = list(merged.values())
+    return merged[:limit] if limit else merged
+
+@timed("rag.perform_vector_search")
+def perform_vector_search(project_id, query_text, limit=5, total=None):
     """
-    Generates embedding for query_text and searches in 'docs' collection
+    Generates embedding for query_text and searches the project's chunks
     filtered by project_id.
+    query_text can also be a list of queries: they are embedded in one call, searched
+    concurrently (`limit` results each) and merged without duplicate chunks, at most `total`.
     Returns list of document text.
     """
     db = get_mongo_db()
+
+    if not isinstance(query_text, str):
+        queries = list(query_text)
+        if not queries:
+            return []
+        query_vectors = generate_embeddings(queries)
+        try:
+            logging.info(f"Searching vectors for project_id: {project_id} ({len(queries)} queries)")
+            result_lists = list(_search_pool.map(
+                lambda vector: list(db[VECTOR_COLLECTION].aggregate(_vector_search_pipeline(project_id, vector, limit))),
+                query_vectors
+            ))
+            return merge_results(result_lists, total)
+        except Exception as e:
+            logging.error(f"Error searching vectors: {e}")
+            raise e
     
     # 1. Generate Embedding
     try:
@@ -31,33 +130,68 @@ def perform_vector_search(project_id, query_text, limit=5):
         raise
 
     # 2. Vector Search Pipeline
-    pipeline = [
-        {
-            "$vectorSearch": {
-                "index": "vector_index",
-                "path": "vector",
-                "queryVector": query_vector,
-                "numCandidates": 100,
-                "limit": limit,
-                "filter": {
-                    "metadata.projectId": project_id
-                }
-            }
-        },
-        {
-            "$project": {
-                "_id": 0,
-                "text": 1,
-                "metadata": 1,
-                "score": { "$meta": "vectorSearchScore" }
-            }
-        }
-    ]
+    pipeline = _vector_search_pipeline(project_id, query_vector, limit)
 
     try:
         logging.info(f"Searching vectors for project_id: {project_id}")
-        results = list(db.docs.aggregate(pipeline))
+        results = list(db[VECTOR_COLLECTION].aggregate(pipeline))
         return results
     except Exception as e:
         logging.error(f"Error searching vectors: {e}")
         raise e
+
+# Async variants
+# Used by the async HTTP handlers. The embedding and the search are split so callers can
+# run the embedding concurrently with their own independent reads (e.g. ownership checks).
+
+@timed("rag.generate_embedding")
+async def generate_embedding_async(text):
+    deployment = _embedding_deployment()
+
+    try:
+        response = await create_embeddings_async([text], deployment, lane=INTERACTIVE)
+        return response.data[0].embedding
+    except Exception as e:
+        logging.error(f"Error generating embedding: {e}")
+        raise e
+
+@timed("rag.vector_search")
+async def vector_search_async(project_id, query_vector, limit=5):
+    """Runs the vector search for an already embedded query."""
+    db = get_async_mongo_db()
+    pipeline = _vector_search_pipeline(project_id, query_vector, limit)
+
+    try:
+        logging.info(f"Searching vectors for project_id: {project_id}")
+        cursor = await db[VECTOR_COLLECTION].aggregate(pipeline)
+        return await cursor.to_list()
+    except Exception as e:
+        logging.error(f"Error searching vectors: {e}")
+        raise e
+
+@timed("rag.generate_embeddings")
+async def generate_embeddings_async(texts):
+    """Embeds several queries in one embeddings call."""
+    try:
+        return _embed_many(await create_embeddings_async(list(texts), _embedding_deployment(), lane=INTERACTIVE))
+    except Exception as e:
+        logging.error(f"Error generating embeddings: {e}")
+        raise e
+
+async def vector_search_many_async(project_id, query_vectors, limit=5, total=None):
+    """Searches for several embedded queries concurrently and merges the results (at most `total`)."""
+    result_lists = await asyncio.gather(*(
+        vector_search_async(project_id, vector, limit) for vector in query_vectors
+    ))
+    return merge_results(result_lists, total)
+
+async def perform_vector_search_async(project_id, query_text, limit=5, total=None):
+    """Async equivalent of perform_vector_search."""
+    if not isinstance(query_text, str):
+        query_text = list(query_text)
+        if not query_text:
+            return []
+        query_vectors = await generate_embeddings_async(query_text)
+        return await vector_search_many_async(project_id, query_vectors, limit, total)
+    query_vector = await generate_embedding_async(query_text)
+    return await vector_search_async(project_id, query_vector, limit)
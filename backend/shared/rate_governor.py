@@ -0,0 +1,321 @@
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from datetime import datetime, timedelta
+
+# Client-side Azure OpenAI rate governor.
+# Every call to Azure OpenAI (see shared/llm.py) is admitted through two token buckets per
+# deployment: requests per minute and tokens per minute. Callers are in one of two lanes:
+#  - interactive (chat, quiz, songs, query embeddings) may use the whole budget,
+#  - background (ingestion summaries and embeddings) only runs while interactive callers
+#    aren't waiting and leaves RATE_GOVERNOR_INTERACTIVE_RESERVE of each bucket untouched,
+# so an ingestion burst can't push chat into 429s.
+# Limits adapt: a 429 cuts the deployment's rate (multiplicative decrease) and blocks it
+# for the Retry-After period, successes slowly restore it (additive increase).
+# Across instances the budget is shared through Mongo: each instance holds a lease per
+# deployment and takes 1/N of the configured quota, and 429 back-offs are published so
+# every instance pauses, not just the one that was throttled.
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+
+MIN_FACTOR = 0.1
+DECREASE = 0.7
+INCREASE = 0.01
+LEASE_SECONDS = 60
+
+INSTANCE_ID = os.getenv("WEBSITE_INSTANCE_ID") or uuid.uuid4().hex
+
+
+def _configured_limits(deployment):
+    """(requests per minute, tokens per minute) for a deployment."""
+    overrides = {}
+    try:
+        overrides = json.loads(os.getenv("OPENAI_RATE_LIMITS") or "{}")
+    except ValueError:
+        logging.warning("OPENAI_RATE_LIMITS is not valid JSON, using defaults")
+    limits = overrides.get(deployment, {})
+    rpm = limits.get("rpm") or int(os.getenv("OPENAI_DEFAULT_RPM", 600))
+    tpm = limits.get("tpm") or int(os.getenv("OPENAI_DEFAULT_TPM", 300000))
+    return rpm, tpm
+
+
+class TokenBucket:
+    """
+    Refills continuously at `per_minute`. Holds at most 10 seconds worth, which is the
+    window Azure OpenAI enforces its per-minute quota over.
+    """
+
+    def __init__(self, per_minute):
+        self.set_rate(per_minute)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def set_rate(self, per_minute):
+        self.rate = max(per_minute, 1) / 60.0
+        self.capacity = max(self.rate * 10, 1.0)
+        if hasattr(self, "level"):
+            self.level = min(self.level, self.capacity)
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_for(self, amount, reserve):
+        """Seconds until `amount` can be taken leaving `reserve`, 0 if it can be taken now."""
+        # A request bigger than the bucket is let through once the bucket is full (it goes into debt)
+        needed = min(amount + reserve, self.capacity)
+        if self.level >= needed:
+            return 0.0
+        return (needed - self.level) / self.rate
+
+
+class DeploymentLimiter:
+    def __init__(self, deployment):
+        self.deployment = deployment
+        self.rpm, self.tpm = _configured_limits(deployment)
+        self.factor = 1.0
+        self.share = 1.0
+        self.requests = TokenBucket(self.rpm)
+        self.tokens = TokenBucket(self.tpm)
+        self.blocked_until = 0.0
+        self.last_decrease = 0.0
+        self.interactive_waiting = 0
+
+    def apply_rates(self):
+        scale = self.factor * self.share
+        self.requests.set_rate(self.rpm * scale)
+        self.tokens.set_rate(self.tpm * scale)
+
+    def try_acquire(self, tokens, lane, now):
+        """Takes capacity for one call and returns 0, or returns how long to wait before trying again."""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if lane == BACKGROUND and self.interactive_waiting:
+            return 0.05
+        self.requests.refill(now)
+        self.tokens.refill(now)
+        reserve = float(os.getenv("RATE_GOVERNOR_INTERACTIVE_RESERVE", 0.25)) if lane == BACKGROUND else 0.0
+        wait = max(self.requests.wait_for(1, reserve * self.requests.capacity),
+                   self.tokens.wait_for(tokens, reserve * self.tokens.capacity))
+        if wait > 0:
+            return max(wait, 0.01)
+        self.requests.level -= 1
+        self.tokens.level -= tokens
+        return 0.0
+
+
+class RateGovernor:
+    def __init__(self, shared_state=None):
+        self._lock = threading.Lock()
+        self._limiters = {}
+        self.shared_state = shared_state
+
+    def _limiter(self, deployment):
+        limiter = self._limiters.get(deployment)
+        if limiter is None:
+            limiter = self._limiters[deployment] = DeploymentLimiter(deployment)
+        return limiter
+
+    def _try(self, deployment, tokens, lane):
+        with self._lock:
+            return self._limiter(deployment).try_acquire(tokens, lane, time.monotonic())
+
+    def _waiting(self, deployment, lane, delta):
+        if lane == INTERACTIVE:
+            with self._lock:
+                self._limiter(deployment).interactive_waiting += delta
+
+    def _max_wait(self, lane):
+        default = 30 if lane == INTERACTIVE else 600
+        return float(os.getenv(f"RATE_GOVERNOR_MAX_WAIT_{lane.upper()}", default))
+
+    def try_acquire(self, deployment, tokens, lane=BACKGROUND):
+        """Admits the call only if it fits right now, without waiting."""
+        return self._try(deployment, tokens, lane) == 0
+
+    def _check_timeout(self, deployment, start, wait, timeout):
+        # With a deadline, fail as soon as the wait is known to overrun it so the caller can fall back
+        if timeout is not None and time.monotonic() - start + wait > timeout:
+            raise TimeoutError(f"Rate governor: {deployment} can't admit the call within {timeout:.1f}s")
+
+    def acquire(self, deployment, tokens, lane=BACKGROUND, timeout=None):
+        """
+        Blocks until the call is admitted. Returns seconds waited. Raises TimeoutError if
+        `timeout` is given and admission would take longer.
+        """
+        if self.shared_state:
+            self.shared_state.refresh_soon(self)
+        start = time.monotonic()
+        wait = self._try(deployment, tokens, lane)
+        if wait == 0:
+            return 0.0
+        self._waiting(deployment, lane, 1)
+        try:
+            while wait > 0:
+                self._check_timeout(deployment, start, wait, timeout)
+                if time.monotonic() - start > self._max_wait(lane):
+                    # Let it through, the retry on 429 still protects the deployment
+                    logging.warning(f"Rate governor: {lane} call to {deployment} waited too long, sending anyway")
+                    break
+                time.sleep(min(wait, 1.0))
+                wait = self._try(deployment, tokens, lane)
+        finally:
+            self._waiting(deployment, lane, -1)
+        return time.monotonic() - start
+
+    async def acquire_async(self, deployment, tokens, lane=INTERACTIVE, timeout=None):
+        """Async version of acquire, waits without blocking the event loop."""
+        import asyncio
+        if self.shared_state:
+            self.shared_state.refresh_soon(self)
+        start = time.monotonic()
+        wait = self._try(deployment, tokens, lane)
+        if wait == 0:
+            return 0.0
+        self._waiting(deployment, lane, 1)
+        try:
+            while wait > 0:
+                self._check_timeout(deployment, start, wait, timeout)
+                if time.monotonic() - start > self._max_wait(lane):
+                    logging.warning(f"Rate governor: {lane} call to {deployment} waited too long, sending anyway")
+                    break
+                await asyncio.sleep(min(wait, 1.0))
+                wait = self._try(deployment, tokens, lane)
+        finally:
+            self._waiting(deployment, lane, -1)
+        return time.monotonic() - start
+
+    def record_success(self, deployment, estimated_tokens, actual_tokens):
+        with self._lock:
+            limiter = self._limiter(deployment)
+            if actual_tokens:
+                # Settle the estimate against what the call really used
+                limiter.tokens.level += estimated_tokens - actual_tokens
+            if limiter.factor < 1.0:
+                limiter.factor = min(1.0, limiter.factor + INCREASE)
+                limiter.apply_rates()
+
+    def record_rate_limited(self, deployment, retry_after):
+        now = time.monotonic()
+        with self._lock:
+            limiter = self._limiter(deployment)
+            limiter.blocked_until = max(limiter.blocked_until, now + retry_after)
+            # Several in-flight calls usually hit the same 429 window, only decrease once per window
+            if now - limiter.last_decrease > max(retry_after, 1.0):
+                limiter.factor = max(MIN_FACTOR, limiter.factor * DECREASE)
+                limiter.last_decrease = now
+                limiter.apply_rates()
+            factor = limiter.factor
+        logging.warning(f"Azure OpenAI 429 on {deployment}: backing off {retry_after:.1f}s, rate factor {factor:.2f}")
+        if self.shared_state:
+            self.shared_state.publish_soon(deployment, retry_after, factor)
+
+    def apply_shared(self, deployment, share=None, blocked_for=None, factor=None):
+        with self._lock:
+            limiter = self._limiter(deployment)
+            if share is not None:
+                limiter.share = share
+            if blocked_for:
+                limiter.blocked_until = max(limiter.blocked_until, time.monotonic() + blocked_for)
+            if factor is not None:
+                limiter.factor = min(limiter.factor, max(MIN_FACTOR, factor))
+            limiter.apply_rates()
+
+    def deployments(self):
+        with self._lock:
+            return list(self._limiters)
+
+
+class MongoSharedState:
+    """
+    Shares the governor across instances through two small collections:
+      rate_leases  one lease per (deployment, instance), renewed every LEASE_SECONDS / 2. The
+                   number of live leases is how many instances split the deployment's quota.
+                   Expired leases (instances that scaled in) are deleted on renewal; a TTL
+                   index on `expiresAt` does the same when no instance is left.
+      rate_state   per deployment: until when everyone should back off and the current rate factor.
+    Mongo work runs on a background thread and failures only cost the cross-instance view.
+    """
+
+    def __init__(self, get_db=None):
+        self.get_db = get_db
+        self._next_refresh = 0.0
+        self._busy = threading.Lock()
+
+    def _db(self):
+        if self.get_db:
+            return self.get_db()
+        from .clients import get_mongo_db
+        return get_mongo_db()
+
+    def _in_background(self, work):
+        def run():
+            try:
+                work()
+            except Exception as e:
+                logging.warning(f"Rate governor shared state unavailable: {e}")
+        threading.Thread(target=run, name="rate-governor-sync", daemon=True).start()
+
+    def refresh_soon(self, governor):
+        now = time.monotonic()
+        if now < self._next_refresh or not self._busy.acquire(blocking=False):
+            return
+        self._next_refresh = now + LEASE_SECONDS / 2
+
+        def work():
+            try:
+                self.refresh(governor)
+            finally:
+                self._busy.release()
+        self._in_background(work)
+
+    def refresh(self, governor):
+        db = self._db()
+        now = datetime.utcnow()
+        for deployment in governor.deployments():
+            db.rate_leases.update_one(
+                {"_id": f"{deployment}:{INSTANCE_ID}"},
+                {"$set": {"deployment": deployment, "instance": INSTANCE_ID,
+                          "expiresAt": now + timedelta(seconds=LEASE_SECONDS)}},
+                upsert=True
+            )
+            db.rate_leases.delete_many({"deployment": deployment, "expiresAt": {"$lte": now}})
+            instances = db.rate_leases.count_documents({"deployment": deployment, "expiresAt": {"$gt": now}})
+            state = db.rate_state.find_one({"_id": deployment}) or {}
+            blocked_for = None
+            if state.get("blockedUntil") and state["blockedUntil"] > now:
+                blocked_for = (state["blockedUntil"] - now).total_seconds()
+            factor = None
+            if state.get("updatedAt") and now - state["updatedAt"] < timedelta(seconds=LEASE_SECONDS):
+                factor = state.get("factor")
+            governor.apply_shared(deployment, share=1.0 / max(instances, 1), blocked_for=blocked_for, factor=factor)
+
+    def publish_soon(self, deployment, retry_after, factor):
+        def work():
+            now = datetime.utcnow()
+            self._db().rate_state.update_one(
+                {"_id": deployment},
+                {"$max": {"blockedUntil": now + timedelta(seconds=retry_after)},
+                 "$set": {"factor": factor, "updatedAt": now}},
+                upsert=True
+            )
+        self._in_background(work)
+
+
+_governor = None
+_governor_lock = threading.Lock()
+
+def get_rate_governor():
+    """The instance-wide governor. Shared through Mongo unless RATE_GOVERNOR_SHARED is false."""
+    global _governor
+    if _governor is None:
+        with _governor_lock:
+            if _governor is None:
+                shared = os.getenv("RATE_GOVERNOR_SHARED", "true").lower() in ("1", "true", "yes") \
+                    and os.getenv("MONGO_DB_CONNECTION_STRING")
+                _governor = RateGovernor(MongoSharedState() if shared else None)
+    return _governor
@@ -0,0 +1,120 @@
+import os
+import gzip
+import json
+import hashlib
+import datetime
+import azure.functions as func
+from bson.objectid import ObjectId
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is in requirements.txt, json keeps working without it
+    orjson = None
+
+# JSON responses for the HTTP handlers.
+# Documents are serialized as they come out of Mongo: ObjectId becomes its hex string and
+# datetimes ISO 8601, so handlers don't copy lists to stringify `_id`s first. orjson does the
+# encoding when installed (several times faster than json.dumps on our payloads).
+# List endpoints hand their cursor to cursor_response, which encodes one document at a time
+# into the response body. The Functions v1 Python worker sends a body as a single buffer (it
+# has no streamed responses), so the array is not sent incrementally, but the full list of
+# documents is never held next to its encoded form. Pair it with a projection so unused fields
+# are never fetched.
+#
+# Given the request, responses are also cacheable and compressed:
+#  - They carry a weak ETag. Where a version field covers the data (a project's statusVersion
+#    for its documents, chatVersion, songVersion) the handler derives the tag from it with
+#    etag_for and checks not_modified before reading anything else; otherwise the tag is a hash
+#    of the body, which still saves the transfer. `Cache-Control: private, no-cache` makes
+#    browsers revalidate with If-None-Match on every fetch and reuse their copy on a 304.
+#  - Bodies of at least RESPONSE_GZIP_MIN_BYTES (default 1024) are gzipped when the client
+#    sends `Accept-Encoding: gzip`.
+
+MIMETYPE = "application/json"
+
+
+def _default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def dumps(value) -> bytes:
+    if orjson is not None:
+        # Serializes datetimes natively, the same way as isoformat()
+        return orjson.dumps(value, default=_default)
+    return json.dumps(value, default=_default, separators=(",", ":")).encode("utf-8")
+
+def encode_array(documents) -> bytearray:
+    """Encodes an iterable (e.g. a cursor) as a JSON array, one document at a time."""
+    body = bytearray(b"[")
+    for document in documents:
+        if len(body) > 1:
+            body += b","
+        body += dumps(document)
+    body += b"]"
+    return body
+
+async def encode_array_async(documents) -> bytearray:
+    """encode_array for async cursors."""
+    body = bytearray(b"[")
+    async for document in documents:
+        if len(body) > 1:
+            body += b","
+        body += dumps(document)
+    body += b"]"
+    return body
+
+def etag_for(*parts) -> str:
+    """A weak ETag for a response determined by `parts` (endpoint, ids, version fields)."""
+    digest = hashlib.sha1("|".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+    return f'W/"{digest[:24]}"'
+
+def _opaque(tag):
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+def _cache_headers(etag):
+    return {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Accept-Encoding"}
+
+def not_modified(req, etag):
+    """A 304 response if the client already has `etag`, otherwise None."""
+    header = req.headers.get("If-None-Match") if req is not None else None
+    if not header:
+        return None
+    # Weak comparison: W/"x" and "x" match
+    if header.strip() != "*" and _opaque(etag) not in [_opaque(tag) for tag in header.split(",")]:
+        return None
+    return func.HttpResponse(status_code=304, headers=_cache_headers(etag))
+
+def _accepts_gzip(req):
+    for part in (req.headers.get("Accept-Encoding") or "").lower().split(","):
+        coding, _, params = part.partition(";")
+        if coding.strip() in ("gzip", "*"):
+            quality = params.strip()
+            return quality not in ("q=0", "q=0.0", "q=0.00", "q=0.000")
+    return False
+
+def _respond(body, status_code, headers, req, etag):
+    headers = dict(headers or {})
+    if req is not None and status_code == 200:
+        etag = etag or etag_for(hashlib.sha1(body).hexdigest())
+        cached = not_modified(req, etag)
+        if cached:
+            return cached
+        headers.update(_cache_headers(etag))
+        if len(body) >= int(os.getenv("RESPONSE_GZIP_MIN_BYTES", 1024)) and _accepts_gzip(req):
+            body = gzip.compress(body, compresslevel=5)
+            headers["Content-Encoding"] = "gzip"
+    return func.HttpResponse(body, mimetype=MIMETYPE, status_code=status_code, headers=headers)
+
+def json_response(value, status_code=200, headers=None, req=None, etag=None) -> func.HttpResponse:
+    """JSON response; pass `req` to make it conditional and compressible."""
+    return _respond(dumps(value), status_code, headers, req, etag)
+
+def cursor_response(cursor, status_code=200, req=None, etag=None) -> func.HttpResponse:
+    return _respond(encode_array(cursor), status_code, None, req, etag)
+
+async def cursor_response_async(cursor, status_code=200, req=None, etag=None) -> func.HttpResponse:
+    return _respond(await encode_array_async(cursor), status_code, None, req, etag)
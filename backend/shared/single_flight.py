@@ -0,0 +1,187 @@
+import os
+import re
+import json
+import uuid
+import asyncio
+import hashlib
+import logging
+from datetime import datetime, timedelta
+import azure.functions as func
+from .telemetry import set_attribute
+from .llm import time_left
+
+# Single-flight for expensive requests (lyrics and quiz generation).
+# Identical requests that arrive while one is already running (double-clicks, client retries)
+# wait for it and get the same response instead of running RAG + completion again.
+#  - Within an instance they await the same future.
+#  - Across instances (SINGLE_FLIGHT_SHARED, default true) the first one claims a lock
+#    document in `single_flight`; the others poll it and return the response the owner
+#    publishes there. Only successful responses are published, and only for
+#    SINGLE_FLIGHT_RESULT_SECONDS, so a retry after a failure runs again.
+# A lock whose owner disappeared expires after SINGLE_FLIGHT_LEASE_SECONDS and is taken over.
+# Responses are shared as they are, headers included: a handler that varies its response on a
+# request header (e.g. gzip for Accept-Encoding) has to put that header in the flight key.
+# Add a TTL index on `single_flight.expiresAt` to clean up old documents.
+
+RUNNING = "running"
+DONE = "done"
+
+_in_flight = {}
+
+
+def _normalize(value):
+    if isinstance(value, str):
+        return re.sub(r"\s+", " ", value).strip().lower()
+    return value
+
+def flight_key(endpoint, project_id, uid, **inputs):
+    """Hash of the endpoint, project, user and normalized inputs that identifies identical requests."""
+    payload = json.dumps({
+        "endpoint": endpoint,
+        "projectId": project_id,
+        "uid": uid,
+        "inputs": {name: _normalize(value) for name, value in inputs.items()}
+    }, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def _shared():
+    return os.getenv("SINGLE_FLIGHT_SHARED", "true").lower() in ("1", "true", "yes")
+
+def _lease_seconds():
+    return float(os.getenv("SINGLE_FLIGHT_LEASE_SECONDS", 120))
+
+def _serialize(response):
+    # Raw body bytes (stored as BSON binary) and all headers, so ETags, Cache-Control and a
+    # Content-Encoding survive along with the (possibly compressed) body they describe
+    return {
+        "status": response.status_code,
+        "body": bytes(response.get_body()),
+        "mimetype": response.mimetype,
+        "headers": dict(response.headers)
+    }
+
+def _deserialize(stored):
+    body = stored["body"]
+    return func.HttpResponse(body.encode("utf-8") if isinstance(body, str) else bytes(body),
+                             status_code=stored["status"], mimetype=stored["mimetype"],
+                             headers=stored.get("headers") or {})
+
+
+async def single_flight(key, compute, db=None):
+    """
+    Runs `compute()` (an async function returning an HttpResponse) unless an identical request is
+    already running, in which case its response is returned.
+    """
+    loop = asyncio.get_running_loop()
+    existing = _in_flight.get(key)
+    if existing is not None and existing.get_loop() is loop:
+        set_attribute("single_flight", "joined")
+        # Shielded so a duplicate that gives up doesn't cancel the request it joined
+        return await asyncio.shield(existing)
+
+    future = loop.create_future()
+    _in_flight[key] = future
+    try:
+        response = await (_run_shared(key, compute, db) if db is not None and _shared() else compute())
+        future.set_result(response)
+        return response
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        # Waiters re-raise it; mark it retrieved so an unjoined failure isn't logged twice
+        future.exception()
+        raise
+    finally:
+        if _in_flight.get(key) is future:
+            del _in_flight[key]
+
+
+async def _run_shared(key, compute, db):
+    try:
+        owner = await _claim(db, key)
+    except Exception as e:
+        logging.warning(f"Single-flight lock unavailable, running without it: {e}")
+        return await compute()
+
+    if owner is None:
+        set_attribute("single_flight", "waiting")
+        response = await _wait_for_response(db, key)
+        if response is not None:
+            set_attribute("single_flight", "shared")
+            return response
+        # The owner failed or disappeared: run it here
+        return await compute()
+
+    try:
+        response = await compute()
+    except BaseException:
+        await _release(db, key, owner)
+        raise
+    await _publish(db, key, owner, response)
+    return response
+
+
+async def _claim(db, key):
+    """
+    Takes the lock document for `key` and returns the owner token, or None when another request
+    holds it or has a fresh response.
+    """
+    from pymongo.errors import DuplicateKeyError
+    now = datetime.utcnow()
+    owner = uuid.uuid4().hex
+    lock = {"status": RUNNING, "owner": owner, "expiresAt": now + timedelta(seconds=_lease_seconds())}
+    try:
+        await db.single_flight.insert_one({"_id": key, **lock})
+        return owner
+    except DuplicateKeyError:
+        # Expired locks (owner gone) and expired responses can be taken over
+        taken = await db.single_flight.find_one_and_update(
+            {"_id": key, "expiresAt": {"$lt": now}},
+            {"$set": lock, "$unset": {"response": ""}}
+        )
+        return owner if taken is not None else None
+
+
+async def _wait_for_response(db, key):
+    """Polls the lock document until the owner publishes a response. None if it never does."""
+    # Don't wait past the request's own deadline
+    wait = _lease_seconds() if time_left() is None else min(_lease_seconds(), time_left())
+    deadline = asyncio.get_running_loop().time() + wait
+    delay = 0.1
+    while asyncio.get_running_loop().time() < deadline:
+        try:
+            doc = await db.single_flight.find_one({"_id": key})
+        except Exception as e:
+            logging.warning(f"Single-flight lock unavailable while waiting: {e}")
+            return None
+        if doc is None or doc["expiresAt"] < datetime.utcnow():
+            return None
+        if doc["status"] == DONE:
+            return _deserialize(doc["response"])
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 1.0)
+    return None
+
+
+async def _publish(db, key, owner, response):
+    try:
+        if 200 <= response.status_code < 300:
+            result_seconds = float(os.getenv("SINGLE_FLIGHT_RESULT_SECONDS", 10))
+            await db.single_flight.update_one(
+                {"_id": key, "owner": owner},
+                {"$set": {"status": DONE, "response": _serialize(response),
+                          "expiresAt": datetime.utcnow() + timedelta(seconds=result_seconds)}}
+            )
+        else:
+            await db.single_flight.delete_one({"_id": key, "owner": owner})
+    except Exception as e:
+        logging.warning(f"Could not publish single-flight response: {e}")
+
+
+async def _release(db, key, owner):
+    try:
+        await db.single_flight.delete_one({"_id": key, "owner": owner, "status": RUNNING})
+    except Exception as e:
+        logging.warning(f"Could not release single-flight lock: {e}")
@@ -0,0 +1,106 @@
+import os
+import re
+import asyncio
+import hashlib
+import logging
+from datetime import datetime, timedelta
+from .blob_urls import SONGS_CONTAINER, signed_url_async
+from .telemetry import set_attribute
+
+# Content-addressed cache for song generation, in the `song_cache` collection.
+#  - Lyrics are keyed by (project, project content version, normalized prompt, genre). The
+#    content version is the project's contentVersion, which moves when a document is stored,
+#    replaced or deleted (not on ingestion progress or failures), so lyrics written from older
+#    documents are never served.
+#  - Audio is keyed by (lyrics, genre, duration) and points at the blob of the song first
+#    composed from them. A new song with the same inputs gets a server-side copy of that blob
+#    instead of another ElevenLabs compose.
+# Entries live SONG_CACHE_TTL_HOURS (default 168); add a TTL index on `song_cache.expiresAt`
+# to clean them up. SONG_CACHE=false turns the cache off.
+
+LYRICS = "lyrics"
+AUDIO = "audio"
+
+
+def enabled():
+    return os.getenv("SONG_CACHE", "true").lower() != "false"
+
+def _ttl():
+    return timedelta(hours=float(os.getenv("SONG_CACHE_TTL_HOURS", 168)))
+
+def _normalize(text):
+    return re.sub(r"\s+", " ", str(text)).strip().lower()
+
+def _key(kind, *parts):
+    return f"{kind}:" + hashlib.sha256("\x1f".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+
+def lyrics_key(project_id, content_version, prompt, genre):
+    return _key(LYRICS, project_id, content_version, _normalize(prompt), _normalize(genre))
+
+def audio_key(lyrics, genre, duration_ms):
+    # Lyrics are sung as written, so only surrounding whitespace is ignored
+    return _key(AUDIO, lyrics.strip(), _normalize(genre), int(duration_ms))
+
+async def _get(db, key):
+    if not enabled():
+        return None
+    entry = await db.song_cache.find_one({"_id": key, "expiresAt": {"$gt": datetime.utcnow()}})
+    set_attribute("song_cache.hit", entry is not None)
+    return entry
+
+async def _put(db, key, **fields):
+    if not enabled():
+        return
+    try:
+        await db.song_cache.update_one(
+            {"_id": key},
+            {"$set": {**fields, "createdAt": datetime.utcnow(), "expiresAt": datetime.utcnow() + _ttl()}},
+            upsert=True
+        )
+    except Exception as e:
+        # The song was made either way
+        logging.warning(f"Could not cache {key.split(':')[0]}: {e}")
+
+async def get_lyrics(db, key):
+    entry = await _get(db, key)
+    return entry["lyrics"] if entry else None
+
+async def put_lyrics(db, key, project_id, lyrics):
+    await _put(db, key, projectId=project_id, lyrics=lyrics)
+
+async def get_audio(db, key):
+    entry = await _get(db, key)
+    return entry["blob"] if entry else None
+
+async def put_audio(db, key, blob_name):
+    await _put(db, key, blob=blob_name)
+
+async def copy_audio(db, key, blob_service_client, source_blob, target_blob):
+    """
+    Copies the cached audio blob to `target_blob`. Returns False (and forgets the entry) if the
+    source is gone or the copy fails, in which case the caller composes the song again.
+    """
+    target = blob_service_client.get_blob_client(container=SONGS_CONTAINER, blob=target_blob)
+    copy = {}
+    try:
+        copy = await target.start_copy_from_url(await signed_url_async(source_blob))
+        status = copy.get("copy_status")
+        # Copies within an account normally finish right away
+        for _ in range(20):
+            if status != "pending":
+                break
+            await asyncio.sleep(0.5)
+            status = (await target.get_blob_properties()).copy.status
+        if status != "success":
+            raise RuntimeError(f"copy ended with status {status}")
+        return True
+    except Exception as e:
+        logging.warning(f"Cached audio {source_blob} could not be copied, composing again: {e}")
+        if copy.get("copy_id"):
+            try:
+                # A pending copy would block the upload of the new composition
+                await target.abort_copy(copy["copy_id"])
+            except Exception:
+                pass
+        await db.song_cache.delete_one({"_id": key})
+        return False
@@ -0,0 +1,87 @@
+import os
+import asyncio
+import logging
+from bson.objectid import ObjectId
+from .telemetry import span, set_attribute
+
+# Ingestion status feed.
+# Instead of the frontend polling the status every few seconds, it sends the `version` it last
+# saw and the request is held until the project's `statusVersion` moves past it (see
+# shared/ingestion_state.py), or STATUS_FEED_WAIT_SECONDS pass and it gets the same status back.
+# Waiting uses a change stream on `projects` filtered to the project's statusVersion updates, so
+# the request wakes up as soon as a worker on any instance records a change. Change streams need
+# a replica set; on a standalone mongod (or with STATUS_FEED_CHANGE_STREAMS=false) the wait falls
+# back to reading the version every STATUS_FEED_POLL_MS, which is one projected read by _id
+# instead of a whole function execution per poll.
+
+# None until the first change stream is opened, False once the server turned it down
+_change_streams_supported = None
+
+
+def wait_seconds():
+    return float(os.getenv("STATUS_FEED_WAIT_SECONDS", 25))
+
+def _change_streams_enabled():
+    if os.getenv("STATUS_FEED_CHANGE_STREAMS", "true").lower() == "false":
+        return False
+    return _change_streams_supported is not False
+
+async def _version(db, oid):
+    project = await db.projects.find_one({"_id": oid}, {"statusVersion": 1})
+    return project.get("statusVersion", 0) if project else None
+
+def _pipeline(oid):
+    return [{"$match": {
+        "documentKey._id": oid,
+        "$or": [
+            {"operationType": {"$in": ["replace", "delete"]}},
+            {"updateDescription.updatedFields.statusVersion": {"$exists": True}}
+        ]
+    }}]
+
+async def _wait_with_change_stream(db, oid, since, deadline):
+    loop = asyncio.get_running_loop()
+    async with await db.projects.watch(_pipeline(oid), max_await_time_ms=1000) as stream:
+        # A change between the caller's read and opening the stream would not be in the stream
+        if await _version(db, oid) != since:
+            return True
+        while loop.time() < deadline:
+            if await stream.try_next() is not None:
+                return True
+    return False
+
+async def _wait_with_polling(db, oid, since, deadline):
+    loop = asyncio.get_running_loop()
+    interval = int(os.getenv("STATUS_FEED_POLL_MS", 1000)) / 1000
+    while loop.time() < deadline:
+        await asyncio.sleep(min(interval, max(0, deadline - loop.time())))
+        if await _version(db, oid) != since:
+            return True
+    return False
+
+async def wait_for_change(db, project_id: str, since: int, timeout: float = None):
+    """
+    Waits until the project's statusVersion is no longer `since`. Returns True if it changed,
+    False if `timeout` seconds (default STATUS_FEED_WAIT_SECONDS) passed first.
+    """
+    global _change_streams_supported
+    oid = ObjectId(project_id)
+    deadline = asyncio.get_running_loop().time() + (wait_seconds() if timeout is None else timeout)
+
+    with span("status_feed.wait", projectId=project_id):
+        if _change_streams_enabled():
+            from pymongo.errors import OperationFailure
+            try:
+                changed = await _wait_with_change_stream(db, oid, since, deadline)
+                _change_streams_supported = True
+                set_attribute("status_feed.mode", "change_stream")
+                return changed
+            except OperationFailure as e:
+                # 40573: "The $changeStream stage is only supported on replica sets"
+                if e.code == 40573:
+                    logging.warning("Change streams need a replica set, status feed falls back to polling")
+                    _change_streams_supported = False
+                else:
+                    logging.warning(f"Status change stream failed, polling instead: {e}")
+        set_attribute("status_feed.mode", "poll")
+        return await _wait_with_polling(db, oid, since, deadline)
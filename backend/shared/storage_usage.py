@@ -0,0 +1,134 @@
+import os
+import logging
+from datetime import datetime
+from bson import ObjectId
+
+# Per-project storage usage, kept as a rollup in the `storage_usage` collection.
+# One document per project (_id = project id) with blob and byte counts per container:
+#   {"_id": "<projectId>", "bytes": ..., "blobs": ...,
+#    "containers": {"docs": {"bytes": ..., "blobs": ...}, "songs": {...}}, "updatedAt": ...}
+# Upload and delete paths move the counters with one $inc upsert, so reading a project's usage
+# never lists blobs. Blobs are attributed to the project folder their name starts with
+# (`<projectId>/...`); anything else counts under UNASSIGNED.
+# Counters can drift (a failed rollup write, blobs written before the rollup existed).
+# rebuild() recounts one project by paging through its blob listings and replaces its counters.
+
+STORAGE_CONTAINERS = ("docs", "songs")
+UNASSIGNED = "unassigned"
+# blob_size() of a blob whose properties couldn't be read
+UNKNOWN_SIZE = -1
+
+
+def page_size(requested=None):
+    limit = int(os.getenv("STORAGE_LIST_PAGE_SIZE", 100))
+    try:
+        limit = int(requested) if requested else limit
+    except ValueError:
+        pass
+    return max(1, min(limit, 5000))
+
+def project_of(blob_name):
+    """The project a blob belongs to, from its `<projectId>/` folder."""
+    folder = blob_name.split("/", 1)[0] if "/" in blob_name else None
+    return folder if folder and ObjectId.is_valid(folder) else UNASSIGNED
+
+def _update(container, size_delta, count_delta):
+    return {
+        "$inc": {
+            "bytes": size_delta,
+            "blobs": count_delta,
+            f"containers.{container}.bytes": size_delta,
+            f"containers.{container}.blobs": count_delta
+        },
+        "$set": {"updatedAt": datetime.utcnow()}
+    }
+
+def record(db, project_id, container, size_delta, count_delta):
+    """Moves a project's counters. Never raises: usage is not worth failing an upload for."""
+    if not size_delta and not count_delta:
+        return
+    try:
+        db.storage_usage.update_one({"_id": project_id}, _update(container, size_delta, count_delta), upsert=True)
+    except Exception as e:
+        logging.warning(f"Storage usage of {project_id} not updated ({container} {size_delta:+} bytes): {e}")
+
+async def record_async(db, project_id, container, size_delta, count_delta):
+    if not size_delta and not count_delta:
+        return
+    try:
+        await db.storage_usage.update_one({"_id": project_id}, _update(container, size_delta, count_delta), upsert=True)
+    except Exception as e:
+        logging.warning(f"Storage usage of {project_id} not updated ({container} {size_delta:+} bytes): {e}")
+
+def record_upload(db, container, blob_name, size, previous_size=None):
+    """An uploaded blob; `previous_size` is the size of the blob it overwrote, if there was one."""
+    if previous_size == UNKNOWN_SIZE:
+        # Whether it replaced a blob is unknown, a recount (rebuild) corrects the project
+        logging.warning(f"Storage usage not updated for {container}/{blob_name}: previous size unknown")
+    elif previous_size is None:
+        record(db, project_of(blob_name), container, size, 1)
+    else:
+        record(db, project_of(blob_name), container, size - previous_size, 0)
+
+def record_delete(db, container, blob_name, size):
+    if size is None or size == UNKNOWN_SIZE:
+        logging.warning(f"Storage usage not updated for deleted {container}/{blob_name}: size unknown")
+        return
+    record(db, project_of(blob_name), container, -size, -1)
+
+def blob_size(blob_client):
+    """
+    Size of the blob, None if it doesn't exist (the upload paths overwrite in place), or
+    UNKNOWN_SIZE if it couldn't be read. Never raises, like record().
+    """
+    from azure.core.exceptions import ResourceNotFoundError
+    try:
+        return blob_client.get_blob_properties().size
+    except ResourceNotFoundError:
+        return None
+    except Exception as e:
+        logging.warning(f"Could not read the size of {blob_client.blob_name}: {e}")
+        return UNKNOWN_SIZE
+
+def list_page(container_client, prefix=None, limit=None, continuation=None):
+    """
+    One page of a container listing: (blobs, continuation token of the next page or None).
+    Blobs are {"name", "size", "lastModified", "contentType"}.
+    """
+    pages = container_client.list_blobs(name_starts_with=prefix or None, results_per_page=page_size(limit)) \
+        .by_page(continuation_token=continuation or None)
+    blobs = [
+        {
+            "name": blob.name,
+            "size": blob.size,
+            "lastModified": blob.last_modified,
+            "contentType": getattr(blob.content_settings, "content_type", None)
+        }
+        for blob in next(pages, [])
+    ]
+    return blobs, pages.continuation_token or None
+
+def usage(db, project_id):
+    return db.storage_usage.find_one({"_id": project_id}) or \
+        {"_id": project_id, "bytes": 0, "blobs": 0, "containers": {}}
+
+def rebuild(db, blob_service_client, project_id):
+    """Recounts a project's blobs page by page and replaces its counters with the result."""
+    counts = {"bytes": 0, "blobs": 0, "containers": {}}
+    for container in STORAGE_CONTAINERS:
+        container_client = blob_service_client.get_container_client(container)
+        totals = {"bytes": 0, "blobs": 0}
+        continuation = None
+        while True:
+            blobs, continuation = list_page(container_client, f"{project_id}/", 5000, continuation)
+            totals["bytes"] += sum(blob["size"] or 0 for blob in blobs)
+            totals["blobs"] += len(blobs)
+            if not continuation:
+                break
+        counts["containers"][container] = totals
+        counts["bytes"] += totals["bytes"]
+        counts["blobs"] += totals["blobs"]
+    now = datetime.utcnow()
+    db.storage_usage.update_one({"_id": project_id}, {"$set": {**counts, "updatedAt": now, "rebuiltAt": now}},
+                                upsert=True)
+    return {"_id": project_id, **counts, "updatedAt": now, "rebuiltAt": now}
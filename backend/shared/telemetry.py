@@ -0,0 +1,277 @@
+import os
+import json
+import time
+import logging
+import functools
+import threading
+import contextvars
+import inspect
+from contextlib import contextmanager
+from datetime import datetime
+
+# Lightweight per-request timing.
+# A request record is opened by `instrument` (one per function invocation) and every
+# `span` / `timed` call made while it is active appends a timing entry to it.
+# When the invocation finishes a single structured JSON line is logged, and optionally
+# appended to TELEMETRY_EXPORT_PATH (JSON Lines) for local analysis.
+# Outside of an instrumented invocation spans are no-ops, so the overhead is a
+# contextvar lookup and two perf_counter calls.
+
+_current_record = contextvars.ContextVar("telemetry_record", default=None)
+_current_depth = contextvars.ContextVar("telemetry_depth", default=0)
+_export_lock = threading.Lock()
+
+
+class RequestRecord:
+    __slots__ = ("name", "started_at", "start", "spans", "usage", "attributes", "pending")
+
+    def __init__(self, name, attributes=None):
+        self.name = name
+        self.started_at = datetime.utcnow().isoformat()
+        self.start = time.perf_counter()
+        self.spans = []
+        self.usage = {}
+        self.attributes = dict(attributes or {})
+        # In-flight Mongo commands keyed by request_id (see MongoCommandListener)
+        self.pending = {}
+
+    def add_span(self, name, duration_ms, depth=0, **attributes):
+        entry = {"name": name, "ms": round(duration_ms, 3), "depth": depth}
+        if attributes:
+            entry.update(attributes)
+        self.spans.append(entry)
+
+    def add_usage(self, model, prompt_tokens=0, completion_tokens=0, total_tokens=0):
+        usage = self.usage.setdefault(model or "unknown", {
+            "calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0
+        })
+        usage["calls"] += 1
+        usage["prompt_tokens"] += prompt_tokens or 0
+        usage["completion_tokens"] += completion_tokens or 0
+        usage["total_tokens"] += total_tokens or 0
+
+    def to_dict(self, total_ms):
+        return {
+            "type": "request_timing",
+            "function": self.name,
+            "startedAt": self.started_at,
+            "totalMs": round(total_ms, 3),
+            "attributes": self.attributes,
+            "spans": self.spans,
+            "usage": self.usage,
+        }
+
+
+def current_record():
+    return _current_record.get()
+
+
+def set_attribute(key, value):
+    """Attaches an attribute (e.g. projectId, status code) to the active request record."""
+    record = _current_record.get()
+    if record is not None:
+        record.attributes[key] = value
+
+
+@contextmanager
+def span(name, **attributes):
+    """Times the enclosed block and records it on the active request, if any."""
+    record = _current_record.get()
+    if record is None:
+        yield
+        return
+
+    depth = _current_depth.get()
+    token = _current_depth.set(depth + 1)
+    start = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        _current_depth.reset(token)
+        if error:
+            attributes["error"] = error
+        record.add_span(name, (time.perf_counter() - start) * 1000, depth, **attributes)
+
+
+def timed(name=None):
+    """Decorator form of `span`. Works for both regular and async functions."""
+    def decorator(f):
+        span_name = name or f"{f.__module__}.{f.__qualname__}"
+
+        if inspect.iscoroutinefunction(f):
+            @functools.wraps(f)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name):
+                    return await f(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_usage(response, model=None):
+    """Adds the token usage of an OpenAI response (chat or embeddings) to the active request."""
+    record = _current_record.get()
+    if record is None:
+        return
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return
+    record.add_usage(
+        model or getattr(response, "model", None),
+        prompt_tokens=getattr(usage, "prompt_tokens", 0),
+        completion_tokens=getattr(usage, "completion_tokens", 0),
+        total_tokens=getattr(usage, "total_tokens", 0),
+    )
+
+
+def _export(payload):
+    line = json.dumps(payload, default=str)
+    logging.info(f"telemetry {line}")
+
+    export_path = os.getenv("TELEMETRY_EXPORT_PATH")
+    if export_path:
+        try:
+            with _export_lock:
+                with open(export_path, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+        except OSError as e:
+            logging.warning(f"Failed to export telemetry to {export_path}: {e}")
+
+
+@contextmanager
+def request_scope(name, **attributes):
+    """Opens a request record for the duration of the block and emits it on exit."""
+    if _current_record.get() is not None:
+        # Nested invocation (e.g. one function calling another): fold into the outer record
+        with span(name, **attributes):
+            yield _current_record.get()
+        return
+
+    record = RequestRecord(name, attributes)
+    token = _current_record.set(record)
+    try:
+        yield record
+    except BaseException as e:
+        record.attributes["error"] = type(e).__name__
+        raise
+    finally:
+        _current_record.reset(token)
+        _export(record.to_dict((time.perf_counter() - record.start) * 1000))
+
+
+def _record_status(response):
+    status_code = getattr(response, "status_code", None)
+    if status_code is not None:
+        set_attribute("status", status_code)
+
+
+_first_invocation = True
+
+
+def _warm_up_instance(name):
+    # The first invocation on an instance warms the clients it doesn't use (see shared/warmup.py)
+    global _first_invocation
+    if not _first_invocation:
+        return
+    _first_invocation = False
+    if name != "warmup":
+        from .warmup import warm_up_in_background
+        warm_up_in_background()
+
+
+def instrument(name):
+    """Decorator for function entry points: wraps the whole invocation in a request record."""
+    def decorator(f):
+        if inspect.iscoroutinefunction(f):
+            @functools.wraps(f)
+            async def async_wrapper(*args, **kwargs):
+                _warm_up_instance(name)
+                with request_scope(name):
+                    response = await f(*args, **kwargs)
+                    _record_status(response)
+                    return response
+            return async_wrapper
+
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            _warm_up_instance(name)
+            with request_scope(name):
+                response = f(*args, **kwargs)
+                _record_status(response)
+                return response
+        return wrapper
+    return decorator
+
+
+_mongo_listener = None
+
+
+def mongo_command_listener():
+    """
+    Returns a pymongo CommandListener that records every Mongo command issued during an
+    instrumented request as a span. Built on first use so importing telemetry stays cheap.
+    """
+    global _mongo_listener
+    if _mongo_listener is not None:
+        return _mongo_listener
+
+    from pymongo import monitoring
+
+    class MongoCommandListener(monitoring.CommandListener):
+        def started(self, event):
+            record = _current_record.get()
+            if record is not None:
+                collection = event.command.get(event.command_name)
+                label = f"mongo.{event.command_name}"
+                if isinstance(collection, str):
+                    label = f"{label}.{collection}"
+                record.pending[event.request_id] = label
+
+        def succeeded(self, event):
+            self._finish(event)
+
+        def failed(self, event):
+            self._finish(event, error=True)
+
+        def _finish(self, event, error=False):
+            record = _current_record.get()
+            if record is None:
+                return
+            label = record.pending.pop(event.request_id, f"mongo.{event.command_name}")
+            attributes = {"error": True} if error else {}
+            record.add_span(label, event.duration_micros / 1000, _current_depth.get(), **attributes)
+
+    _mongo_listener = MongoCommandListener()
+    return _mongo_listener
+
+
+def azure_client_hooks(prefix):
+    """
+    Returns `raw_request_hook` / `raw_response_hook` kwargs for Azure SDK clients
+    (Blob, Document Intelligence) so each HTTP call they make is recorded as a span.
+    """
+    def on_request(request):
+        request.context["telemetry_start"] = time.perf_counter()
+
+    def on_response(response):
+        record = _current_record.get()
+        start = response.context.get("telemetry_start")
+        if record is None or start is None:
+            return
+        record.add_span(
+            f"{prefix}.{response.http_request.method}",
+            (time.perf_counter() - start) * 1000,
+            _current_depth.get(),
+            status=response.http_response.status_code,
+        )
+
+    return {"raw_request_hook": on_request, "raw_response_hook": on_response}
@@ -0,0 +1,364 @@
+import os
+import heapq
+import time
+import random
+import logging
+from collections import Counter
+from datetime import datetime
+from .clients import get_mongo_db
+from .telemetry import timed
+from .chunk_store import TEXT_COLLECTION, VECTOR_COLLECTION
+from .projections import CHUNK_PROJECTION
+
+# Topic map per project, built from chunk embeddings at ingestion time.
+# A project's chunks are clustered with spherical k-means (cosine, NumPy) and the map
+# stored in `topic_maps` (one document per project, _id = projectId) holds per cluster:
+#   mean             mean of the member unit vectors (its direction is the centroid)
+#   size             number of member chunks
+#   representatives  the chunks closest to the centroid: {id, score, heading}
+#   label            most common section heading of the representatives, or their first words
+# Ingestion only folds new chunks into the nearest clusters and subtracts removed ones
+# (TopicMapUpdate). A project without a map, or whose changes since the last build exceed
+# TOPIC_MAP_REBUILD_RATIO of max(its chunks, TOPIC_MAP_REBUILD_MIN_CHUNKS), is flagged
+# `rebuildDue`, and the `topic_map_rebuild` timer rebuilds flagged maps from a sample of
+# TOPIC_MAP_SAMPLE chunks, off the ingestion path (reading the vectors is most of the cost,
+# k-means itself takes ~100ms). Surprise quizzes and the topics view read the map without any
+# LLM or embedding call; until a project's first map is built they fall back as if it had none.
+
+REPRESENTATIVES = 5
+
+
+def cluster_count(chunks):
+    max_clusters = int(os.getenv("TOPIC_MAP_MAX_CLUSTERS", 12))
+    return max(1, min(max_clusters, round((chunks / 2) ** 0.5), chunks))
+
+def _normalize(matrix):
+    import numpy as np
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+def kmeans(vectors, k, iterations=25, seed=0):
+    """
+    Spherical k-means with k-means++ seeding. Returns (centroids, labels) with unit centroids.
+    Every step is a matrix product over all vectors at once.
+    """
+    import numpy as np
+    x = _normalize(np.asarray(vectors, dtype=np.float32))
+    n = len(x)
+    k = max(1, min(k, n))
+    rng = np.random.default_rng(seed)
+
+    centroids = np.empty((k, x.shape[1]), dtype=np.float32)
+    centroids[0] = x[rng.integers(n)]
+    distance = 1.0 - x @ centroids[0]
+    for i in range(1, k):
+        weights = np.clip(distance, 0, None) ** 2
+        total = weights.sum()
+        pick = rng.choice(n, p=weights / total) if total > 0 else rng.integers(n)
+        centroids[i] = x[pick]
+        distance = np.minimum(distance, 1.0 - x @ centroids[i])
+
+    labels = None
+    for _ in range(iterations):
+        new_labels = np.argmax(x @ centroids.T, axis=1)
+        if labels is not None and np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+        one_hot = np.zeros((n, k), dtype=np.float32)
+        one_hot[np.arange(n), labels] = 1.0
+        sums = one_hot.T @ x
+        # A cluster that lost all its members keeps its centroid
+        empty = one_hot.sum(axis=0) == 0
+        sums[empty] = centroids[empty]
+        centroids = _normalize(sums)
+    return centroids, labels
+
+def _heading(metadata):
+    headings = (metadata or {}).get("headings") or []
+    return headings[-1] if headings else None
+
+def _label(representatives, texts):
+    headings = Counter(r["heading"] for r in representatives if r.get("heading"))
+    if headings:
+        return headings.most_common(1)[0][0]
+    for r in representatives:
+        if texts.get(r["id"]):
+            return " ".join(texts[r["id"]].split()[:8])
+    return None
+
+def _find(db, project_id):
+    return db.topic_maps.find_one({"_id": project_id})
+
+@timed("topics.build")
+def build_topic_map(project_id, db=None):
+    """Clusters the project's chunks (a sample of TOPIC_MAP_SAMPLE for large projects) and stores the map."""
+    import numpy as np
+    db = db if db is not None else get_mongo_db()
+    vectors = db[VECTOR_COLLECTION]
+    total = vectors.count_documents({"metadata.projectId": project_id})
+    if not total:
+        db.topic_maps.delete_one({"_id": project_id})
+        return None
+
+    sample = int(os.getenv("TOPIC_MAP_SAMPLE", 2000))
+    pipeline = [{"$match": {"metadata.projectId": project_id}}]
+    if total > sample:
+        pipeline.append({"$sample": {"size": sample}})
+    pipeline.append({"$project": {"vector": 1}})
+    rows = [row for row in vectors.aggregate(pipeline) if row.get("vector")]
+    if not rows:
+        db.topic_maps.update_one({"_id": project_id}, {"$unset": {"rebuildDue": "", "rebuildRequestedAt": ""}})
+        return None
+
+    x = _normalize(np.asarray([row["vector"] for row in rows], dtype=np.float32))
+    centroids, labels = kmeans(x, cluster_count(len(rows)))
+    scale = total / len(rows)
+
+    clusters = []
+    for c in range(len(centroids)):
+        members = np.flatnonzero(labels == c)
+        if not len(members):
+            continue
+        scores = x[members] @ centroids[c]
+        closest = np.argsort(-scores)[:REPRESENTATIVES]
+        clusters.append({
+            "mean": x[members].mean(axis=0).tolist(),
+            "size": max(1, round(len(members) * scale)),
+            "representatives": [{
+                "id": rows[members[i]]["_id"],
+                "score": float(scores[i])
+            } for i in closest]
+        })
+
+    rep_ids = [r["id"] for cluster in clusters for r in cluster["representatives"]]
+    # Text and headings only for the representatives, vectors are all the clustering reads
+    chunks = {d["_id"]: d for d in db[TEXT_COLLECTION].find({"_id": {"$in": rep_ids}}, {"text": 1, "metadata.headings": 1})}
+    texts = {chunk_id: chunk.get("text") for chunk_id, chunk in chunks.items()}
+    for cluster in clusters:
+        for r in cluster["representatives"]:
+            r["heading"] = _heading((chunks.get(r["id"]) or {}).get("metadata"))
+        cluster["label"] = _label(cluster["representatives"], texts)
+
+    previous = _find(db, project_id) or {}
+    topic_map = {
+        "_id": project_id,
+        "clusters": clusters,
+        "chunkCount": total,
+        "changes": 0,
+        "version": previous.get("version", 0) + 1,
+        "builtAt": datetime.utcnow().isoformat()
+    }
+    db.topic_maps.replace_one({"_id": project_id}, topic_map, upsert=True)
+    logging.info(f"Built topic map for project {project_id}: {len(clusters)} topics from {len(rows)} chunks")
+    return topic_map
+
+
+class TopicMapUpdate:
+    """
+    Collects the chunks a document adds and removes, then folds them into the project's
+    topic map in one compare-and-set (commit). Never raises: a failed update only costs
+    freshness until the next rebuild.
+    """
+
+    def __init__(self, project_id, db=None):
+        self.project_id = project_id
+        self._db = db
+        self.added = 0
+        self.removed = 0
+        self.removed_ids = set()
+        self.stale = False
+        self.topic_map = None
+        self.centroids = None
+        try:
+            self.topic_map = _find(self.db, project_id)
+            if self.topic_map and self.topic_map.get("clusters"):
+                import numpy as np
+                clusters = self.topic_map["clusters"]
+                self.centroids = _normalize(np.asarray([c["mean"] for c in clusters], dtype=np.float32))
+                self.sums = np.zeros_like(self.centroids)
+                self.counts = np.zeros(len(clusters), dtype=np.int64)
+                self.candidates = [[] for _ in clusters]
+        except Exception as e:
+            logging.warning(f"Topic map for project {self.project_id} unavailable: {e}")
+
+    @property
+    def db(self):
+        if self._db is None:
+            self._db = get_mongo_db()
+        return self._db
+
+    def _fold(self, ids, vectors, headings, sign):
+        import numpy as np
+        x = _normalize(np.asarray(vectors, dtype=np.float32))
+        similarities = x @ self.centroids.T
+        labels = np.argmax(similarities, axis=1)
+        np.add.at(self.sums, labels, sign * x)
+        np.add.at(self.counts, labels, sign)
+        if sign > 0:
+            for i, c in enumerate(labels):
+                candidate = (float(similarities[i, c]), str(ids[i]), ids[i], headings[i])
+                if len(self.candidates[c]) < REPRESENTATIVES:
+                    heapq.heappush(self.candidates[c], candidate)
+                else:
+                    heapq.heappushpop(self.candidates[c], candidate)
+
+    def add(self, ids, vectors, headings):
+        """Chunks of the document being stored, batch by batch."""
+        self.added += len(ids)
+        if self.centroids is not None and len(ids):
+            try:
+                self._fold(ids, vectors, headings, 1)
+            except Exception as e:
+                logging.warning(f"Could not add chunks to topic map: {e}")
+                self.centroids = None
+
+    def skipped(self, count):
+        """
+        Chunks an earlier attempt at the document already stored. Whether that attempt got to fold
+        them in is unknown, so the map is rebuilt from what is stored instead.
+        """
+        if count:
+            self.stale = True
+
+    def remove_matching(self, chunk_filter):
+        """Chunks about to be deleted. Call before deleting them."""
+        try:
+            ids, vectors = [], []
+            for row in self.db[VECTOR_COLLECTION].find(chunk_filter, {"vector": 1}):
+                ids.append(row["_id"])
+                vectors.append(row.get("vector"))
+            self.removed += len(ids)
+            self.removed_ids.update(ids)
+            present = [(i, v) for i, v in zip(ids, vectors) if v]
+            if self.centroids is not None and present:
+                self._fold([i for i, _ in present], [v for _, v in present], [None] * len(present), -1)
+        except Exception as e:
+            logging.warning(f"Could not remove chunks from topic map: {e}")
+            self.centroids = None
+
+    def _needs_rebuild(self):
+        if self.topic_map is None or self.centroids is None:
+            return True
+        changes = self.topic_map.get("changes", 0) + self.added + self.removed
+        # Small projects would otherwise cross the ratio with nearly every upload
+        chunk_count = max(self.topic_map.get("chunkCount", 0), int(os.getenv("TOPIC_MAP_REBUILD_MIN_CHUNKS", 200)), 1)
+        return changes > float(os.getenv("TOPIC_MAP_REBUILD_RATIO", 0.5)) * chunk_count
+
+    def _request_rebuild(self):
+        self.db.topic_maps.update_one({"_id": self.project_id},
+                                      {"$set": {"rebuildDue": True, "rebuildRequestedAt": datetime.utcnow()}},
+                                      upsert=True)
+
+    def _apply(self, topic_map):
+        import numpy as np
+        clusters = []
+        for c, cluster in enumerate(topic_map["clusters"]):
+            size = cluster["size"] + int(self.counts[c])
+            if size <= 0:
+                continue
+            mean = (np.asarray(cluster["mean"], dtype=np.float32) * cluster["size"] + self.sums[c]) / size
+            representatives = [r for r in cluster["representatives"] if r["id"] not in self.removed_ids]
+            representatives += [{"id": chunk_id, "score": score, "heading": heading}
+                                for score, _, chunk_id, heading in self.candidates[c]]
+            representatives = sorted(representatives, key=lambda r: -r["score"])[:REPRESENTATIVES]
+            if not representatives:
+                return None
+            label = cluster.get("label")
+            if not cluster["representatives"] or representatives[0]["id"] != cluster["representatives"][0]["id"]:
+                label = _label(representatives, {}) or label
+            clusters.append({**cluster, "mean": mean.tolist(), "size": size,
+                             "representatives": representatives, "label": label})
+        return clusters
+
+    def commit(self):
+        """Folds the changes into the stored map, and flags it for a rebuild when it drifted too far."""
+        try:
+            if self.stale:
+                self._request_rebuild()
+            if not self.added and not self.removed:
+                return
+            folded = self.centroids is not None and self._commit_fold()
+            if not self.stale and (not folded or self._needs_rebuild()):
+                self._request_rebuild()
+        except Exception as e:
+            logging.warning(f"Could not update topic map for project {self.project_id}: {e}")
+
+    def _commit_fold(self):
+        for _ in range(3):
+            topic_map = _find(self.db, self.project_id)
+            if not topic_map:
+                return False
+            if topic_map.get("builtAt") != self.topic_map.get("builtAt"):
+                # Rebuilt by the timer meanwhile, which read these chunks or will be caught up
+                # by the next rebuild: only count the drift
+                self.db.topic_maps.update_one({"_id": self.project_id},
+                                              {"$inc": {"changes": self.added + self.removed}})
+                return True
+            clusters = self._apply(topic_map)
+            if not clusters:
+                return False
+            result = self.db.topic_maps.update_one(
+                {"_id": self.project_id, "version": topic_map["version"]},
+                {"$set": {"clusters": clusters, "version": topic_map["version"] + 1},
+                 "$inc": {"chunkCount": self.added - self.removed, "changes": self.added + self.removed}}
+            )
+            if result.modified_count:
+                return True
+        return False
+
+
+@timed("topics.rebuild_due")
+def rebuild_due_topic_maps(db=None, time_budget_seconds=None):
+    """Rebuilds the maps flagged rebuildDue, oldest request first. Returns how many were rebuilt."""
+    db = db if db is not None else get_mongo_db()
+    deadline = time.monotonic() + time_budget_seconds if time_budget_seconds else None
+    rebuilt = 0
+    for due in list(db.topic_maps.find({"rebuildDue": True}, {"rebuildRequestedAt": 1}).sort("rebuildRequestedAt", 1)):
+        if deadline and time.monotonic() > deadline:
+            break
+        try:
+            build_topic_map(due["_id"], db)
+            rebuilt += 1
+        except Exception as e:
+            # Stays flagged, the next run retries it
+            logging.error(f"Topic map rebuild failed for project {due['_id']}: {e}")
+    return rebuilt
+
+
+def pick_representatives(clusters, limit, rng=random):
+    """
+    Chunk ids for a surprise quiz: about limit / 3 clusters drawn at random weighted by size,
+    then their representatives in random order, round-robin, up to `limit`.
+    """
+    clusters = [c for c in clusters if c.get("representatives")]
+    count = min(len(clusters), max(1, limit // 3))
+    # Weighted sampling without replacement (largest rng.random() ** (1 / size) wins)
+    drawn = sorted(clusters, key=lambda c: rng.random() ** (1.0 / max(c["size"], 1)), reverse=True)[:count]
+    pools = [rng.sample(c["representatives"], len(c["representatives"])) for c in drawn]
+    ids = []
+    for rank in range(REPRESENTATIVES):
+        for pool in pools:
+            if rank < len(pool) and len(ids) < limit:
+                ids.append(pool[rank]["id"])
+    return ids
+
+async def sample_topic_chunks(db, project_id, limit):
+    """Chunks from a few random topics of the project's map, [] if it has none yet."""
+    topic_map = await db.topic_maps.find_one({"_id": project_id}, {"clusters.mean": 0})
+    if not topic_map or not topic_map.get("clusters"):
+        return []
+    ids = pick_representatives(topic_map["clusters"], limit)
+    docs = await db[TEXT_COLLECTION].find({"_id": {"$in": ids}}, CHUNK_PROJECTION).to_list()
+    order = {chunk_id: i for i, chunk_id in enumerate(ids)}
+    return sorted(docs, key=lambda d: order.get(d["_id"], len(order)))
+
+def topic_summary(topic_map):
+    """The map as a list of topics for display, largest first."""
+    clusters = (topic_map or {}).get("clusters") or []
+    total = sum(c["size"] for c in clusters) or 1
+    return [{
+        "label": c.get("label"),
+        "size": c["size"],
+        "share": round(c["size"] / total, 3)
+    } for c in sorted(clusters, key=lambda c: -c["size"])]
@@ -0,0 +1,88 @@
+import os
+import asyncio
+import logging
+import threading
+from . import clients
+from .telemetry import span
+
+# Cold-start warm-up.
+# Builds (and imports) the SDK clients ahead of the first real request so a fresh
+# instance does not pay for module imports, client construction, TLS handshakes and
+# Firebase initialisation on a user's critical path. Clients whose configuration is
+# missing are skipped rather than failing the warm-up.
+# Each instance warms up once:
+#  - on Premium and Dedicated plans the `warmup` function (a warmupTrigger) runs warm_up()
+#    when the instance is added, before it gets traffic,
+#  - elsewhere (Consumption) the first invocation on the instance starts warm_up_sync() on a
+#    background thread (see shared.telemetry.instrument), so the clients that request doesn't
+#    use are ready for the next ones. WARMUP_ON_FIRST_INVOCATION=false turns that off.
+
+SYNC_CLIENTS = {
+    "mongo": lambda: clients.get_mongo_client().admin.command("ping"),
+    "openai": clients.get_openai_client,
+    "blob": clients.get_blob_service_client,
+    "document_intelligence": clients.get_document_intelligence_client,
+}
+
+ASYNC_CLIENTS = {
+    "async_mongo": lambda: clients.get_async_mongo_client().admin.command("ping"),
+    "async_openai": clients.get_async_openai_client,
+    "async_blob": clients.get_async_blob_service_client,
+}
+
+_claimed = False
+_claim_lock = threading.Lock()
+
+def _claim():
+    """True the first time it's called on this instance."""
+    global _claimed
+    with _claim_lock:
+        if _claimed:
+            return False
+        _claimed = True
+        return True
+
+def warm_up_in_background():
+    """Warms the sync clients on a background thread, unless this instance was warmed already."""
+    if os.getenv("WARMUP_ON_FIRST_INVOCATION", "true").lower() == "false" or not _claim():
+        return
+    threading.Thread(target=warm_up_sync, name="warmup", daemon=True).start()
+
+def _warm_firebase():
+    from .auth import initialize_firebase
+    initialize_firebase()
+    # Importing the auth module pulls in the token verification stack
+    from firebase_admin import auth  # noqa: F401
+
+def warm_up_sync():
+    """Builds the cached sync clients. Returns a dict of client name -> 'ok' or error message."""
+    results = {}
+    targets = dict(SYNC_CLIENTS, firebase=_warm_firebase)
+    for name, build in targets.items():
+        try:
+            with span(f"warmup.{name}"):
+                build()
+            results[name] = "ok"
+        except Exception as e:
+            logging.warning(f"Warm-up of {name} skipped: {e}")
+            results[name] = str(e)
+    return results
+
+async def warm_up():
+    """
+    Warms sync clients in a worker thread and the per-loop async clients on the running
+    event loop (the one the async handlers share).
+    """
+    _claim()
+    results = await asyncio.to_thread(warm_up_sync)
+    for name, build in ASYNC_CLIENTS.items():
+        try:
+            with span(f"warmup.{name}"):
+                result = build()
+                if asyncio.iscoroutine(result):
+                    await result
+            results[name] = "ok"
+        except Exception as e:
+            logging.warning(f"Warm-up of {name} skipped: {e}")
+            results[name] = str(e)
+    return results
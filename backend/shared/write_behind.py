@@ -0,0 +1,221 @@
+import os
+import glob
+import uuid
+import atexit
+import asyncio
+import logging
+import tempfile
+import weakref
+from bson import ObjectId, json_util
+from .telemetry import span
+
+# Write-behind buffer for non-critical inserts (chat history, quizzes, quiz results).
+# With WRITE_BEHIND=true, insert() gives the document an _id, queues it in process and
+# returns; the queue is flushed with one insert_many per collection every WRITE_BEHIND_FLUSH_MS
+# (default 200) or as soon as WRITE_BEHIND_MAX_BATCH (default 100) documents are waiting.
+# Without it, insert() is a plain insert_one.
+#
+# Delivery is at least once:
+#  - Documents are only dropped from the queue once Mongo acknowledged them. A failed flush
+#    puts them back and retries with backoff; duplicate key errors count as delivered, which
+#    makes the retries (and reloaded spills) idempotent thanks to the pre-allocated _ids.
+#  - At interpreter exit whatever is still queued or in flight is spilled to a file under
+#    WRITE_BEHIND_SPILL_DIR, and the next worker process on the instance loads and flushes it.
+#    A spill only survives on the same instance (the temp directory is local).
+# Follow-up updates (e.g. moving the project's chatVersion) run after their document was
+# inserted, so a reader never sees the new version without the document.
+# Reads that must see a queued document on this instance can use find_pending().
+
+_buffers = weakref.WeakKeyDictionary()
+
+
+def enabled():
+    return os.getenv("WRITE_BEHIND", "false").lower() == "true"
+
+def _flush_seconds():
+    return int(os.getenv("WRITE_BEHIND_FLUSH_MS", 200)) / 1000
+
+def _max_batch():
+    return max(1, int(os.getenv("WRITE_BEHIND_MAX_BATCH", 100)))
+
+def _spill_dir():
+    return os.getenv("WRITE_BEHIND_SPILL_DIR") or os.path.join(tempfile.gettempdir(), "learnai-write-behind")
+
+
+class WriteBehindBuffer:
+    def __init__(self, db):
+        self.db = db
+        self.pending = []
+        self.in_flight = []
+        self.failures = 0
+        self.claimed_spills = []
+        self._timer = None
+        self._lock = asyncio.Lock()
+
+    def add(self, collection, document, follow_up=None):
+        self.pending.append({"collection": collection, "document": document, "followUp": follow_up})
+        self._schedule(0 if len(self.pending) >= _max_batch() else _flush_seconds())
+
+    def find(self, collection, document_id):
+        for entry in self.in_flight + self.pending:
+            if entry["collection"] == collection and entry["document"]["_id"] == document_id:
+                return entry["document"]
+        return None
+
+    def _schedule(self, delay):
+        if self._timer is not None and not self._timer.done():
+            # A flush that is due or running picks these up; only a waiting one is brought forward
+            if delay > 0 or self._lock.locked():
+                return
+            self._timer.cancel()
+        self._timer = asyncio.get_running_loop().create_task(self._flush_later(delay))
+
+    async def _flush_later(self, delay):
+        await asyncio.sleep(delay)
+        await self.flush()
+
+    async def flush(self):
+        """Writes what is queued. Entries that fail go back to the queue for the next flush."""
+        async with self._lock:
+            while self.pending:
+                batch = self.pending[:_max_batch()]
+                del self.pending[:len(batch)]
+                self.in_flight = batch
+                failed = await self._write(batch)
+                self.in_flight = []
+                if failed:
+                    self.pending[:0] = failed
+                    self.failures += 1
+                    delay = min(30, _flush_seconds() * 2 ** self.failures)
+                    logging.warning(f"Write-behind flush failed for {len(failed)} documents, retrying in {delay:.1f}s")
+                    self._timer = asyncio.get_running_loop().create_task(self._flush_later(delay))
+                    return
+                self.failures = 0
+            # Everything reloaded from spills is stored now
+            for path in self.claimed_spills:
+                os.remove(path)
+            self.claimed_spills = []
+
+    async def _write(self, batch):
+        from pymongo.errors import BulkWriteError
+        failed = []
+        collections = {}
+        for entry in batch:
+            collections.setdefault(entry["collection"], []).append(entry)
+        for collection, entries in collections.items():
+            with span("write_behind.flush", collection=collection, documents=len(entries)):
+                try:
+                    await self.db[collection].insert_many([e["document"] for e in entries], ordered=False)
+                    delivered = entries
+                except BulkWriteError as e:
+                    # Duplicate keys were delivered by an earlier attempt
+                    errors = {err["index"] for err in e.details.get("writeErrors", []) if err.get("code") != 11000}
+                    if e.details.get("writeConcernErrors"):
+                        errors = set(range(len(entries)))
+                    failed.extend(entries[i] for i in sorted(errors))
+                    delivered = [entry for i, entry in enumerate(entries) if i not in errors]
+                except Exception as e:
+                    logging.error(f"Write-behind insert into {collection} failed: {e}")
+                    failed.extend(entries)
+                    continue
+            for entry in delivered:
+                if entry["followUp"]:
+                    target, query, update = entry["followUp"]
+                    try:
+                        await self.db[target].update_one(query, update)
+                    except Exception as e:
+                        logging.error(f"Write-behind follow-up on {target} failed: {e}")
+        return failed
+
+    def spill(self):
+        """Writes queued and in-flight entries to a spill file (interpreter exit)."""
+        entries = self.in_flight + self.pending
+        if not entries:
+            return
+        os.makedirs(_spill_dir(), exist_ok=True)
+        path = os.path.join(_spill_dir(), f"spill-{os.getpid()}-{uuid.uuid4().hex}.jsonl")
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            for entry in entries:
+                f.write(json_util.dumps(entry) + "\n")
+        os.replace(path + ".tmp", path)
+        logging.warning(f"Write-behind spilled {len(entries)} documents to {path}")
+
+    def load_spills(self):
+        """Queues the entries of spill files left by earlier processes on this instance."""
+        for path in glob.glob(os.path.join(_spill_dir(), "spill-*")):
+            if path.endswith(".tmp") or not _abandoned(path):
+                continue
+            claimed = f"{path.split('.claimed-')[0]}.claimed-{os.getpid()}"
+            try:
+                # Only one process wins the rename
+                os.replace(path, claimed)
+            except OSError:
+                continue
+            with open(claimed, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json_util.loads(line)
+                        if entry.get("followUp"):
+                            entry["followUp"] = tuple(entry["followUp"])
+                        self.pending.append(entry)
+            # Removed once flushed; if this process dies first, the next one claims it again
+            self.claimed_spills.append(claimed)
+            logging.info(f"Write-behind reloaded spill {path}")
+        if self.pending:
+            self._schedule(0)
+
+
+def _abandoned(path):
+    """Unclaimed spills, and spills claimed by a process that is gone."""
+    if ".claimed-" not in path:
+        return True
+    try:
+        os.kill(int(path.rsplit("-", 1)[1]), 0)
+    except ProcessLookupError:
+        return True
+    except (ValueError, OSError):
+        return False
+    return False
+
+
+def get_write_buffer(db):
+    """The buffer of the running event loop, created (and fed any spills) on first use."""
+    loop = asyncio.get_running_loop()
+    buffer = _buffers.get(loop)
+    if buffer is None:
+        buffer = WriteBehindBuffer(db)
+        _buffers[loop] = buffer
+        buffer.load_spills()
+    return buffer
+
+async def insert(db, collection, document, follow_up=None):
+    """
+    Inserts `document`, behind the response when WRITE_BEHIND is on. `document` gets an _id
+    first if it has none, so callers can return it right away. `follow_up` is an optional
+    (collection, filter, update) applied with update_one once the document is stored.
+    """
+    document.setdefault("_id", ObjectId())
+    if not enabled():
+        await db[collection].insert_one(document)
+        if follow_up:
+            target, query, update = follow_up
+            await db[target].update_one(query, update)
+        return document["_id"]
+    get_write_buffer(db).add(collection, document, follow_up)
+    return document["_id"]
+
+def find_pending(collection, document_id):
+    """A document of `collection` still queued on this event loop, or None."""
+    try:
+        buffer = _buffers.get(asyncio.get_running_loop())
+    except RuntimeError:
+        return None
+    return buffer.find(collection, document_id) if buffer else None
+
+@atexit.register
+def _spill_all():
+    for buffer in list(_buffers.values()):
+        try:
+            buffer.spill()
+        except Exception as e:
+            logging.error(f"Write-behind spill failed: {e}")
@@ -0,0 +1,63 @@
+import asyncio
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from urllib.parse import urlparse, parse_qs
+
+from azure.storage.blob import UserDelegationKey
+
+from shared import blob_urls
+
+AZURITE = ("DefaultEndpointsProtocol=http;AccountName=devstoreaccount1;"
+           "AccountKey=Eby8vdM02xNOcqFlqUwJPLlmEtlCDXJ1OUzFT50uSRZ6IFsuFq2UVErCz4I6tq/K1SZFPTOtr/KBHBeksoGMGw==;"
+           "BlobEndpoint=http://127.0.0.1:10000/devstoreaccount1;")
+
+
+def test_urls_are_cached_per_window_and_legacy_urls_resolve(monkeypatch):
+    monkeypatch.setenv("BLOB_STORAGE_CONNECTION_STRING", AZURITE)
+    now = datetime(2024, 5, 1, 12, 10, tzinfo=timezone.utc)
+    monkeypatch.setattr(blob_urls, "sas_window", lambda: int(now.timestamp() // 3600))
+
+    song = blob_urls.with_audio_url({"title": "Cells", "audioBlob": "p1/s1.mp3"})
+    assert "audioBlob" not in song
+    url = urlparse(song["audioUrl"])
+    assert url.path == "/devstoreaccount1/songs/p1/s1.mp3"
+    # Valid until the end of the next window
+    assert parse_qs(url.query)["se"] == ["2024-05-01T14:00:00Z"]
+    assert blob_urls.signed_url("p1/s1.mp3") == song["audioUrl"]
+
+    now = datetime(2024, 5, 1, 13, 1, tzinfo=timezone.utc)
+    assert blob_urls.signed_url("p1/s1.mp3") != song["audioUrl"]
+
+    # Songs saved with a 24 hour SAS get a fresh one for the same blob
+    legacy = {"audioUrl": "http://127.0.0.1:10000/devstoreaccount1/songs/p1/s0.mp3?se=2020-01-01&sig=x"}
+    assert urlparse(blob_urls.with_audio_url(legacy)["audioUrl"]).path.endswith("/songs/p1/s0.mp3")
+    assert blob_urls.blob_from_url("https://acct.blob.core.windows.net/songs/p1/s2.mp3?sig=y") == "p1/s2.mp3"
+    assert blob_urls.blob_from_url("https://acct.blob.core.windows.net/docs/p1/a.pdf") is None
+
+
+def test_delegation_key_is_fetched_once_per_window(monkeypatch):
+    requests = []
+
+    class TokenClient:
+        account_name = "acct"
+        credential = SimpleNamespace(token="aad")
+
+        async def get_user_delegation_key(self, start, expiry):
+            requests.append((start, expiry))
+            key = UserDelegationKey()
+            key.signed_oid, key.signed_tid, key.signed_service, key.signed_version = "o", "t", "b", "2020-02-10"
+            key.signed_start, key.signed_expiry, key.value = "s", "e", "a2V5"
+            return key
+
+        def get_blob_client(self, container, blob):
+            return SimpleNamespace(url=f"https://acct.blob.core.windows.net/{container}/{blob}")
+
+    monkeypatch.setattr(blob_urls, "get_async_blob_service_client", TokenClient)
+    monkeypatch.setattr(blob_urls, "sas_window", lambda: 480000)
+
+    async def sign_all():
+        return [await blob_urls.signed_url_async(f"p1/{i}.mp3") for i in range(5)]
+
+    urls = asyncio.run(sign_all())
+    assert len(requests) == 1 and len(set(urls)) == 5
+    assert all("skoid=o" in url for url in urls)
@@ -0,0 +1,33 @@
+import asyncio
+import mongomock
+from bson import ObjectId
+
+from benchmarks.standins import AsyncDatabaseShim
+from shared import chat_history
+
+PROJECT_ID = "65f000000000000000000007"
+
+
+def test_load_earlier_walks_back_through_the_history():
+    db = mongomock.MongoClient().db
+    for i in range(7):
+        # Two exchanges share each timestamp, the _id keeps them apart
+        db.chat_history.insert_one({"projectId": PROJECT_ID, "userId": "u1", "message": f"q{i}", "answer": "",
+                                    "timestamp": f"2024-01-0{i // 2 + 1}"})
+    db.chat_history.insert_one({"projectId": PROJECT_ID, "userId": "u2", "message": "other", "answer": "",
+                                "timestamp": "2024-01-01"})
+
+    latest = chat_history.page(db, "u1", PROJECT_ID, limit=3)
+    assert [m["message"] for m in latest["messages"]] == ["q4", "q5", "q6"] and latest["hasMore"]
+
+    earlier = chat_history.page(db, "u1", PROJECT_ID, limit=3, before=latest["messages"][0]["_id"])
+    assert [m["message"] for m in earlier["messages"]] == ["q1", "q2", "q3"] and earlier["hasMore"]
+
+    async_db = AsyncDatabaseShim(db)
+    first = asyncio.run(chat_history.page_async(async_db, "u1", PROJECT_ID, limit=3,
+                                                before=str(earlier["messages"][0]["_id"])))
+    assert [m["message"] for m in first["messages"]] == ["q0"] and not first["hasMore"]
+
+    other = db.chat_history.find_one({"userId": "u2"})["_id"]
+    assert chat_history.page(db, "u1", PROJECT_ID, before=other) is None
+    assert chat_history.page(db, "u1", PROJECT_ID, before=ObjectId()) is None
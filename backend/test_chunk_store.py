@@ -0,0 +1,37 @@
+import mongomock
+
+from benchmarks.standins import VectorSearchDatabase
+from shared import chunk_store
+from shared.rag import _vector_search_pipeline
+
+PROJECT_ID = "65f000000000000000000004"
+
+
+def chunk(i, vector):
+    return {"_id": f"{PROJECT_ID}/a.pdf@h#{i}", "chunk_index": i, "text": f"text {i}", "vector": vector,
+            "contentHash": "h", "metadata": {"projectId": PROJECT_ID, "source": "a.pdf", "headings": ["Cells"]}}
+
+
+def test_vectors_are_stored_apart_and_search_joins_the_top_hits():
+    raw = mongomock.MongoClient().db
+    chunk_store.insert_chunks(raw, [chunk(0, [1.0, 0.0]), chunk(1, [0.0, 1.0]), chunk(2, [0.7, 0.7])])
+
+    assert all("vector" not in doc for doc in raw.docs.find())
+    assert set(raw.doc_vectors.find_one()) == {"_id", "vector", "metadata", "contentHash"}
+
+    hits = list(VectorSearchDatabase(raw).doc_vectors.aggregate(_vector_search_pipeline(PROJECT_ID, [1.0, 0.1], 2)))
+    assert [(hit["text"], hit["chunk_index"]) for hit in hits] == [("text 0", 0), ("text 2", 2)]
+    assert hits[0]["metadata"]["headings"] == ["Cells"] and hits[0]["score"] > hits[1]["score"]
+
+    chunk_store.delete_chunks(raw, {"metadata.projectId": PROJECT_ID, "contentHash": {"$ne": "other"}})
+    assert raw.docs.count_documents({}) == raw.doc_vectors.count_documents({}) == 0
+
+
+def test_migration_moves_vectors_out_of_docs():
+    db = mongomock.MongoClient().db
+    db.docs.insert_many([chunk(i, [float(i), 1.0]) for i in range(5)])
+
+    assert chunk_store.migrate_vectors(db, batch_size=2) == 5
+    assert chunk_store.migrate_vectors(db) == 0
+    assert db.docs.count_documents({"vector": {"$exists": True}}) == 0
+    assert db.doc_vectors.find_one({"_id": f"{PROJECT_ID}/a.pdf@h#3"})["vector"] == [3.0, 1.0]
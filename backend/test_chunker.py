@@ -0,0 +1,53 @@
+from process_file.chunker import Block, chunk_blocks, blocks_from_text, count_tokens
+
+
+def sentences(prefix, count, words=12):
+    return " ".join(f"{prefix} sentence {i} " + "word " * words + "end." for i in range(count))
+
+
+def test_chunks_respect_token_budget_and_carry_pages_and_headings():
+    blocks = [
+        Block("Biology", 1, "title"),
+        Block("Page 1 header", 1, "pageHeader"),
+        Block("Cells", 1, "sectionHeading"),
+        Block(sentences("cell", 20), 1),
+        Block(sentences("membrane", 20), 2),
+        Block("Genetics", 3, "sectionHeading"),
+        Block(sentences("gene", 5), 3),
+    ]
+    chunks = list(chunk_blocks(blocks, max_tokens=120, overlap_tokens=30))
+
+    assert all(chunk.tokens <= 120 for chunk in chunks)
+    assert all(count_tokens(chunk.text) <= 130 for chunk in chunks)
+    assert not any("header" in chunk.text for chunk in chunks)
+
+    cells = [chunk for chunk in chunks if chunk.headings == ["Biology", "Cells"]]
+    genetics = [chunk for chunk in chunks if chunk.headings == ["Biology", "Genetics"]]
+    assert len(cells) + len(genetics) == len(chunks)
+    # Sections never share a chunk
+    assert all("gene sentence" not in chunk.text for chunk in cells)
+    assert [(c.page_start, c.page_end) for c in genetics] == [(3, 3)]
+    assert cells[0].page_start == 1 and cells[-1].page_end == 2
+    assert any(c.page_start == 1 and c.page_end == 2 for c in cells)
+
+
+def test_consecutive_chunks_overlap_by_whole_sentences():
+    chunks = list(chunk_blocks([Block(sentences("s", 30))], max_tokens=100, overlap_tokens=30))
+    assert len(chunks) > 2
+    for previous, current in zip(chunks, chunks[1:]):
+        last_sentence = previous.text.split("end.")[-2] + "end."
+        assert current.text.startswith(last_sentence.strip())
+
+
+def test_plain_text_pages_and_markdown_headings():
+    text = "# Notes\n\nIntro paragraph.\n\n## Part A\n\nFirst page text.\fSecond page text."
+    blocks = list(blocks_from_text(text))
+    assert [(b.text, b.page, b.role) for b in blocks] == [
+        ("Notes", 1, "title"),
+        ("Intro paragraph.", 1, None),
+        ("Part A", 1, "sectionHeading"),
+        ("First page text.", 1, None),
+        ("Second page text.", 2, None),
+    ]
+    chunks = list(chunk_blocks(blocks))
+    assert [(c.headings, c.page_start, c.page_end) for c in chunks] == [(["Notes"], 1, 1), (["Notes", "Part A"], 1, 2)]
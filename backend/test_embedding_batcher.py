@@ -0,0 +1,38 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from benchmarks.fake_services import FakeServices, FakeServiceConfig, fake_embedding
+from shared.embedding_batcher import EmbeddingAggregator
+
+
+def test_concurrent_jobs_share_batches_against_fake_embeddings_server(monkeypatch):
+    config = FakeServiceConfig(latency_ms=20, jitter_ms=0, embedding_dims=8)
+    with FakeServices(config) as services:
+        monkeypatch.setenv("AZURE_OPENAI_ENDPOINT", services.endpoint)
+        monkeypatch.setenv("AZURE_OPENAI_API_KEY", "test")
+        monkeypatch.setenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT", "embeddings")
+        aggregator = EmbeddingAggregator(window_ms=200, max_inputs=64, max_in_flight=2)
+
+        jobs = [[f"document {d} chunk {c}" for c in range(12)] for d in range(8)]
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            results = list(pool.map(aggregator.embed, jobs))
+
+    # 96 inputs in batches of at most 64 instead of 8 separate calls
+    assert config.calls["embedding_inputs"] == 96
+    assert config.calls["embeddings"] <= 3
+    # Every vector is routed back to the job and position it was asked for
+    for texts, vectors in zip(jobs, results):
+        assert vectors == [pytest.approx(fake_embedding(text, 8)) for text in texts]
+
+
+def test_batch_failure_is_raised_in_every_job_of_the_batch():
+    def failing_embed(texts):
+        raise RuntimeError("429 Too Many Requests")
+
+    aggregator = EmbeddingAggregator(embed=failing_embed, window_ms=100)
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        futures = [pool.submit(aggregator.embed, ["a", "b"]), pool.submit(aggregator.embed, ["c"])]
+        for future in futures:
+            with pytest.raises(RuntimeError, match="429"):
+                future.result(timeout=5)
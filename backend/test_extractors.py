@@ -0,0 +1,90 @@
+import zipfile
+from io import BytesIO
+from types import SimpleNamespace
+
+import pytest
+
+import process_file.extractors as extractors
+from process_file.chunker import TITLE_ROLE, HEADING_ROLE
+
+W_NS = 'xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"'
+P_NS = ('xmlns:p="http://schemas.openxmlformats.org/presentationml/2006/main" '
+        'xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"')
+
+
+def package(parts):
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for name, xml in parts.items():
+            archive.writestr(name, xml)
+    return buffer.getvalue()
+
+def roles(blocks):
+    return [(block.text, block.page, block.role) for block in blocks]
+
+
+@pytest.fixture(autouse=True)
+def no_document_intelligence(monkeypatch):
+    def analyze(file_stream):
+        raise AssertionError("text-native formats must not reach Document Intelligence")
+    monkeypatch.setattr(extractors, "analyze_document", analyze)
+
+
+def test_docx_keeps_headings_by_style_name_and_tables():
+    paragraph = lambda style, text: (f'<w:p><w:pPr><w:pStyle w:val="{style}"/></w:pPr><w:r><w:t>{text}</w:t></w:r></w:p>'
+                                     if style else f'<w:p><w:r><w:t>{text}</w:t></w:r></w:p>')
+    document = (f'<w:document {W_NS}><w:body>' + paragraph("Titel", "Cells") + paragraph("Kop1", "Mitosis")
+                + paragraph(None, "Cells divide.") + '<w:p/>'
+                + '<w:tbl><w:tr><w:tc><w:p><w:r><w:t>Phase</w:t></w:r></w:p></w:tc>'
+                + '<w:tc><w:p><w:r><w:t>Length</w:t></w:r></w:p></w:tc></w:tr></w:tbl></w:body></w:document>')
+    styles = (f'<w:styles {W_NS}><w:style w:styleId="Titel"><w:name w:val="Title"/></w:style>'
+              f'<w:style w:styleId="Kop1"><w:name w:val="heading 1"/></w:style></w:styles>')
+    data = package({"word/document.xml": document, "word/styles.xml": styles})
+
+    assert roles(extractors.extract_blocks("Notes.DOCX", data)) == [
+        ("Cells", None, TITLE_ROLE), ("Mitosis", None, HEADING_ROLE), ("Cells divide.", None, None),
+        ("Phase | Length", None, None)]
+
+
+def test_pptx_reads_slides_in_presentation_order():
+    slide = lambda title, body: (f'<p:sld {P_NS}><p:cSld><p:spTree>'
+                                 f'<p:sp><p:nvSpPr><p:nvPr><p:ph type="title"/></p:nvPr></p:nvSpPr>'
+                                 f'<p:txBody><a:p><a:r><a:t>{title}</a:t></a:r></a:p></p:txBody></p:sp>'
+                                 f'<p:sp><p:nvSpPr><p:nvPr/></p:nvSpPr><p:txBody><a:p><a:r><a:t>{body}</a:t></a:r></a:p>'
+                                 f'</p:txBody></p:sp></p:spTree></p:cSld></p:sld>')
+    data = package({
+        "ppt/presentation.xml": f'<p:presentation {P_NS}><p:sldIdLst><p:sldId r:id="rId3"/><p:sldId r:id="rId2"/>'
+                                f'</p:sldIdLst></p:presentation>',
+        "ppt/_rels/presentation.xml.rels": '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                                           '<Relationship Id="rId2" Target="slides/slide1.xml"/>'
+                                           '<Relationship Id="rId3" Target="slides/slide2.xml"/></Relationships>',
+        "ppt/slides/slide1.xml": slide("Prophase", "Chromosomes condense."),
+        "ppt/slides/slide2.xml": slide("Overview", "Four phases."),
+    })
+
+    assert roles(extractors.extract_blocks("deck.pptx", data)) == [
+        ("Overview", 1, HEADING_ROLE), ("Four phases.", 1, None),
+        ("Prophase", 2, HEADING_ROLE), ("Chromosomes condense.", 2, None)]
+
+
+def test_html_and_markdown_structure():
+    html = (b"<html><head><title>x</title><style>p {}</style></head><body><h1>Cells</h1>"
+            b"<p>Cells  divide\n often.</p><script>var a;</script><h2>Mitosis</h2><ul><li>One</li><li>Two</li></ul>"
+            b"</body></html>")
+    assert roles(extractors.extract_blocks("page.html", html)) == [
+        ("Cells", None, TITLE_ROLE), ("Cells divide often.", None, None), ("Mitosis", None, HEADING_ROLE),
+        ("One", None, None), ("Two", None, None)]
+
+    markdown = "# Cells\nIntro line\n\n## Code\n```\n# not a heading\n```\n".encode()
+    assert roles(extractors.extract_blocks("notes.md", markdown)) == [
+        ("Cells", None, TITLE_ROLE), ("Intro line", None, None), ("Code", None, HEADING_ROLE),
+        ("```\n# not a heading\n```", None, None)]
+
+
+def test_types_without_an_extractor_go_to_document_intelligence(monkeypatch):
+    analyzed = []
+    monkeypatch.setattr(extractors, "analyze_document", lambda data: analyzed.append(data) or SimpleNamespace(
+        paragraphs=[SimpleNamespace(content="Sheet text", bounding_regions=[SimpleNamespace(page_number=1)], role=None)]))
+    assert roles(extractors.extract_blocks("grades.xlsx", b"xlsx")) == [("Sheet text", 1, None)]
+    assert analyzed == [b"xlsx"]
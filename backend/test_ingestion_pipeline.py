@@ -0,0 +1,85 @@
+from types import SimpleNamespace
+
+import mongomock
+import pytest
+from bson import ObjectId
+
+import shared.ingestion_state
+import shared.llm
+from shared import topic_map
+import process_file.ingestion_logic as ingestion_logic
+
+PROJECT_ID = "65f000000000000000000002"
+
+
+class FakeOpenAI:
+    def __init__(self):
+        self.embedding_calls = []
+        self.embeddings = SimpleNamespace(create=self.create_embeddings)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create_completion))
+
+    def with_options(self, **options):
+        return self
+
+    def create_embeddings(self, input, model):
+        self.embedding_calls.append(len(input))
+        return SimpleNamespace(usage=None, data=[
+            SimpleNamespace(index=i, embedding=[float(len(text)), 1.0]) for i, text in enumerate(input)])
+
+    def create_completion(self, **kwargs):
+        return SimpleNamespace(usage=None, choices=[SimpleNamespace(message=SimpleNamespace(content="<h1>Summary</h1>"))])
+
+
+@pytest.fixture
+def env(monkeypatch):
+    db = mongomock.MongoClient().db
+    db.projects.insert_one({"_id": ObjectId(PROJECT_ID), "status": "ready", "processingCount": 0})
+    openai = FakeOpenAI()
+    monkeypatch.setattr(ingestion_logic, "get_mongo_db", lambda: db)
+    monkeypatch.setattr(shared.llm, "get_openai_client", lambda: openai)
+    monkeypatch.setattr(shared.ingestion_state, "get_mongo_db", lambda: db)
+    monkeypatch.setenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT", "embeddings")
+    monkeypatch.setenv("INGESTION_EMBED_BATCH_SIZE", "4")
+    return SimpleNamespace(db=db, openai=openai)
+
+
+def document(seed, paragraphs=30):
+    return "\n\n".join(f"Paragraph {seed}-{i}. " + "Cells divide and grow. " * 20 for i in range(paragraphs)).encode()
+
+
+def test_document_is_embedded_and_stored_in_batches(env):
+    ingestion_logic.process_document("notes.txt", document("a"), PROJECT_ID)
+
+    stored = list(env.db.docs.find({"metadata.projectId": PROJECT_ID}))
+    assert len(stored) == sum(env.openai.embedding_calls)
+    assert max(env.openai.embedding_calls) == 4
+    assert [d["chunk_index"] for d in sorted(stored, key=lambda d: d["chunk_index"])] == list(range(len(stored)))
+
+    record = env.db.documents.find_one({"filename": "notes.txt"})
+    assert record["status"] == "stored"
+    assert record["progress"]["chunksTotal"] == len(stored)
+    assert record["summary"] == "<h1>Summary</h1>"
+
+    # Progress ticks move statusVersion, only the stored document moves the content version
+    project = env.db.projects.find_one({"_id": ObjectId(PROJECT_ID)})
+    assert project["contentVersion"] == 1 and project["statusVersion"] > 2
+
+
+def test_rerun_skips_stored_batches_and_reupload_replaces_chunks(env):
+    content = document("a")
+    ingestion_logic.process_document("notes.txt", content, PROJECT_ID)
+    first_count = env.db.docs.count_documents({})
+    topic_map.rebuild_due_topic_maps(env.db)
+
+    # Retrying the same content (e.g. after a crash) doesn't embed or store anything again
+    env.openai.embedding_calls.clear()
+    ingestion_logic.process_document("notes.txt", content, PROJECT_ID)
+    assert env.openai.embedding_calls == []
+    assert env.db.docs.count_documents({}) == first_count
+    # but the skipped chunks may never have reached the topic map, so it is rebuilt
+    assert env.db.topic_maps.find_one({"_id": PROJECT_ID})["rebuildDue"]
+
+    # A new version of the file replaces the old chunks once it is stored
+    ingestion_logic.process_document("notes.txt", document("b", paragraphs=10), PROJECT_ID)
+    texts = [d["text"] for d in env.db.docs.find({})]
+    assert texts and all("Paragraph b-" in text for text in texts)
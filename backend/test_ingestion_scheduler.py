@@ -0,0 +1,104 @@
+import time
+import itertools
+from types import SimpleNamespace
+
+from shared.ingestion_queue import encode_job
+from process_file.scheduler import IngestionScheduler, IngestionJob, interleave_by_project
+
+# In-memory stand-in for azure.storage.queue.QueueClient (visibility is not simulated,
+# every receive returns the messages that were not deleted or delayed).
+
+class FakeQueue:
+    def __init__(self, contents=()):
+        self.ids = itertools.count()
+        self.messages = {}
+        self.delayed = {}
+        for content in contents:
+            self.send_message(content)
+
+    def send_message(self, content):
+        message_id = str(next(self.ids))
+        self.messages[message_id] = SimpleNamespace(
+            id=message_id, content=content, pop_receipt="r0", dequeue_count=0)
+
+    def receive_messages(self, max_messages, visibility_timeout):
+        received = []
+        for message in list(self.messages.values())[:max_messages]:
+            message.dequeue_count += 1
+            received.append(message)
+            del self.messages[message.id]
+            self.delayed[message.id] = message
+        return received
+
+    def delete_message(self, message_id, pop_receipt):
+        self.delayed.pop(message_id, None)
+
+    def update_message(self, message_id, pop_receipt, visibility_timeout):
+        message = self.delayed[message_id]
+        if visibility_timeout == 0:
+            self.messages[message_id] = self.delayed.pop(message_id)
+        return SimpleNamespace(pop_receipt=f"r{message.dequeue_count}")
+
+
+def job(project_id, filename):
+    return IngestionJob(SimpleNamespace(id=filename, pop_receipt="r", dequeue_count=1), project_id, filename)
+
+
+def test_interleave_is_round_robin_across_projects():
+    jobs = [job("a", "a1"), job("a", "a2"), job("a", "a3"), job("b", "b1"), job("c", "c1"), job("b", "b2")]
+    ordered = [j.filename for j in interleave_by_project(jobs)]
+    assert ordered == ["a1", "b1", "c1", "a2", "b2", "a3"]
+
+
+def test_interleave_puts_busy_projects_last():
+    jobs = [job("a", "a1"), job("b", "b1")]
+    ordered = [j.filename for j in interleave_by_project(jobs, busy={"a": 2})]
+    assert ordered == ["b1", "a1"]
+
+
+def test_failed_jobs_are_retried_then_poisoned():
+    queue = FakeQueue([encode_job("p1", "ok.pdf"), encode_job("p1", "bad.pdf"), "not json"])
+    poison = FakeQueue()
+    processed = []
+
+    def process(filename, content, project_id):
+        if filename == "bad.pdf":
+            raise RuntimeError("boom")
+        processed.append(filename)
+
+    scheduler = IngestionScheduler(queue_client=queue, poison_queue_client=poison, process=process,
+                                   download=lambda project_id, filename: b"data",
+                                   max_concurrency=2, visibility_timeout=10, max_attempts=2)
+    stats = scheduler.run(time_budget_seconds=5)
+
+    assert processed == ["ok.pdf"]
+    assert stats["processed"] == 1
+    assert stats["failed"] == 1
+    # The undecodable message goes straight to the poison queue, bad.pdf is delayed for a retry
+    assert [m.content for m in poison.messages.values()] == ["not json"]
+    assert list(queue.delayed) == ["1"]
+
+    # Second attempt reaches max_attempts and is poisoned
+    queue.messages.update(queue.delayed)
+    queue.delayed.clear()
+    scheduler.run(time_budget_seconds=5)
+    assert len(poison.messages) == 2
+    assert not queue.messages and not queue.delayed
+
+
+def test_jobs_running_past_the_deadline_are_abandoned():
+    queue = FakeQueue([encode_job("p1", "huge.pdf"), encode_job("p2", "next.pdf")])
+
+    def process(filename, content, project_id):
+        time.sleep(1.5)
+
+    scheduler = IngestionScheduler(queue_client=queue, poison_queue_client=FakeQueue(), process=process,
+                                   download=lambda project_id, filename: b"data",
+                                   max_concurrency=1, visibility_timeout=10, job_seconds=0.2)
+    started = time.monotonic()
+    stats = scheduler.run(time_budget_seconds=0.1)
+
+    assert time.monotonic() - started < 1
+    assert stats["abandoned"] == 1 and stats["processed"] == 0
+    # The job that never started is released right away, the abandoned one waits for its visibility timeout
+    assert list(queue.messages) == ["1"] and list(queue.delayed) == ["0"]
@@ -0,0 +1,84 @@
+import mongomock
+import pytest
+from bson import ObjectId
+
+from shared import ingestion_state
+from shared.ingestion_state import DocumentIngestion, QUEUED, EXTRACTING, EMBEDDING
+
+
+PROJECT_ID = "65f000000000000000000001"
+
+
+@pytest.fixture
+def db():
+    db = mongomock.MongoClient().db
+    db.projects.insert_one({"_id": ObjectId(PROJECT_ID), "status": "ready", "processingCount": 0})
+    return db
+
+
+def project(db):
+    return db.projects.find_one({"_id": ObjectId(PROJECT_ID)})
+
+
+def test_project_counts_each_active_document_once(db):
+    ingestion_state.mark_active(db, PROJECT_ID, "a.pdf", QUEUED)
+    ingestion_state.mark_active(db, PROJECT_ID, "b.pdf", QUEUED)
+    # Moving through the stages doesn't count the document again
+    ingestion_state.mark_active(db, PROJECT_ID, "a.pdf", EXTRACTING)
+    ingestion_state.mark_active(db, PROJECT_ID, "a.pdf", EMBEDDING)
+    assert project(db)["processingCount"] == 2
+    assert project(db)["status"] == "processing"
+
+    assert ingestion_state.mark_finished(db, PROJECT_ID, "a.pdf", ingestion_state.STORED)
+    # Finishing twice (e.g. a duplicate delivery) is a no-op
+    assert not ingestion_state.mark_finished(db, PROJECT_ID, "a.pdf", ingestion_state.STORED)
+    assert project(db)["processingCount"] == 1
+
+    ingestion_state.mark_finished(db, PROJECT_ID, "b.pdf", ingestion_state.FAILED, error="boom")
+    assert project(db)["processingCount"] == 0
+    assert project(db)["status"] == "ready"
+    assert db.documents.find_one({"filename": "b.pdf"})["error"] == "boom"
+
+
+def test_document_ingestion_records_failure_and_timings(db):
+    ingestion_state.mark_active(db, PROJECT_ID, "c.txt", QUEUED)
+    ingestion = DocumentIngestion(PROJECT_ID, "c.txt", db=db)
+    ingestion.stage(EXTRACTING)
+    ingestion.stage(EMBEDDING, chunksTotal=3, chunksEmbedded=0)
+    ingestion.failed(RuntimeError("embedding service down"))
+
+    doc = db.documents.find_one({"filename": "c.txt"})
+    assert doc["status"] == "failed"
+    assert doc["error"] == "embedding service down"
+    assert doc["progress"] == {"chunksTotal": 3, "chunksEmbedded": 0}
+    assert set(doc["timings"]) == {"extractingMs", "embeddingMs", "totalMs"}
+    assert project(db)["status"] == "ready"
+
+
+def test_stale_documents_are_failed_and_project_reconciled(db):
+    db.projects.update_one({"_id": ObjectId(PROJECT_ID)}, {"$set": {"status": "processing", "processingCount": 3}})
+    db.documents.insert_one({"projectId": PROJECT_ID, "filename": "old.pdf", "status": EXTRACTING,
+                             "statusUpdatedAt": "2020-01-01T00:00:00"})
+    docs = list(db.documents.find({"projectId": PROJECT_ID}, ingestion_state.STATUS_PROJECTION))
+
+    assert ingestion_state.fail_stale(db, PROJECT_ID, docs) == 1
+    reconciled = ingestion_state.reconcile_project(db, PROJECT_ID, project(db), docs)
+    assert reconciled["processingCount"] == 0
+    assert reconciled["status"] == "ready"
+
+
+def test_status_version_moves_with_every_visible_change(db):
+    versions = []
+    ingestion_state.mark_active(db, PROJECT_ID, "a.pdf", QUEUED)
+    versions.append(project(db)["statusVersion"])
+    ingestion_state.mark_active(db, PROJECT_ID, "a.pdf", EXTRACTING)
+    versions.append(project(db)["statusVersion"])
+    DocumentIngestion(PROJECT_ID, "a.pdf", db).progress(chunksTotal=4)
+    versions.append(project(db)["statusVersion"])
+    ingestion_state.mark_finished(db, PROJECT_ID, "a.pdf", ingestion_state.STORED)
+    versions.append(project(db)["statusVersion"])
+    assert versions == [1, 2, 3, 4]
+
+    status = ingestion_state.project_status(db, PROJECT_ID)
+    assert status["version"] == 4 and status["status"] == "ready"
+    assert ingestion_state.project_status(db, PROJECT_ID, uid="someone-else") is None
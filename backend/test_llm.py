@@ -0,0 +1,88 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from shared import llm
+from shared.rate_governor import RateGovernor
+
+
+class FakeAsyncOpenAI:
+    """Answers after the delay configured for the deployment (or the nth call to it)."""
+
+    def __init__(self, delays):
+        self.delays = delays
+        self.started = []
+        self.cancelled = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def with_options(self, **options):
+        return self
+
+    async def create(self, model, **kwargs):
+        call = len(self.started)
+        self.started.append(model)
+        delay = self.delays[model]
+        if isinstance(delay, list):
+            delay = delay[call]
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            self.cancelled.append(call)
+            raise
+        return SimpleNamespace(model=model, usage=None,
+                               choices=[SimpleNamespace(message=SimpleNamespace(content=f"answer {call}"))])
+
+
+@pytest.fixture
+def governor(monkeypatch):
+    governor = RateGovernor()
+    monkeypatch.setattr(llm, "get_rate_governor", lambda: governor)
+    monkeypatch.setattr(llm, "_latencies", llm.LatencyTracker())
+    monkeypatch.setenv("LLM_HEDGE_DELAY_MS", "50")
+    monkeypatch.setenv("LLM_HEDGE_MIN_DELAY_MS", "10")
+    return governor
+
+
+def run_with_deadline(monkeypatch, seconds, coroutine_function):
+    monkeypatch.setenv("LLM_DEADLINE_TEST", str(seconds))
+    return asyncio.run(llm.with_deadline("test")(coroutine_function)())
+
+
+def test_slow_call_is_hedged_and_the_loser_cancelled(monkeypatch, governor):
+    client = FakeAsyncOpenAI({"chat": [2.0, 0.01]})
+    monkeypatch.setattr(llm, "get_async_openai_client", lambda: client)
+
+    async def ask():
+        return await llm.chat_completion_async(hedge=True, model="chat", messages=[{"role": "user", "content": "hi"}])
+
+    response = run_with_deadline(monkeypatch, 5, ask)
+    assert response.choices[0].message.content == "answer 1"
+    assert client.cancelled == [0]
+
+
+def test_throttled_deployment_falls_back_within_the_deadline(monkeypatch, governor):
+    client = FakeAsyncOpenAI({"gpt-4o": 0.01, "gpt-4o-mini": 0.01})
+    monkeypatch.setattr(llm, "get_async_openai_client", lambda: client)
+    # Azure asked us to back off from gpt-4o for longer than the request has left
+    governor.record_rate_limited("gpt-4o", retry_after=60)
+
+    async def ask():
+        return await llm.chat_completion_async(fallbacks=["gpt-4o-mini"], model="gpt-4o",
+                                               messages=[{"role": "user", "content": "hi"}])
+
+    response = run_with_deadline(monkeypatch, 10, ask)
+    assert response.model == "gpt-4o-mini"
+    assert client.started == ["gpt-4o-mini"]
+
+
+def test_call_stops_at_the_deadline(monkeypatch, governor):
+    client = FakeAsyncOpenAI({"chat": 5.0})
+    monkeypatch.setattr(llm, "get_async_openai_client", lambda: client)
+
+    async def ask():
+        return await llm.chat_completion_async(model="chat", messages=[{"role": "user", "content": "hi"}])
+
+    with pytest.raises(llm.DeadlineExceeded):
+        run_with_deadline(monkeypatch, 0.2, ask)
+    assert client.cancelled == [0]
@@ -0,0 +1,30 @@
+import mongomock
+from bson import ObjectId
+
+from api_projects.workspace import load_workspace
+
+
+def test_workspace_returns_owned_project_with_latest_chat_page():
+    db = mongomock.MongoClient()["mnemoniq"]
+    pid = db.projects.insert_one({"name": "Bio", "subject": "Cells", "ownerId": "u1", "status": "ready"}).inserted_id
+    project_id = str(pid)
+    db.documents.insert_one({"projectId": project_id, "filename": "a.pdf", "summary": "<p>A</p>", "queuedAt": "x"})
+    for i in range(5):
+        db.chat_history.insert_one({"projectId": project_id, "userId": "u1", "message": f"q{i}", "answer": f"a{i}",
+                                    "timestamp": f"2024-01-0{i + 1}"})
+    db.chat_history.insert_one({"projectId": project_id, "userId": "u2", "message": "other", "answer": "",
+                                "timestamp": "2024-02-01"})
+    db.songs.insert_one({"projectId": project_id, "userId": "u1", "title": "Old", "createdAt": "2024-01-01"})
+    db.songs.insert_one({"projectId": project_id, "userId": "u1", "title": "New", "createdAt": "2024-01-02"})
+
+    workspace = load_workspace(db, "u1", project_id, chat_limit=3)
+
+    assert workspace["project"] == {"_id": pid, "name": "Bio", "subject": "Cells", "status": "ready"}
+    assert [d["filename"] for d in workspace["documents"]] == ["a.pdf"]
+    assert "queuedAt" not in workspace["documents"][0]
+    assert [m["message"] for m in workspace["chat"]["messages"]] == ["q2", "q3", "q4"]
+    assert workspace["chat"]["hasMore"] is True
+    assert [s["title"] for s in workspace["songs"]] == ["New", "Old"]
+
+    assert load_workspace(db, "u2", project_id) is None
+    assert load_workspace(db, "u1", str(ObjectId())) is None
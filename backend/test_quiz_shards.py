@@ -0,0 +1,61 @@
+import re
+import json
+import asyncio
+from types import SimpleNamespace
+
+from api_quiz import quiz_shards
+
+
+def chunk(source, heading, page, text):
+    return {"text": text, "metadata": {"source": source, "headings": [heading], "pageStart": page}}
+
+
+def question(text, answer="A"):
+    return {"question": text, "options": ["A", "B", "C", "D"], "correctAnswer": answer, "explanation": "Because."}
+
+
+def completion(questions):
+    content = json.dumps({"questions": questions})
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+def test_chunks_are_grouped_by_topic_and_questions_spread_over_shards():
+    chunks = [chunk("b.pdf", "Osmosis", 4, "b2"), chunk("a.pdf", "Cells", 1, "a1"),
+              chunk("b.pdf", "Osmosis", 3, "b1"), chunk("a.pdf", "Cells", 2, "a2")]
+    shards = quiz_shards.split_into_shards(chunks, 2)
+    assert [[c["text"] for c in shard] for shard in shards] == [["a1", "a2"], ["b1", "b2"]]
+    assert quiz_shards.questions_per_shard(10, 4) == [3, 3, 2, 2]
+
+
+def test_invalid_questions_are_rejected():
+    assert quiz_shards.validate_question(question(" What is osmosis? ")) == question("What is osmosis?")
+    assert quiz_shards.validate_question(question("What is osmosis?", answer="E")) is None
+    assert quiz_shards.validate_question({**question("Q?"), "options": ["A", "A", "B", "C"]}) is None
+    assert quiz_shards.validate_question({"question": "Q?"}) is None
+
+
+def test_failed_and_duplicate_shards_are_regenerated(monkeypatch):
+    monkeypatch.setenv("QUIZ_SHARDS", "2")
+    calls = []
+
+    async def fake_completion(messages, **kwargs):
+        prompt = messages[0]["content"]
+        count = int(re.search(r"quiz with (\d+) questions", prompt).group(1))
+        shard = "a" if "text about a" in prompt else "b"
+        calls.append((shard, count))
+        if shard == "a" and len([c for c in calls if c[0] == "a"]) == 1:
+            raise RuntimeError("500 Internal Server Error")
+        if shard == "b" and len([c for c in calls if c[0] == "b"]) == 1:
+            # One good question, one invalid, one near-duplicate of the first
+            return completion([question("What does the membrane do?"), question("Broken", answer="Z"),
+                               question("What does the membrane do ?")])
+        return completion([question(f"Question {shard} {len(calls)} {i}") for i in range(count)])
+
+    monkeypatch.setattr(quiz_shards, "chat_completion_async", fake_completion)
+    chunks = [chunk("a.pdf", "A", 1, "text about a"), chunk("b.pdf", "B", 1, "text about b")]
+    questions = asyncio.run(quiz_shards.generate_questions(chunks, "chat", total=6))
+
+    assert len(questions) == 6
+    assert len({q["question"] for q in questions}) == 6
+    # Shard a failed and was asked again for all 3, shard b only for the 2 it was missing
+    assert sorted(calls[2:]) == [("a", 3), ("b", 2)]
@@ -0,0 +1,69 @@
+import asyncio
+from types import SimpleNamespace
+
+from shared import rag
+
+
+def hit(source, index, score):
+    return {"text": f"{source} {index}", "chunk_index": index, "metadata": {"source": source}, "score": score}
+
+
+def test_merge_interleaves_queries_and_drops_duplicate_chunks():
+    first = [hit("a.pdf", 1, 0.9), hit("a.pdf", 2, 0.8), hit("a.pdf", 3, 0.7)]
+    second = [hit("b.pdf", 7, 0.95), hit("a.pdf", 1, 0.99)]
+    merged = rag.merge_results([first, second])
+    assert [(d["metadata"]["source"], d["chunk_index"]) for d in merged] == \
+        [("a.pdf", 1), ("b.pdf", 7), ("a.pdf", 2), ("a.pdf", 3)]
+    assert merged[0]["score"] == 0.99
+    assert len(rag.merge_results([first, second], limit=2)) == 2
+
+
+def test_query_list_is_embedded_in_one_call_and_searched_concurrently(monkeypatch):
+    embedding_calls = []
+
+    async def create_embeddings_async(input, model, lane):
+        embedding_calls.append(input)
+        return SimpleNamespace(data=[SimpleNamespace(index=i, embedding=[float(i)]) for i in range(len(input))])
+
+    async def vector_search_async(project_id, query_vector, limit=5):
+        await asyncio.sleep(0.05)
+        return [hit("a.pdf", int(query_vector[0]), 0.5), hit("a.pdf", 10, 0.4)]
+
+    monkeypatch.setenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT", "embeddings")
+    monkeypatch.setattr(rag, "create_embeddings_async", create_embeddings_async)
+    monkeypatch.setattr(rag, "vector_search_async", vector_search_async)
+
+    async def search():
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        results = await rag.perform_vector_search_async("p1", ["osmosis", "enzymes", "membranes"])
+        return results, loop.time() - start
+
+    results, elapsed = asyncio.run(search())
+    assert embedding_calls == [["osmosis", "enzymes", "membranes"]]
+    assert [d["chunk_index"] for d in results] == [0, 1, 2, 10]
+    assert elapsed < 0.12
+
+
+def test_empty_query_list_searches_nothing(monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("nothing to embed")
+
+    monkeypatch.setattr(rag, "get_mongo_db", lambda: None)
+    monkeypatch.setattr(rag, "create_embeddings", fail)
+    monkeypatch.setattr(rag, "create_embeddings_async", fail)
+    assert rag.perform_vector_search("p1", []) == []
+    assert asyncio.run(rag.perform_vector_search_async("p1", iter([]))) == []
+
+
+def test_query_list_results_are_capped_at_total(monkeypatch):
+    class Vectors:
+        def aggregate(self, pipeline):
+            index = int(pipeline[0]["$vectorSearch"]["queryVector"][0])
+            return [hit("a.pdf", index * 10 + rank, 0.5) for rank in range(pipeline[0]["$vectorSearch"]["limit"])]
+
+    monkeypatch.setattr(rag, "get_mongo_db", lambda: {rag.VECTOR_COLLECTION: Vectors()})
+    monkeypatch.setattr(rag, "generate_embeddings", lambda texts: [[float(i)] for i in range(len(texts))])
+    results = rag.perform_vector_search("p1", ["osmosis", "enzymes", "membranes"], limit=4, total=5)
+    assert [d["chunk_index"] for d in results] == [0, 10, 20, 1, 11]
+    assert len(rag.perform_vector_search("p1", ["osmosis", "enzymes"], limit=4)) == 8
@@ -0,0 +1,98 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import mongomock
+import pytest
+
+from shared import llm, rate_governor
+from shared.rate_governor import RateGovernor, MongoSharedState, INTERACTIVE, BACKGROUND
+
+
+@pytest.fixture(autouse=True)
+def limits(monkeypatch):
+    monkeypatch.setenv("OPENAI_RATE_LIMITS", '{"chat": {"rpm": 60, "tpm": 60000}}')
+    monkeypatch.setenv("RATE_GOVERNOR_INTERACTIVE_RESERVE", "0.5")
+
+
+def test_background_keeps_a_reserve_for_interactive_calls():
+    governor = RateGovernor()
+    limiter = governor._limiter("chat")
+    # 60 rpm holds 10 requests; background stops at the 50% reserve, interactive can use it
+    admitted = 0
+    while limiter.try_acquire(10, BACKGROUND, time.monotonic()) == 0:
+        admitted += 1
+    assert admitted == 5
+    assert all(limiter.try_acquire(10, INTERACTIVE, time.monotonic()) == 0 for _ in range(5))
+
+    # While an interactive call is waiting, background calls don't jump in
+    limiter.interactive_waiting = 1
+    limiter.requests.level = limiter.requests.capacity
+    assert limiter.try_acquire(10, BACKGROUND, time.monotonic()) > 0
+
+
+def test_rate_limit_blocks_and_lowers_rate_then_recovers():
+    governor = RateGovernor()
+    governor.record_rate_limited("chat", retry_after=2)
+    limiter = governor._limiter("chat")
+    assert limiter.factor == pytest.approx(0.7)
+    assert limiter.requests.rate == pytest.approx(0.7)
+    assert 1.5 < limiter.try_acquire(1, INTERACTIVE, time.monotonic()) <= 2
+
+    # A burst of 429s from the same window only counts once
+    governor.record_rate_limited("chat", retry_after=2)
+    assert limiter.factor == pytest.approx(0.7)
+
+    for _ in range(10):
+        governor.record_success("chat", 100, 100)
+    assert limiter.factor == pytest.approx(0.8)
+
+
+def test_llm_call_retries_429_after_retry_after(monkeypatch):
+    governor = RateGovernor()
+    monkeypatch.setattr(llm, "get_rate_governor", lambda: governor)
+
+    class RateLimitError(Exception):
+        status_code = 429
+        response = SimpleNamespace(headers={"retry-after-ms": "50"})
+
+    attempts = []
+
+    async def create():
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            raise RateLimitError()
+        return SimpleNamespace(usage=SimpleNamespace(total_tokens=20), choices=[])
+
+    asyncio.run(llm._call_async(create, "chat", 20, INTERACTIVE))
+    assert len(attempts) == 2
+    assert attempts[1] - attempts[0] >= 0.05
+
+
+def test_instances_split_quota_and_share_back_off(monkeypatch):
+    db = mongomock.MongoClient().db
+    first, second = RateGovernor(), RateGovernor()
+    first._limiter("chat")
+    second._limiter("chat")
+
+    monkeypatch.setattr(rate_governor, "INSTANCE_ID", "instance-1")
+    MongoSharedState(lambda: db).refresh(first)
+    monkeypatch.setattr(rate_governor, "INSTANCE_ID", "instance-2")
+    state = MongoSharedState(lambda: db)
+    state.refresh(second)
+    assert second._limiter("chat").share == 0.5
+
+    # Leases of instances that scaled in don't pile up
+    db.rate_leases.insert_one({"_id": "chat:gone", "deployment": "chat", "instance": "gone",
+                               "expiresAt": datetime.utcnow() - timedelta(minutes=5)})
+    state.refresh(second)
+    assert db.rate_leases.count_documents({}) == 2
+
+    # A 429 seen by one instance is picked up by the other on its next refresh
+    monkeypatch.setattr(state, "_in_background", lambda work: work())
+    second.shared_state = state
+    second.record_rate_limited("chat", retry_after=5)
+    MongoSharedState(lambda: db).refresh(first)
+    assert first._limiter("chat").try_acquire(1, INTERACTIVE, time.monotonic()) > 4
+    assert first._limiter("chat").factor == pytest.approx(0.7)
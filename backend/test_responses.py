@@ -0,0 +1,59 @@
+import gzip
+import json
+import asyncio
+import datetime
+import mongomock
+import azure.functions as func
+from bson import ObjectId
+
+from benchmarks.standins import AsyncDatabaseShim
+from shared import responses
+
+
+def test_documents_are_encoded_with_object_ids_and_datetimes():
+    oid = ObjectId()
+    created = datetime.datetime(2024, 5, 1, 12, 30, 15, 250000)
+    body = responses.dumps({"_id": oid, "createdAt": created, "tags": ["a"]})
+    assert json.loads(body) == {"_id": str(oid), "createdAt": created.isoformat(), "tags": ["a"]}
+
+    response = responses.json_response({"ok": True}, status_code=201)
+    assert response.status_code == 201 and response.mimetype == "application/json"
+
+
+def test_cursors_are_encoded_as_arrays():
+    db = mongomock.MongoClient().db
+    ids = db.songs.insert_many([{"title": f"Song {i}", "lyrics": "la " * 100} for i in range(3)]).inserted_ids
+
+    response = responses.cursor_response(db.songs.find({}, {"title": 1}))
+    assert json.loads(response.get_body()) == [{"_id": str(i), "title": f"Song {n}"} for n, i in enumerate(ids)]
+    assert responses.cursor_response(db.songs.find({"title": "none"})).get_body() == b"[]"
+
+    async_response = asyncio.run(responses.cursor_response_async(AsyncDatabaseShim(db).songs.find({}, {"title": 1})))
+    assert async_response.get_body() == response.get_body()
+
+
+def request(**headers):
+    return func.HttpRequest("GET", "http://localhost/api/documents", headers=headers, body=b"")
+
+
+def test_conditional_get_and_compression(monkeypatch):
+    monkeypatch.setenv("RESPONSE_GZIP_MIN_BYTES", "100")
+    summaries = [{"summary": "<p>" + "osmosis " * 50 + "</p>"}]
+    etag = responses.etag_for("documents", "p1", 7)
+    assert etag == responses.etag_for("documents", "p1", 7) != responses.etag_for("documents", "p1", 8)
+
+    first = responses.json_response(summaries, req=request(**{"Accept-Encoding": "gzip, br"}), etag=etag)
+    assert first.headers["ETag"] == etag and first.headers["Content-Encoding"] == "gzip"
+    assert json.loads(gzip.decompress(first.get_body())) == summaries
+
+    assert responses.not_modified(request(**{"If-None-Match": etag}), etag).status_code == 304
+    assert responses.not_modified(request(**{"If-None-Match": etag.lstrip("W/")}), etag).status_code == 304
+    assert responses.not_modified(request(**{"If-None-Match": responses.etag_for("x")}), etag) is None
+    assert responses.not_modified(request(), etag) is None
+
+    # Without a version the ETag comes from the body; small or unaccepted bodies stay uncompressed
+    small = responses.json_response({"ok": True}, req=request(**{"Accept-Encoding": "gzip"}))
+    assert "Content-Encoding" not in small.headers
+    assert responses.json_response({"ok": True}, req=request(**{"If-None-Match": small.headers["ETag"]})).status_code == 304
+    plain = responses.json_response(summaries, req=request(**{"Accept-Encoding": "gzip;q=0, identity"}))
+    assert "Content-Encoding" not in plain.headers
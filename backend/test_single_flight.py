@@ -0,0 +1,69 @@
+import asyncio
+
+import azure.functions as func
+import mongomock
+
+from benchmarks.standins import AsyncDatabaseShim
+from shared import single_flight
+from shared.single_flight import flight_key
+
+
+def counting(calls, status=200, delay=0.2):
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(delay)
+        return func.HttpResponse(f'{{"run": {len(calls)}}}', status_code=status, mimetype="application/json")
+    return compute
+
+
+def test_key_ignores_case_and_whitespace_but_not_inputs():
+    assert flight_key("lyrics", "p1", "u1", prompt="Cell  division ", genre="Pop") == \
+        flight_key("lyrics", "p1", "u1", prompt="cell division", genre="pop")
+    assert flight_key("lyrics", "p1", "u1", prompt="cell division") != flight_key("lyrics", "p1", "u2", prompt="cell division")
+
+
+def test_concurrent_duplicates_share_one_run():
+    calls = []
+
+    async def main():
+        key = flight_key("quiz/generate", "p1", "u1", topic="osmosis")
+        return await asyncio.gather(*(single_flight.single_flight(key, counting(calls)) for _ in range(3)))
+
+    responses = asyncio.run(main())
+    assert len(calls) == 1
+    assert {r.get_body() for r in responses} == {b'{"run": 1}'}
+
+
+def test_instances_share_through_mongo_and_failures_are_not_shared():
+    mongo = mongomock.MongoClient().db
+    db = AsyncDatabaseShim(mongo)
+    key = flight_key("quiz/generate", "p1", "u1", topic="osmosis")
+
+    async def two_instances(compute):
+        # _run_shared directly: the in-process map would already coalesce these
+        return await asyncio.gather(single_flight._run_shared(key, compute, db),
+                                    single_flight._run_shared(key, compute, db))
+
+    calls = []
+    responses = asyncio.run(two_instances(counting(calls)))
+    assert len(calls) == 1
+    assert responses[1].get_body() == b'{"run": 1}'
+
+    # A failed run isn't published: the waiting instance runs it itself
+    mongo.single_flight.delete_one({"_id": key})
+    failed = []
+    responses = asyncio.run(two_instances(counting(failed, status=500)))
+    assert len(failed) == 2
+
+
+def test_shared_response_keeps_headers_and_compressed_body():
+    import gzip
+    body = gzip.compress(b'{"lyrics": "la la"}')
+    response = func.HttpResponse(body, status_code=200, mimetype="application/json",
+                                 headers={"ETag": 'W/"abc"', "Content-Encoding": "gzip"})
+    mongo = mongomock.MongoClient().db
+    mongo.single_flight.insert_one({"_id": "k", "response": single_flight._serialize(response)})
+
+    replayed = single_flight._deserialize(mongo.single_flight.find_one({"_id": "k"})["response"])
+    assert gzip.decompress(replayed.get_body()) == b'{"lyrics": "la la"}'
+    assert replayed.headers["Content-Encoding"] == "gzip" and replayed.headers["ETag"] == 'W/"abc"'
@@ -0,0 +1,50 @@
+import asyncio
+import mongomock
+from types import SimpleNamespace
+
+from benchmarks.standins import AsyncDatabaseShim
+from shared import song_cache
+
+
+def test_keys_follow_content_version_and_normalized_inputs():
+    key = song_cache.lyrics_key("p1", 4, "The  Krebs cycle ", "Pop")
+    assert key == song_cache.lyrics_key("p1", 4, "the krebs cycle", "pop")
+    # New or changed documents move the content version
+    assert key != song_cache.lyrics_key("p1", 5, "the krebs cycle", "pop")
+    assert song_cache.audio_key("La la\n", "Pop", 30000) == song_cache.audio_key("La la", "pop", 30000.0)
+    assert song_cache.audio_key("La la", "Pop", 30000) != song_cache.audio_key("La la", "Pop", 60000)
+
+
+def test_cached_audio_is_copied_and_dropped_when_the_copy_fails(monkeypatch):
+    raw = mongomock.MongoClient().db
+    db = AsyncDatabaseShim(raw)
+    copies = []
+
+    async def signed_url_async(blob_name):
+        return f"https://acct/songs/{blob_name}?sig"
+
+    class Target:
+        def __init__(self, blob):
+            self.blob = blob
+
+        async def start_copy_from_url(self, url):
+            if "gone" in url:
+                raise RuntimeError("404 BlobNotFound")
+            copies.append((url, self.blob))
+            return {"copy_status": "success", "copy_id": "c1"}
+
+    client = SimpleNamespace(get_blob_client=lambda container, blob: Target(blob))
+    monkeypatch.setattr(song_cache, "signed_url_async", signed_url_async)
+
+    async def scenario():
+        key = song_cache.audio_key("La la", "Pop", 30000)
+        await song_cache.put_audio(db, key, "p1/first.mp3")
+        source = await song_cache.get_audio(db, key)
+        assert await song_cache.copy_audio(db, key, client, source, "p1/second.mp3")
+
+        await song_cache.put_audio(db, key, "p1/gone.mp3")
+        assert not await song_cache.copy_audio(db, key, client, "p1/gone.mp3", "p1/third.mp3")
+        return await song_cache.get_audio(db, key)
+
+    assert asyncio.run(scenario()) is None
+    assert copies == [("https://acct/songs/p1/first.mp3?sig", "p1/second.mp3")]
@@ -0,0 +1,27 @@
+import asyncio
+import threading
+import mongomock
+from bson import ObjectId
+
+from benchmarks.standins import AsyncDatabaseShim
+from shared import status_feed
+
+
+PROJECT_ID = "65f000000000000000000002"
+
+
+def test_wait_returns_when_version_moves_and_times_out_otherwise(monkeypatch):
+    monkeypatch.setenv("STATUS_FEED_CHANGE_STREAMS", "false")
+    monkeypatch.setenv("STATUS_FEED_POLL_MS", "20")
+    raw = mongomock.MongoClient().db
+    raw.projects.insert_one({"_id": ObjectId(PROJECT_ID), "statusVersion": 3})
+    db = AsyncDatabaseShim(raw)
+
+    assert asyncio.run(status_feed.wait_for_change(db, PROJECT_ID, 3, timeout=0.1)) is False
+    # An earlier version is already stale
+    assert asyncio.run(status_feed.wait_for_change(db, PROJECT_ID, 2, timeout=0.1)) is True
+
+    timer = threading.Timer(0.1, raw.projects.update_one, ({"_id": ObjectId(PROJECT_ID)}, {"$inc": {"statusVersion": 1}}))
+    timer.start()
+    assert asyncio.run(status_feed.wait_for_change(db, PROJECT_ID, 3, timeout=5)) is True
+    timer.join()
@@ -0,0 +1,82 @@
+import mongomock
+from types import SimpleNamespace
+from shared import storage_usage
+
+PROJECT = "65f1a2b3c4d5e6f7a8b9c0d1"
+
+
+class FakePages:
+    def __init__(self, pages, token):
+        self.pages = pages
+        self.index = int(token or 0)
+        self.continuation_token = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.index >= len(self.pages):
+            raise StopIteration
+        page = self.pages[self.index]
+        self.index += 1
+        self.continuation_token = str(self.index) if self.index < len(self.pages) else None
+        return iter(page)
+
+
+class FakeContainer:
+    def __init__(self, sizes):
+        self.blobs = [SimpleNamespace(name=name, size=size, last_modified=None, content_settings=None)
+                      for name, size in sizes.items()]
+        self.listed = []
+
+    def list_blobs(self, name_starts_with=None, results_per_page=None):
+        self.listed.append(results_per_page)
+        blobs = [b for b in self.blobs if b.name.startswith(name_starts_with or "")]
+        pages = [blobs[i:i + results_per_page] for i in range(0, len(blobs), results_per_page)]
+        return SimpleNamespace(by_page=lambda continuation_token=None: FakePages(pages, continuation_token))
+
+
+def test_rollup_follows_uploads_overwrites_and_deletes():
+    db = mongomock.MongoClient().db
+    storage_usage.record_upload(db, "docs", f"{PROJECT}/a.pdf", 100)
+    storage_usage.record_upload(db, "docs", f"{PROJECT}/b.pdf", 50)
+    # Same file uploaded again: bigger, but still one blob
+    storage_usage.record_upload(db, "docs", f"{PROJECT}/a.pdf", 120, previous_size=100)
+    storage_usage.record_delete(db, "docs", f"{PROJECT}/b.pdf", 50)
+    storage_usage.record_upload(db, "docs", "loose.pdf", 7)
+
+    usage = storage_usage.usage(db, PROJECT)
+    assert (usage["bytes"], usage["blobs"]) == (120, 1)
+    assert usage["containers"]["docs"] == {"bytes": 120, "blobs": 1}
+    assert storage_usage.usage(db, storage_usage.UNASSIGNED)["bytes"] == 7
+
+
+def test_listing_pages_with_continuation_and_rebuild_recounts():
+    docs = FakeContainer({f"{PROJECT}/{i}.pdf": 10 for i in range(5)})
+    songs = FakeContainer({f"{PROJECT}/s.mp3": 300, "other/s.mp3": 1})
+
+    blobs, token = storage_usage.list_page(docs, f"{PROJECT}/", limit=2)
+    assert [b["name"] for b in blobs] == [f"{PROJECT}/0.pdf", f"{PROJECT}/1.pdf"] and token == "1"
+    blobs, token = storage_usage.list_page(docs, f"{PROJECT}/", limit=2, continuation="2")
+    assert [b["name"] for b in blobs] == [f"{PROJECT}/4.pdf"] and token is None
+
+    db = mongomock.MongoClient().db
+    storage_usage.record(db, PROJECT, "docs", 999, 9)  # drifted
+    client = SimpleNamespace(get_container_client=lambda name: {"docs": docs, "songs": songs}[name])
+    storage_usage.rebuild(db, client, PROJECT)
+
+    usage = storage_usage.usage(db, PROJECT)
+    assert (usage["bytes"], usage["blobs"]) == (350, 6)
+    assert usage["containers"] == {"docs": {"bytes": 50, "blobs": 5}, "songs": {"bytes": 300, "blobs": 1}}
+
+
+def test_failed_size_probe_leaves_the_rollup_alone():
+    def properties():
+        raise ConnectionError("storage throttled")
+    blob = SimpleNamespace(blob_name=f"{PROJECT}/a.pdf", get_blob_properties=properties)
+    assert storage_usage.blob_size(blob) == storage_usage.UNKNOWN_SIZE
+
+    db = mongomock.MongoClient().db
+    storage_usage.record_upload(db, "docs", f"{PROJECT}/a.pdf", 100, previous_size=storage_usage.UNKNOWN_SIZE)
+    storage_usage.record_delete(db, "docs", f"{PROJECT}/a.pdf", storage_usage.UNKNOWN_SIZE)
+    assert storage_usage.usage(db, PROJECT)["blobs"] == 0
@@ -0,0 +1,55 @@
+import json
+import threading
+from types import SimpleNamespace
+
+from shared import telemetry, warmup
+
+
+def test_spans_and_usage_are_recorded(tmp_path, monkeypatch):
+    export_path = tmp_path / "telemetry.jsonl"
+    monkeypatch.setenv("TELEMETRY_EXPORT_PATH", str(export_path))
+    monkeypatch.setenv("WARMUP_ON_FIRST_INVOCATION", "false")
+
+    @telemetry.timed("stage.embed")
+    def embed():
+        return "ok"
+
+    @telemetry.instrument("api_test")
+    def main():
+        with telemetry.span("stage.auth"):
+            pass
+        embed()
+        usage = SimpleNamespace(prompt_tokens=10, completion_tokens=5, total_tokens=15)
+        telemetry.record_usage(SimpleNamespace(usage=usage), "gpt-4o-mini")
+        return SimpleNamespace(status_code=200)
+
+    main()
+
+    record = json.loads(export_path.read_text().strip())
+    assert record["function"] == "api_test"
+    assert [s["name"] for s in record["spans"]] == ["stage.auth", "stage.embed"]
+    assert record["attributes"]["status"] == 200
+    assert record["usage"]["gpt-4o-mini"]["total_tokens"] == 15
+
+
+def test_spans_outside_a_request_are_noops():
+    with telemetry.span("orphan"):
+        pass
+    assert telemetry.current_record() is None
+
+
+
+def test_first_invocation_warms_the_instance_once(monkeypatch):
+    warmed = threading.Event()
+    calls = []
+    monkeypatch.setattr(telemetry, "_first_invocation", True)
+    monkeypatch.setattr(warmup, "_claimed", False)
+    monkeypatch.setattr(warmup, "warm_up_sync", lambda: calls.append(1) or warmed.set())
+
+    @telemetry.instrument("api_test")
+    def main():
+        return SimpleNamespace(status_code=200)
+
+    main()
+    main()
+    assert warmed.wait(1) and calls == [1]
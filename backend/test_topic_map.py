@@ -0,0 +1,91 @@
+import asyncio
+import random
+
+import mongomock
+import numpy as np
+
+from benchmarks.standins import AsyncDatabaseShim
+from shared import topic_map, chunk_store
+from shared.topic_map import TopicMapUpdate, kmeans
+
+PROJECT_ID = "65f000000000000000000003"
+DIMS = 16
+
+
+def blob_vectors(center, count, rng):
+    return [list(np.eye(DIMS)[center] + rng.normal(0, 0.05, DIMS)) for _ in range(count)]
+
+
+def store(db, source, center, count, rng, heading):
+    ids, vectors = [], []
+    for i, vector in enumerate(blob_vectors(center, count, rng)):
+        chunk_id = f"{PROJECT_ID}/{source}#{i}"
+        chunk_store.insert_chunks(db, [{"_id": chunk_id, "text": f"{heading} text {i}", "vector": vector,
+                                        "metadata": {"projectId": PROJECT_ID, "source": source, "headings": [heading]}}])
+        ids.append(chunk_id)
+        vectors.append(vector)
+    return ids, vectors
+
+
+def test_kmeans_finds_separated_topics():
+    rng = np.random.default_rng(1)
+    vectors = blob_vectors(0, 30, rng) + blob_vectors(5, 30, rng) + blob_vectors(9, 30, rng)
+    _, labels = kmeans(vectors, 3)
+    assert sorted(len(set(labels[i:i + 30])) for i in (0, 30, 60)) == [1, 1, 1]
+    assert len(set(labels)) == 3
+
+
+def test_map_is_built_then_updated_incrementally_and_on_removal():
+    db = mongomock.MongoClient().db
+    rng = np.random.default_rng(2)
+
+    # First documents: no map yet, so it is built
+    update = TopicMapUpdate(PROJECT_ID, db)
+    for center, heading in ((0, "Osmosis"), (5, "Enzymes"), (9, "Membranes")):
+        ids, vectors = store(db, f"{heading}.pdf", center, 40, rng, heading)
+        update.add(ids, vectors, [heading] * len(ids))
+    update.commit()
+    # Ingestion only flags the map, the rebuild timer builds it
+    assert "clusters" not in db.topic_maps.find_one({"_id": PROJECT_ID})
+    assert topic_map.rebuild_due_topic_maps(db) == 1
+    built = db.topic_maps.find_one({"_id": PROJECT_ID})
+    assert built["chunkCount"] == 120 and not built.get("rebuildDue")
+    assert {c["label"] for c in built["clusters"]} >= {"Osmosis", "Enzymes", "Membranes"}
+
+    # A small document joins the nearest topic without a rebuild
+    update = TopicMapUpdate(PROJECT_ID, db)
+    ids, vectors = store(db, "more-osmosis.pdf", 0, 10, rng, "Osmosis")
+    update.add(ids, vectors, ["Osmosis"] * len(ids))
+    update.commit()
+    updated = db.topic_maps.find_one({"_id": PROJECT_ID})
+    assert updated["version"] == built["version"] + 1
+    assert updated["chunkCount"] == 130 and updated["changes"] == 10 and not updated.get("rebuildDue")
+    assert sum(c["size"] for c in updated["clusters"]) == 130
+
+    # Removing it takes it back out
+    update = TopicMapUpdate(PROJECT_ID, db)
+    update.remove_matching({"metadata.source": "more-osmosis.pdf"})
+    chunk_store.delete_chunks(db, {"metadata.source": "more-osmosis.pdf"})
+    update.commit()
+    removed = db.topic_maps.find_one({"_id": PROJECT_ID})
+    assert removed["chunkCount"] == 120
+    assert sum(c["size"] for c in removed["clusters"]) == 120
+    representatives = {r["id"] for c in removed["clusters"] for r in c["representatives"]}
+    assert not any("more-osmosis" in chunk_id for chunk_id in representatives)
+
+
+def test_surprise_context_is_sampled_from_several_topics(monkeypatch):
+    # One cluster per topic, so the clusters drawn are always different topics
+    monkeypatch.setenv("TOPIC_MAP_MAX_CLUSTERS", "4")
+    db = mongomock.MongoClient().db
+    rng = np.random.default_rng(3)
+    for center, heading in ((0, "Osmosis"), (5, "Enzymes"), (9, "Membranes"), (12, "Cells")):
+        store(db, f"{heading}.pdf", center, 40, rng, heading)
+    topic_map.build_topic_map(PROJECT_ID, db)
+
+    ids = topic_map.pick_representatives(db.topic_maps.find_one({"_id": PROJECT_ID})["clusters"], 12, random.Random(0))
+    assert len(ids) == len(set(ids)) == 12
+
+    chunks = asyncio.run(topic_map.sample_topic_chunks(AsyncDatabaseShim(db), PROJECT_ID, 12))
+    assert len({c["metadata"]["headings"][0] for c in chunks}) >= 3
+    assert all("vector" not in c for c in chunks)
@@ -0,0 +1,84 @@
+import asyncio
+import mongomock
+
+from benchmarks.standins import AsyncDatabaseShim
+from shared import write_behind
+
+
+def test_writes_are_batched_and_follow_ups_run_after_them(monkeypatch):
+    monkeypatch.setenv("WRITE_BEHIND", "true")
+    monkeypatch.setenv("WRITE_BEHIND_FLUSH_MS", "50")
+    raw = mongomock.MongoClient().db
+    raw.projects.insert_one({"_id": "p1", "chatVersion": 0})
+    db = AsyncDatabaseShim(raw)
+    calls = []
+    insert_many = raw.chat_history.insert_many
+    monkeypatch.setattr(raw.chat_history, "insert_many", lambda docs, **kw: calls.append(len(docs)) or insert_many(docs, **kw))
+
+    async def scenario():
+        ids = [await write_behind.insert(db, "chat_history", {"message": f"m{i}"},
+                                         follow_up=("projects", {"_id": "p1"}, {"$inc": {"chatVersion": 1}}))
+               for i in range(3)]
+        # Queued, not written yet, but visible to this instance
+        assert raw.chat_history.count_documents({}) == 0
+        assert write_behind.find_pending("chat_history", ids[1])["message"] == "m1"
+        await asyncio.sleep(0.2)
+        return ids
+
+    ids = asyncio.run(scenario())
+    assert calls == [3]
+    assert [d["_id"] for d in raw.chat_history.find()] == ids
+    assert raw.projects.find_one({"_id": "p1"})["chatVersion"] == 3
+
+
+def test_failed_flush_is_retried_and_duplicates_count_as_delivered(monkeypatch):
+    monkeypatch.setenv("WRITE_BEHIND", "true")
+    monkeypatch.setenv("WRITE_BEHIND_FLUSH_MS", "20")
+    raw = mongomock.MongoClient().db
+    failures = []
+    insert_many = raw.quiz_results.insert_many
+
+    def flaky_insert_many(docs, **kwargs):
+        if not failures:
+            # The first attempt stores one document, then the connection drops
+            insert_many(docs[:1])
+            failures.append(True)
+            raise ConnectionError("connection reset")
+        return insert_many(docs, **kwargs)
+
+    monkeypatch.setattr(raw.quiz_results, "insert_many", flaky_insert_many)
+
+    async def scenario():
+        buffer = write_behind.WriteBehindBuffer(AsyncDatabaseShim(raw))
+        for i in range(3):
+            buffer.add("quiz_results", {"_id": i, "score": i})
+        await asyncio.sleep(0.3)
+        return buffer
+
+    buffer = asyncio.run(scenario())
+    assert not buffer.pending and buffer.failures == 0
+    assert sorted(d["_id"] for d in raw.quiz_results.find()) == [0, 1, 2]
+
+
+def test_queued_writes_are_spilled_and_reloaded(monkeypatch, tmp_path):
+    monkeypatch.setenv("WRITE_BEHIND_SPILL_DIR", str(tmp_path))
+    raw = mongomock.MongoClient().db
+
+    async def queue():
+        buffer = write_behind.WriteBehindBuffer(AsyncDatabaseShim(raw))
+        buffer.add("quizzes", {"questions": ["q"], "_id": write_behind.ObjectId()},
+                   follow_up=("projects", {"_id": "p1"}, {"$inc": {"quizVersion": 1}}))
+        # The process exits before the flush
+        buffer.spill()
+
+    async def restart():
+        buffer = write_behind.WriteBehindBuffer(AsyncDatabaseShim(raw))
+        buffer.load_spills()
+        assert len(buffer.pending) == 1
+        await buffer.flush()
+
+    asyncio.run(queue())
+    assert len(list(tmp_path.iterdir())) == 1
+    asyncio.run(restart())
+    assert raw.quizzes.find_one()["questions"] == ["q"]
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,14 @@
+import os
+import logging
+import azure.functions as func
+from shared.telemetry import instrument
+from shared.topic_map import rebuild_due_topic_maps
+
+@instrument("topic_map_rebuild")
+def main(timer: func.TimerRequest) -> None:
+    # Rebuilds the topic maps ingestion flagged as due (see shared/topic_map.py), off the ingestion path.
+    # Timer functions run as a singleton, so a map is never rebuilt twice at once.
+    budget = int(os.getenv("TOPIC_MAP_REBUILD_BUDGET_SECONDS", 240))
+    rebuilt = rebuild_due_topic_maps(time_budget_seconds=budget)
+    if rebuilt:
+        logging.info(f"Rebuilt {rebuilt} topic maps")
@@ -1,8 +1,11 @@
 import logging
 import azure.functions as func
 import os
-from azure.storage.blob import BlobServiceClient
+from shared.clients import get_blob_service_client, get_mongo_db
+from shared import storage_usage
+from shared.telemetry import instrument
 
+@instrument("upload_file")
 def main(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Python HTTP trigger function processed a request.....')
 
@@ -58,8 +61,7 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
                         continue
 
                     # Connect to Blob Storage
-                    connect_str = os.getenv('BLOB_STORAGE_CONNECTION_STRING')
-                    blob_service_client = BlobServiceClient.from_connection_string(connect_str)
+                    blob_service_client = get_blob_service_client()
                     container_name = "docs"
                     
                     # Create container if it doesn't exist
@@ -69,7 +71,9 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
 
                     # Upload file
                     blob_client = container_client.get_blob_client(filename)
+                    previous_size = storage_usage.blob_size(blob_client)
                     blob_client.upload_blob(bytes(file_content), overwrite=True)
+                    storage_usage.record_upload(get_mongo_db(), container_name, filename, len(file_content), previous_size)
                     uploaded_files.append(filename)
 
                 except Exception as e:
@@ -0,0 +1,11 @@
+import logging
+import azure.functions as func
+from shared.telemetry import instrument
+from shared.warmup import warm_up
+
+@instrument("warmup")
+async def main(warmupContext: func.Context) -> None:
+    # Runs once when the platform adds an instance, before it gets traffic. Runs on the same
+    # event loop as the async handlers, so their async clients are built too.
+    results = await warm_up()
+    logging.info(f"Warm-up complete: {results}")
@@ -109,7 +109,7 @@ export const CreateProjectModal: React.FC<CreateProjectModalProps> = ({ isOpen,
                                 type="file"
                                 onChange={(e) => setFiles(e.target.files)}
                                 className="absolute inset-0 w-full h-full opacity-0 cursor-pointer"
-                                accept=".pdf,.txt"
+                                accept=".pdf,.txt,.docx,.pptx,.md,.html"
                                 multiple
                                 required
                             />
@@ -24,14 +24,39 @@ interface ChatMessage {
     timestamp: string;
 }
 
+// A stored exchange (question and answer) becomes two chat bubbles
+const toChatMessages = (history: any[]): ChatMessage[] => history.map((h: any) => ([
+    { role: 'user' as const, content: h.message, timestamp: h.timestamp },
+    { role: 'assistant' as const, content: h.answer, timestamp: h.timestamp }
+])).flat();
+
+type IngestionStatus = 'queued' | 'extracting' | 'embedding' | 'stored' | 'failed';
+
 interface Document {
     _id?: string; // Add optional ID if available from backend, though we mostly use filename
     filename: string;
     summary: string;
     uploadedAt: string;
+    status?: IngestionStatus;
+    error?: string;
     isRegenerating?: boolean;
 }
 
+interface DocumentProgress {
+    filename: string;
+    status?: IngestionStatus;
+    progress?: { chunksTotal?: number; chunksEmbedded?: number };
+    error?: string;
+}
+
+const INGESTION_STATUS_LABELS: Record<IngestionStatus, string> = {
+    queued: 'Queued',
+    extracting: 'Reading document',
+    embedding: 'Indexing',
+    stored: 'Ready',
+    failed: 'Failed'
+};
+
 interface Song {
     _id: string;
     title: string;
@@ -56,6 +81,11 @@ export const ProjectDetails: React.FC = () => {
     const [sending, setSending] = useState(false);
     const [expandedDocs, setExpandedDocs] = useState<Record<number, boolean>>({});
     const chatEndRef = useRef<HTMLDivElement>(null);
+    // Older history is paged in with /chat?before=<oldest exchange id>
+    const [oldestChatId, setOldestChatId] = useState<string | null>(null);
+    const [hasEarlierChat, setHasEarlierChat] = useState(false);
+    const [loadingEarlierChat, setLoadingEarlierChat] = useState(false);
+    const keepChatScrollRef = useRef(false);
 
     // Quiz State
     const [quizState, setQuizState] = useState<{
@@ -87,6 +117,7 @@ export const ProjectDetails: React.FC = () => {
     const [lyricsPrompt, setLyricsPrompt] = useState('');
     const [generatingLyrics, setGeneratingLyrics] = useState(false);
     const [expandedSongLyrics, setExpandedSongLyrics] = useState<Record<string, boolean>>({});
+    const lastLyricsRequest = useRef<string | null>(null);
 
 
     // Error Handling State
@@ -99,53 +130,55 @@ export const ProjectDetails: React.FC = () => {
     const fileInputRef = useRef<HTMLInputElement>(null);
     const [uploading, setUploading] = useState(false);
     const isUploadingRef = useRef(false);
+    const [ingestionProgress, setIngestionProgress] = useState<DocumentProgress[]>([]);
 
-    // Polling for processing status
+    // Ingestion status feed (per-document progress, no summaries). Each request is held by the
+    // backend until the project's status version moves past the one we send.
     useEffect(() => {
-        let interval: ReturnType<typeof setInterval>;
+        if (project?.status !== 'processing' || !id) return;
+        let cancelled = false;
 
-        if (project?.status === 'processing') {
-            interval = setInterval(async () => {
-                if (!id) return;
+        const follow = async () => {
+            let version: number | undefined;
+            while (!cancelled) {
                 try {
-                    const projects = await apiRequest('/projects');
-                    const found = projects.find((p: Project) => p._id === id);
-                    if (found) {
-                        setProject(found);
-                        // If status changed to ready, refresh documents
-                        if (found.status === 'ready' && project.status === 'processing') {
-                            const docs = await apiRequest(`/documents?projectId=${id}`);
-                            setDocuments(docs);
-                        }
+                    const query = version === undefined ? '' : `?since=${version}`;
+                    const status = await apiRequest(`/projects/${id}/status${query}`);
+                    if (cancelled) return;
+                    version = status.version;
+                    // If status changed to ready, refresh documents (before the status update ends this effect)
+                    if (status.status === 'ready') {
+                        const docs = await apiRequest(`/documents?projectId=${id}`);
+                        if (cancelled) return;
+                        setDocuments(docs);
                     }
+                    setIngestionProgress(status.documents);
+                    setProject(prev => prev ? { ...prev, status: status.status, processingCount: status.processingCount } : null);
+                    if (status.status === 'ready') return;
                 } catch (error) {
-                    console.error('Polling error:', error);
+                    console.error('Status feed error:', error);
+                    // Back off before reconnecting
+                    await new Promise(resolve => setTimeout(resolve, 3000));
                 }
-            }, 3000); // Poll every 3 seconds
-        }
+            }
+        };
 
-        return () => clearInterval(interval);
+        follow();
+        return () => { cancelled = true; };
     }, [project?.status, id]);
 
     useEffect(() => {
         const fetchProjectData = async () => {
             if (!id) return;
             try {
-                const projects = await apiRequest('/projects');
-                const found = projects.find((p: Project) => p._id === id);
-                if (found) {
-                    setProject(found);
-                    const [history, docs] = await Promise.all([
-                        apiRequest(`/chat?projectId=${id}`),
-                        apiRequest(`/documents?projectId=${id}`)
-                    ]);
-
-                    setMessages(history.map((h: any) => ([
-                        { role: 'user', content: h.message, timestamp: h.timestamp },
-                        { role: 'assistant', content: h.answer, timestamp: h.timestamp }
-                    ])).flat());
-                    setDocuments(docs);
-                }
+                // One round trip: project, documents, latest chat page and songs
+                const workspace = await apiRequest(`/projects/${id}`);
+                setProject(workspace.project);
+                setMessages(toChatMessages(workspace.chat.messages));
+                setOldestChatId(workspace.chat.messages[0]?._id ?? null);
+                setHasEarlierChat(workspace.chat.hasMore);
+                setDocuments(workspace.documents);
+                setSongs(workspace.songs);
             } catch (error) {
                 console.error('Failed to fetch project data:', error);
             } finally {
@@ -170,7 +203,12 @@ export const ProjectDetails: React.FC = () => {
     }, [documents, activeTab]);
 
     useEffect(() => {
-        chatEndRef.current?.scrollIntoView({ behavior: 'smooth' });
+        // Prepending earlier messages keeps the reader where they were
+        if (keepChatScrollRef.current) {
+            keepChatScrollRef.current = false;
+        } else {
+            chatEndRef.current?.scrollIntoView({ behavior: 'smooth' });
+        }
         if (activeTab === 'songs' && id) {
             const fetchSongs = async () => {
                 try {
@@ -187,12 +225,16 @@ export const ProjectDetails: React.FC = () => {
     const handleGenerateLyrics = async () => {
         if (!id || !lyricsPrompt.trim()) return;
         setGeneratingLyrics(true);
+        // Asking again for the same prompt and genre means new lyrics, not the cached ones
+        const request = `${lyricsPrompt.trim()}|${songForm.genre}`;
         try {
             const response = await apiRequest('/songs/generate-lyrics', 'POST', {
                 projectId: id,
                 prompt: lyricsPrompt,
-                genre: songForm.genre
+                genre: songForm.genre,
+                regenerate: lastLyricsRequest.current === request
             });
+            lastLyricsRequest.current = request;
             setSongForm(prev => ({ ...prev, lyrics: response.lyrics }));
             setLyricsPanelOpen(false);
         } catch (error) {
@@ -261,6 +303,22 @@ export const ProjectDetails: React.FC = () => {
         }
     };
 
+    const loadEarlierChat = async () => {
+        if (!id || !oldestChatId) return;
+        setLoadingEarlierChat(true);
+        try {
+            const page = await apiRequest(`/chat?projectId=${id}&before=${oldestChatId}`);
+            keepChatScrollRef.current = true;
+            setMessages(prev => [...toChatMessages(page.messages), ...prev]);
+            setOldestChatId(page.messages[0]?._id ?? oldestChatId);
+            setHasEarlierChat(page.hasMore);
+        } catch (error) {
+            console.error('Failed to load earlier messages:', error);
+        } finally {
+            setLoadingEarlierChat(false);
+        }
+    };
+
     const handleClearChat = () => {
         setShowClearChatModal(true);
     };
@@ -271,6 +329,8 @@ export const ProjectDetails: React.FC = () => {
         try {
             await apiRequest(`/chat?projectId=${id}`, 'DELETE');
             setMessages([]);
+            setOldestChatId(null);
+            setHasEarlierChat(false);
             setShowClearChatModal(false);
         } catch (error) {
             console.error('Failed to clear chat:', error);
@@ -480,6 +540,19 @@ export const ProjectDetails: React.FC = () => {
                                         <span>{project.processingCount} document{project.processingCount > 1 ? 's' : ''} remaining</span>
                                     </div>
                                 )}
+                                {ingestionProgress.some(d => d.status && d.status !== 'stored') && (
+                                    <ul className="mt-6 space-y-2 text-left text-sm">
+                                        {ingestionProgress.filter(d => d.status && d.status !== 'stored').map(d => (
+                                            <li key={d.filename} className="flex items-center justify-between gap-4">
+                                                <span className="truncate">{d.filename}</span>
+                                                <span className={d.status === 'failed' ? 'text-red-500' : 'text-gray-500 dark:text-gray-400'}>
+                                                    {INGESTION_STATUS_LABELS[d.status!]}
+                                                    {d.status === 'embedding' && d.progress?.chunksTotal ? ` (${d.progress.chunksEmbedded || 0}/${d.progress.chunksTotal})` : ''}
+                                                </span>
+                                            </li>
+                                        ))}
+                                    </ul>
+                                )}
                             </div>
                         </div>
                     )}
@@ -564,7 +637,7 @@ export const ProjectDetails: React.FC = () => {
                                                         ref={fileInputRef}
                                                         className="hidden"
                                                         onChange={handleFileChange}
-                                                        accept=".pdf,.txt,.docx,.md"
+                                                        accept=".pdf,.txt,.docx,.pptx,.md,.html"
                                                     />
                                                     <Button onClick={handleAddDocumentClick} disabled={uploading}>
                                                         {uploading ? <Loader2 className="w-4 h-4 animate-spin mr-2" /> : <Plus className="w-4 h-4 mr-2" />}
@@ -586,6 +659,12 @@ export const ProjectDetails: React.FC = () => {
                                                                 <BookOpen className="w-5 h-5 text-blue-600 dark:text-blue-300" />
                                                             </div>
                                                             <h3 className="font-bold text-lg">{doc.filename}</h3>
+                                                            {doc.status === 'failed' && (
+                                                                <span className="inline-flex items-center gap-1 text-sm text-red-500" title={doc.error}>
+                                                                    <AlertCircle className="w-4 h-4" />
+                                                                    Processing failed
+                                                                </span>
+                                                            )}
                                                         </div>
                                                         <div className="flex items-center gap-2">
                                                             <button
@@ -644,7 +723,7 @@ export const ProjectDetails: React.FC = () => {
                                                         ref={fileInputRef}
                                                         className="hidden"
                                                         onChange={handleFileChange}
-                                                        accept=".pdf,.txt,.docx,.md"
+                                                        accept=".pdf,.txt,.docx,.pptx,.md,.html"
                                                     />
                                                     <Button onClick={handleAddDocumentClick} disabled={uploading}>
                                                         {uploading ? <Loader2 className="w-4 h-4 animate-spin mr-2" /> : <Plus className="w-4 h-4 mr-2" />}
@@ -699,6 +778,18 @@ export const ProjectDetails: React.FC = () => {
                                         </Button>
                                     </div>
                                     <div className="flex-1 overflow-y-auto p-4 space-y-4">
+                                        {hasEarlierChat && (
+                                            <div className="flex justify-center">
+                                                <Button
+                                                    variant="ghost"
+                                                    size="sm"
+                                                    onClick={loadEarlierChat}
+                                                    disabled={loadingEarlierChat}
+                                                >
+                                                    {loadingEarlierChat ? 'Loading...' : 'Load earlier messages'}
+                                                </Button>
+                                            </div>
+                                        )}
                                         {messages.length === 0 && (
                                             <div className="text-center text-gray-500 mt-10">
                                                 Ask a question about your documents to get started!